@@ -0,0 +1,145 @@
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+def members_checksum(members: list) -> str:
+    """计算地址组成员列表的校验和（与顺序无关）"""
+    names = sorted(member.get("name") or "" for member in members)
+    return hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()
+
+
+class AddressGroupCache:
+    """
+    地址组成员与 PROXY_* 地址对象的进程内写穿缓存
+
+    - 本进程的写操作直接更新缓存，不需要重新下载整个地址组
+    - 缓存条目超过 ttl 秒后视为过期，下次读取时重新获取，
+      并通过 FortiOS 配置版本号（revision）或成员校验和判断防火墙上是否发生了外部变更
+    """
+
+    MAX_PROBE_BACKOFF = 16  # 版本号核对连续失败后，最多连续跳过的核对次数
+
+    def __init__(self, ttl: float = 30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._members: Optional[list] = None
+        self._revision: Optional[str] = None
+        self._checksum: Optional[str] = None
+        self._validated_at = 0.0
+        self._objects: Dict[str, str] = {}  # PROXY_* 地址对象名称 -> IP
+        self._probe_backoff = 0
+        self._probe_skip = 0
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0  # 过期后重新获取的次数
+        self.external_changes = 0  # 重新获取时发现防火墙上的成员被外部修改的次数
+        self.stale_writes_avoided = 0  # 写入地址组前核对版本号发现缓存已过时的次数
+        self.probes_skipped = 0  # 因核对接连失败而直接重新获取的次数
+        self.object_hits = 0
+        self.object_misses = 0
+
+    def get_members(self, validate: Optional[Callable[[str], bool]] = None) -> Optional[list]:
+        """
+        返回缓存的成员列表副本；未缓存、已过期、配置版本号未知或 validate(版本号) 判定已过时返回 None。
+        只有真正返回缓存内容时才计一次命中。版本号核对失败后的若干次读取直接视为未命中（次数逐次加倍），
+        避免本进程之外的写入（例如创建地址对象）持续改变版本号时每次都白白多一次核对请求
+        """
+        with self._lock:
+            if (self._members is None or self._revision is None
+                    or time.monotonic() - self._validated_at > self.ttl):
+                self.misses += 1
+                return None
+            if self._probe_skip > 0:
+                self._probe_skip -= 1
+                self.misses += 1
+                self.probes_skipped += 1
+                return None
+            members, revision = list(self._members), self._revision
+        # 核对版本号需要请求防火墙，不持有锁
+        if validate is not None and not validate(revision):
+            with self._lock:
+                self.misses += 1
+                self.stale_writes_avoided += 1
+                self._validated_at = 0.0
+                self._probe_backoff = min(max(1, self._probe_backoff * 2), self.MAX_PROBE_BACKOFF)
+                self._probe_skip = self._probe_backoff
+            return None
+        with self._lock:
+            self.hits += 1
+            self._probe_backoff = 0
+        return members
+
+    def store_members(self, members: list, revision: Optional[str] = None):
+        """保存从防火墙获取到的成员列表，并记录是否发生了外部变更"""
+        checksum = members_checksum(members)
+        with self._lock:
+            if self._members is not None:
+                self.revalidations += 1
+                if revision is not None and revision == self._revision:
+                    changed = False  # 配置版本号未变，无需比较成员
+                else:
+                    changed = checksum != self._checksum
+                if changed:
+                    self.external_changes += 1
+            self._members = list(members)
+            self._revision = revision
+            self._checksum = checksum
+            self._validated_at = time.monotonic()
+
+    def apply_write(self, members: list, revision: Optional[str] = None):
+        """
+        本进程成功写入地址组后更新缓存，revision 为写入响应中的配置版本号。
+        不刷新校验时间，保证缓存仍会按 ttl 周期性地与防火墙核对。
+        """
+        with self._lock:
+            if self._members is None:
+                return
+            self._members = list(members)
+            self._checksum = members_checksum(members)
+            self._revision = revision  # 版本号未知（None）时下次写入前重新获取
+
+    def invalidate(self):
+        """丢弃缓存的成员列表（例如写入失败时，本地状态可能已与防火墙不一致）"""
+        with self._lock:
+            self._members = None
+            self._revision = None
+            self._checksum = None
+
+    def get_object_ip(self, name: str) -> Optional[str]:
+        """查询已缓存的 PROXY_* 地址对象对应的IP"""
+        with self._lock:
+            ip = self._objects.get(name)
+            if ip is None:
+                self.object_misses += 1
+            else:
+                self.object_hits += 1
+            return ip
+
+    def put_object(self, name: str, ip: str):
+        with self._lock:
+            self._objects[name] = ip
+
+    def remove_object(self, name: str):
+        with self._lock:
+            self._objects.pop(name, None)
+
+    def stats(self) -> dict:
+        """缓存统计信息（用于 /health）"""
+        with self._lock:
+            return {
+                "ttl": self.ttl,
+                "members_cached": self._members is not None,
+                "member_count": len(self._members) if self._members is not None else None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "external_changes": self.external_changes,
+                "stale_writes_avoided": self.stale_writes_avoided,
+                "probes_skipped": self.probes_skipped,
+                "objects_cached": len(self._objects),
+                "object_hits": self.object_hits,
+                "object_misses": self.object_misses
+            }
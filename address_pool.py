@@ -0,0 +1,76 @@
+import threading
+from collections import deque
+from typing import Optional
+
+
+class AddressObjectPool:
+    """
+    预先创建的空闲 PROXY_* 地址对象池
+
+    空闲对象指向占位地址且不在地址组中。新连接直接领取一个并改写其地址，
+    到期的对象改回占位地址后放回池中，而不是删除后再重新创建。
+    空闲数量低于 low_water 时，由后台任务补充到 size。
+    """
+
+    def __init__(self, size: int, low_water: int):
+        self.size = size
+        self.low_water = min(low_water, size)
+        self._idle: deque = deque()
+        self._lock = threading.Lock()
+        # 统计信息
+        self.claimed = 0
+        self.misses = 0  # 池为空时的领取次数
+        self.recycled = 0
+        self.created = 0
+
+    def __len__(self) -> int:
+        return len(self._idle)
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return name in self._idle
+
+    def claim(self) -> Optional[str]:
+        """领取一个空闲对象，池为空时返回 None"""
+        with self._lock:
+            if not self._idle:
+                self.misses += 1
+                return None
+            self.claimed += 1
+            return self._idle.popleft()
+
+    def add(self, name: str, recycled: bool = False) -> bool:
+        """放入一个空闲对象；池已满时返回 False（调用方应删除该对象）"""
+        with self._lock:
+            if len(self._idle) >= self.size:
+                return False
+            self._idle.append(name)
+            if recycled:
+                self.recycled += 1
+            else:
+                self.created += 1
+            return True
+
+    def room(self) -> int:
+        """池中还能放入的对象数"""
+        with self._lock:
+            return max(0, self.size - len(self._idle))
+
+    def deficit(self) -> int:
+        """低于低水位时需要补充的对象数，否则为 0"""
+        with self._lock:
+            if len(self._idle) >= self.low_water:
+                return 0
+            return self.size - len(self._idle)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "low_water": self.low_water,
+                "idle": len(self._idle),
+                "claimed": self.claimed,
+                "misses": self.misses,
+                "recycled": self.recycled,
+                "created": self.created
+            }
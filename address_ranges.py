@@ -0,0 +1,453 @@
+import bisect
+import ipaddress
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MAX_LOADED_RANGE = 1 << 16  # 启动同步时载入的单个区间最多包含的IP数，更大的区间不会是按客户端合并出来的
+
+
+class AddressRangeIndex:
+    """
+    活动租约IP（IPv4 整数）的区间索引：每段连续的IP对应防火墙上的一个 iprange 地址对象
+
+    区间按起始地址排序保存（起始地址列表 + 起始地址 -> [结束地址, 对象名称]），
+    加入或移除一个IP时只改动相邻的一两个区间：延长、缩短、合并或拆分。
+    合并和拆分时较长的一段保留原有名称，只有较短一段的IP需要改名（见 relabels）。
+
+    begin() 之后的修改记录在撤销日志中，rollback() 可整体撤销，diff() 给出相对 begin() 时的
+    新建 / 修改 / 删除的对象。不是线程安全的，由调用方加锁。
+    """
+
+    def __init__(self, name_factory: Callable[[], str]):
+        self.name_factory = name_factory
+        self._starts: List[int] = []
+        self._runs: Dict[int, Tuple[int, str]] = {}  # 起始地址 -> (结束地址, 名称)
+        self._by_name: Dict[str, int] = {}  # 名称 -> 起始地址
+        self._undo: List[Tuple[int, Optional[Tuple[int, str]]]] = []
+        self._touched: Dict[str, Optional[Tuple[int, int]]] = {}  # 名称 -> begin() 时的区间（新建的为 None）
+        self.relabels: List[Tuple[int, str]] = []  # begin() 以来改名的 (IP, 新名称)
+        self.addresses = 0  # 区间覆盖的IP总数
+
+    def __len__(self) -> int:
+        return len(self._runs)
+
+    def __contains__(self, ip: int) -> bool:
+        return self.find(ip) is not None
+
+    def find(self, ip: int) -> Optional[Tuple[int, int, str]]:
+        """包含该IP的区间 (起始, 结束, 名称)"""
+        i = bisect.bisect_right(self._starts, ip) - 1
+        if i < 0:
+            return None
+        start = self._starts[i]
+        end, name = self._runs[start]
+        return (start, end, name) if ip <= end else None
+
+    def runs(self) -> List[Tuple[int, int, str]]:
+        return [(start, *self._runs[start]) for start in self._starts]
+
+    def _write(self, start: int, value: Optional[Tuple[int, str]]):
+        """设置或删除以 start 开始的区间，记录撤销信息和涉及的对象"""
+        previous = self._runs.get(start)
+        self._undo.append((start, previous))
+        if previous is not None:
+            self._touched.setdefault(previous[1], (start, previous[0]))
+            self._by_name.pop(previous[1], None)
+            self.addresses -= previous[0] - start + 1
+        if value is not None:
+            self._touched.setdefault(value[1], None)
+            self._by_name[value[1]] = start
+            self.addresses += value[0] - start + 1
+        self._restore(start, value)
+
+    def _restore(self, start: int, value: Optional[Tuple[int, str]]):
+        present = start in self._runs
+        if value is None:
+            if present:
+                del self._runs[start]
+                del self._starts[bisect.bisect_left(self._starts, start)]
+        else:
+            self._runs[start] = value
+            if not present:
+                bisect.insort(self._starts, start)
+
+    def _relabel(self, first: int, last: int, name: str):
+        self.relabels.extend((ip, name) for ip in range(first, last + 1))
+
+    def load(self, start: int, end: int, name: str) -> bool:
+        """载入防火墙上已有的区间（启动同步），与已有区间重叠时返回 False"""
+        i = bisect.bisect_right(self._starts, end) - 1
+        if i >= 0 and self._runs[self._starts[i]][0] >= start:
+            return False
+        self._write(start, (end, name))
+        return True
+
+    def add(self, ip: int) -> bool:
+        """加入一个IP，已被覆盖时返回 False"""
+        if self.find(ip) is not None:
+            return False
+        left = self.find(ip - 1)
+        right_value = self._runs.get(ip + 1)
+        if left is not None and right_value is not None:
+            # 与两侧区间合并：较长的一段保留名称
+            left_start, left_end, left_name = left
+            right_end, right_name = right_value
+            self._write(left_start, None)
+            self._write(ip + 1, None)
+            if left_end - left_start >= right_end - ip - 1:
+                name = left_name
+                self._relabel(ip + 1, right_end, name)
+            else:
+                name = right_name
+                self._relabel(left_start, left_end, name)
+            self._write(left_start, (right_end, name))
+        elif left is not None:
+            name = left[2]
+            self._write(left[0], (ip, name))
+        elif right_value is not None:
+            name = right_value[1]
+            self._write(ip + 1, None)
+            self._write(ip, (right_value[0], name))
+        else:
+            name = self.name_factory()
+            self._write(ip, (ip, name))
+        self.relabels.append((ip, name))
+        return True
+
+    def remove(self, ip: int) -> bool:
+        """移除一个IP，不在任何区间中时返回 False"""
+        run = self.find(ip)
+        if run is None:
+            return False
+        start, end, name = run
+        self._write(start, None)
+        if start == end:
+            return True
+        if ip == start:
+            self._write(ip + 1, (end, name))
+        elif ip == end:
+            self._write(start, (ip - 1, name))
+        else:
+            # 从中间拆分：较长的一段保留名称，较短的一段新建对象
+            new_name = self.name_factory()
+            if ip - start >= end - ip:
+                self._write(start, (ip - 1, name))
+                self._write(ip + 1, (end, new_name))
+                self._relabel(ip + 1, end, new_name)
+            else:
+                self._write(start, (ip - 1, new_name))
+                self._write(ip + 1, (end, name))
+                self._relabel(start, ip - 1, new_name)
+        return True
+
+    def begin(self):
+        self._undo.clear()
+        self._touched.clear()
+        self.relabels = []
+
+    def mark(self) -> Tuple[int, int]:
+        """当前的撤销位置，rollback(mark) 只撤销此后的修改（例如批次中出错的单个操作）"""
+        return len(self._undo), len(self.relabels)
+
+    def rollback(self, mark: Optional[Tuple[int, int]] = None):
+        """撤销 begin()（或 mark() 的位置）以来的修改"""
+        undo_to, relabels_to = mark or (0, 0)
+        while len(self._undo) > undo_to:
+            start, previous = self._undo.pop()
+            current = self._runs.get(start)
+            if current is not None:
+                self._by_name.pop(current[1], None)
+                self.addresses -= current[0] - start + 1
+            if previous is not None:
+                self._by_name[previous[1]] = start
+                self.addresses += previous[0] - start + 1
+            self._restore(start, previous)
+        if mark is None:
+            self._touched.clear()
+        del self.relabels[relabels_to:]
+
+    def originals(self) -> Dict[str, Tuple[int, int]]:
+        """begin() 之后改动过的已有对象在 begin() 时的区间"""
+        return {name: run for name, run in self._touched.items() if run is not None}
+
+    def diff(self) -> Tuple[Dict[str, Tuple[int, int]], Dict[str, Tuple[int, int]], Dict[str, Tuple[int, int]]]:
+        """相对 begin() 的变化：(新建 名称 -> 区间, 修改 名称 -> 新区间, 删除 名称 -> 原区间)"""
+        created, updated, deleted = {}, {}, {}
+        for name, original in self._touched.items():
+            start = self._by_name.get(name)
+            current = (start, self._runs[start][0]) if start is not None else None
+            if original is None and current is not None:
+                created[name] = current
+            elif original is not None and current is None:
+                deleted[name] = original
+            elif original is not None and current != original:
+                updated[name] = current
+        return created, updated, deleted
+
+
+class _RangeBatch:
+    def __init__(self):
+        self.opened_at = time.monotonic()
+        self.ops: List[Tuple[str, int, Future]] = []  # ("add" / "remove", IP, Future)
+
+
+def ip_to_int(ip: str) -> int:
+    """IPv4 地址 -> 整数；不是 IPv4 地址时抛出 ValueError（区间聚合只支持 IPv4）"""
+    return int(ipaddress.IPv4Address(ip))
+
+
+def is_ipv4(ip: str) -> bool:
+    try:
+        ipaddress.IPv4Address(ip)
+        return True
+    except ValueError:
+        return False
+
+
+def int_to_ip(value: int) -> str:
+    return str(ipaddress.IPv4Address(value))
+
+
+class RangeCommitEngine:
+    """
+    地址聚合模式下的提交引擎
+
+    与地址组批量提交引擎一样在一个时间窗口内收集加入/移除的IP，合并后一次性改动区间索引，
+    再按差异操作防火墙：新建区间对象 -> 加入地址组 -> 修改区间 -> 移出地址组 -> 删除对象。
+    这个顺序保证过程中仍应放行的IP始终被覆盖；任何一步失败时撤销已完成的步骤并回滚索引。
+    地址组的改动经由地址组批量提交引擎，防火墙写入次数与变化的区间数有关，而不是与用户数有关。
+    """
+
+    def __init__(self, client_getter: Callable[[], object], group_commit, name_factory: Callable[[], str],
+                 window: float = 0.2, max_batch: int = 500, max_workers: int = 8,
+                 on_relabel: Optional[Callable[[List[Tuple[str, str]]], None]] = None):
+        self.client_getter = client_getter  # 返回当前的 FortigateAPI 实例（可能为 None）
+        self.group_commit = group_commit
+        self.window = window
+        self.max_batch = max_batch
+        self.max_workers = max_workers
+        self.on_relabel = on_relabel  # 提交成功后通知改名的 [(IP, 新名称)]
+        self.index = AddressRangeIndex(name_factory)
+        self._lock = threading.Lock()  # 保护索引（刷新线程与启动同步）
+        self._batches: List[_RangeBatch] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # 统计信息
+        self.flush_count = 0
+        self.failed_flushes = 0
+
+    def start(self):
+        """启动后台刷新线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="range-commit", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程，剩余的批次会在退出前刷新"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def submit_add(self, ip: str) -> Future:
+        """加入一个IP，结果为覆盖它的地址对象名称（失败时为 None）"""
+        return self._submit("add", ip)
+
+    def submit_remove(self, ip: str) -> Future:
+        """移除一个IP，结果为是否成功"""
+        return self._submit("remove", ip)
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return sum(len(batch.ops) for batch in self._batches)
+
+    def _submit(self, op: str, ip: str) -> Future:
+        future: Future = Future()
+        try:
+            value = ip_to_int(ip)
+        except ValueError:
+            # 不能进入批次：同一批次的操作一起提交，一个无效的IP不应让其他IP一起失败
+            logger.error(f"地址区间只支持 IPv4，忽略 {ip}")
+            future.set_result(None if op == "add" else False)
+            return future
+        with self._cond:
+            batch = self._batches[-1] if self._batches else None
+            if batch is None or len(batch.ops) >= self.max_batch:
+                batch = _RangeBatch()
+                self._batches.append(batch)
+            batch.ops.append((op, value, future))
+            self._cond.notify_all()
+        return future
+
+    def load(self, runs: Iterable[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+        """用防火墙上已有的区间对象 (名称, 起始IP, 结束IP) 替换索引，返回因重叠而未载入的对象"""
+        rejected = []
+        with self._lock:
+            index = AddressRangeIndex(self.index.name_factory)
+            for name, start_ip, end_ip in runs:
+                if not index.load(ip_to_int(start_ip), ip_to_int(end_ip), name):
+                    rejected.append((name, start_ip, end_ip))
+            index.begin()
+            self.index = index
+        return rejected
+
+    def stats(self) -> dict:
+        # 不加锁：刷新期间持有锁的时间包含防火墙调用，健康检查不应等待
+        return {
+            "runs": len(self.index),
+            "addresses": self.index.addresses,
+            "pending": self.pending_count(),
+            "flushes": self.flush_count,
+            "failed_flushes": self.failed_flushes
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._batches:
+                        remaining = self._batches[0].opened_at + self.window - time.monotonic()
+                        if not self._running or remaining <= 0 or len(self._batches) > 1:
+                            break
+                        self._cond.wait(remaining)
+                    elif not self._running:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._batches.pop(0)
+
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.error(f"地址区间提交异常: {str(e)}")
+                for op, _, future in batch.ops:
+                    if not future.done():
+                        future.set_result(None if op == "add" else False)
+
+    def _flush(self, batch: _RangeBatch):
+        client = self.client_getter()
+        with self._lock:
+            index = self.index
+            index.begin()
+            failed = set()
+            for i, (op, ip, _) in enumerate(batch.ops):
+                mark = index.mark()
+                try:
+                    if op == "add":
+                        index.add(ip)
+                    else:
+                        index.remove(ip)
+                except Exception as e:
+                    # 只撤销这一个操作，批次中的其他操作照常提交
+                    logger.error(f"地址区间操作 {op} {int_to_ip(ip)} 异常: {str(e)}")
+                    index.rollback(mark)
+                    failed.add(i)
+            created, updated, deleted = index.diff()
+            if not created and not updated and not deleted:
+                success = True
+            elif client is None:
+                logger.error("地址区间提交失败: Fortigate连接不可用")
+                success = False
+            else:
+                self.flush_count += 1
+                success = self._apply(client, created, updated, deleted)
+            if success:
+                relabels = [(int_to_ip(ip), name) for ip, name in index.relabels]
+                results = [index.find(ip) for _, ip, _ in batch.ops]
+                index.begin()
+            else:
+                self.failed_flushes += 1
+                index.rollback()
+
+        if success:
+            logger.info(f"地址区间提交完成: 新建 {len(created)}，修改 {len(updated)}，删除 {len(deleted)}")
+            if self.on_relabel and relabels:
+                self.on_relabel(relabels)
+            for i, ((op, _, future), run) in enumerate(zip(batch.ops, results)):
+                if i in failed:
+                    future.set_result(None if op == "add" else False)
+                elif op == "add":
+                    future.set_result(run[2] if run is not None else None)
+                else:
+                    future.set_result(True)
+        else:
+            for op, _, future in batch.ops:
+                future.set_result(None if op == "add" else False)
+
+    def _parallel(self, fn: Callable, items: Dict[str, Tuple[int, int]]) -> Dict[str, bool]:
+        if not items:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(items))) as executor:
+            futures = {name: executor.submit(fn, name, int_to_ip(start), int_to_ip(end))
+                       for name, (start, end) in items.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def _group(self, submit: Callable[[str], Future], names: Iterable[str]) -> Dict[str, bool]:
+        futures = {name: submit(name) for name in names}
+        wait(futures.values())
+        return {name: future.result() for name, future in futures.items()}
+
+    def _apply(self, client, created: Dict[str, Tuple[int, int]], updated: Dict[str, Tuple[int, int]],
+               deleted: Dict[str, Tuple[int, int]]) -> bool:
+        """按差异修改防火墙，失败时撤销已完成的步骤"""
+        originals = self.index.originals()
+        created_ok: Set[str] = set()
+        grouped: Set[str] = set()
+        updated_ok: Set[str] = set()
+        try:
+            results = self._parallel(client.create_range_object, created)
+            created_ok = {name for name, ok in results.items() if ok}
+            if len(created_ok) < len(created):
+                return self._undo(client, created_ok, grouped, updated_ok, originals)
+
+            results = self._group(self.group_commit.submit_add, created)
+            grouped = {name for name, ok in results.items() if ok}
+            if len(grouped) < len(created):
+                return self._undo(client, created_ok, grouped, updated_ok, originals)
+
+            results = self._parallel(client.update_range_object, updated)
+            updated_ok = {name for name, ok in results.items() if ok}
+            if len(updated_ok) < len(updated):
+                return self._undo(client, created_ok, grouped, updated_ok, originals)
+
+            results = self._group(self.group_commit.submit_remove, deleted)
+            if not all(results.values()):
+                # 已移出的对象重新加入，使地址组与回滚后的索引一致
+                self._group(self.group_commit.submit_add, [name for name, ok in results.items() if ok])
+                return self._undo(client, created_ok, grouped, updated_ok, originals)
+        except Exception as e:
+            logger.error(f"地址区间提交异常: {str(e)}")
+            return self._undo(client, created_ok, grouped, updated_ok, originals)
+
+        # 已移出地址组的对象删除失败只留下不再使用的对象，不影响放行范围
+        for name, ok in client.delete_address_objects(list(deleted)).items():
+            if not ok:
+                logger.warning(f"删除地址区间对象 {name} 失败")
+        return True
+
+    def _undo(self, client, created_ok: Set[str], grouped: Set[str], updated_ok: Set[str],
+              originals: Dict[str, Tuple[int, int]]) -> bool:
+        """撤销一次失败的提交中已经完成的步骤（尽力而为），返回 False"""
+        logger.error("地址区间提交失败，撤销已完成的修改。")
+        try:
+            reverted = self._parallel(client.update_range_object, {name: originals[name] for name in updated_ok})
+            if grouped:
+                self._group(self.group_commit.submit_remove, grouped)
+            if created_ok:
+                client.delete_address_objects(list(created_ok))
+            for name, ok in reverted.items():
+                if not ok:
+                    logger.error(f"恢复地址区间对象 {name} 失败，防火墙上的范围可能与本地记录不一致")
+        except Exception as e:
+            logger.error(f"撤销地址区间修改异常: {str(e)}")
+        return False
@@ -1,25 +1,53 @@
 import asyncio
+import hmac
+import ipaddress
+import json
 import uuid
-import threading
+import socket
 import time
 import os
 import psutil
-from datetime import datetime, timedelta
-from typing import Dict, Optional
-import queue
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, wait
 from contextlib import asynccontextmanager
 
 import requests
-from fastapi import FastAPI, Request, HTTPException, status
-from fastapi.responses import JSONResponse, HTMLResponse
+import requests.adapters
+import httpx
+from fastapi import Depends, FastAPI, Request, HTTPException, status
+from fastapi.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel
 import uvicorn
+try:
+    import ijson  # 可选依赖：用于流式解析大的API响应
+except ImportError:
+    ijson = None
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.date import DateTrigger
 from datetime import timezone
 
+from address_cache import AddressGroupCache
+from group_commit import GroupCommitEngine
+from lease_store import LeaseJournal
+from lease_table import LeaseTable
+from lease_timer import LeaseTimerWheel
+from cleanup_pool import CleanupDispatcher
+from address_pool import AddressObjectPool
+from address_ranges import MAX_LOADED_RANGE, RangeCommitEngine, int_to_ip, ip_to_int, is_ipv4
+from metrics import Registry, instrument
+from event_hub import EventHub, HEARTBEAT, format_event
+from static_cache import StaticAsset
+from shared_state import SqliteStateBackend, SharedLeaseMap
+from rate_limit import TokenBucketLimiter, SingleFlight
+from routing import RouteTable
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, RETRY_STATUSES
+from operations import Operation, OperationTracker
+from traffic import RENEW, TrafficRecorder, TrafficRecorderMiddleware
+from tracing import Tracer, TracingMiddleware, Trace, activate, current_trace, span, traced
+
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
 
@@ -42,6 +70,63 @@ except ImportError:
     SERVER_PORT = 8000
     TIMEZONE = "UTC"  # 默认时区
 
+# 可选的高级配置（旧版本的 config.py 中可能没有这些项，缺失时使用默认值）
+try:
+    import config as _config
+except ImportError:
+    _config = None
+
+GROUP_COMMIT_WINDOW = getattr(_config, "GROUP_COMMIT_WINDOW", 0.2)  # 地址组批量提交窗口（秒）
+GROUP_COMMIT_MAX_BATCH = getattr(_config, "GROUP_COMMIT_MAX_BATCH", 500)  # 单次提交的最大操作数
+GROUP_CACHE_TTL = getattr(_config, "GROUP_CACHE_TTL", 30)  # 地址组缓存与防火墙核对的周期（秒），0 表示不缓存
+SYNC_PAGE_SIZE = getattr(_config, "SYNC_PAGE_SIZE", 500)  # 启动同步时分页获取地址对象的每页数量
+READY_WAIT_TIMEOUT = getattr(_config, "READY_WAIT_TIMEOUT", 30)  # 启动同步期间请求等待就绪的最长时间（秒）
+LEASE_DB_PATH = getattr(_config, "LEASE_DB_PATH", "leases.db")  # 租约日志文件（相对于程序目录），为空则不持久化
+LEASE_COMPACT_INTERVAL = getattr(_config, "LEASE_COMPACT_INTERVAL", 600)  # 租约日志压缩检查间隔（秒）
+LEASE_TIMER_TICK = getattr(_config, "LEASE_TIMER_TICK", 1.0)  # 租约时间轮的精度（秒）
+LEASE_TIMER_SLOTS = getattr(_config, "LEASE_TIMER_SLOTS", 3600)  # 租约时间轮的槽数
+CLEANUP_WORKERS = getattr(_config, "CLEANUP_WORKERS", 4)  # 清理工作线程数
+CLEANUP_BATCH_SIZE = getattr(_config, "CLEANUP_BATCH_SIZE", 200)  # 每个清理工作线程一次批量处理的最大租约数
+FORTIGATE_USE_TRANSACTIONS = getattr(_config, "FORTIGATE_USE_TRANSACTIONS", True)  # 批量删除时尝试使用 FortiOS 配置事务
+ADDRESS_POOL_SIZE = getattr(_config, "ADDRESS_POOL_SIZE", 0)  # 预创建地址对象池大小，0 表示不启用
+ADDRESS_POOL_LOW_WATER = getattr(_config, "ADDRESS_POOL_LOW_WATER", ADDRESS_POOL_SIZE // 2)  # 低于该数量时补充
+ADDRESS_POOL_PLACEHOLDER = getattr(_config, "ADDRESS_POOL_PLACEHOLDER", "0.0.0.0")  # 空闲对象指向的占位地址
+ADDRESS_POOL_FILL_INTERVAL = getattr(_config, "ADDRESS_POOL_FILL_INTERVAL", 5)  # 补充检查间隔（秒）
+FORTIGATE_SCHEME = getattr(_config, "FORTIGATE_SCHEME", "https")  # 防火墙API协议（模拟服务器可用 http）
+FORTIGATE_TIMEOUT = getattr(_config, "FORTIGATE_TIMEOUT", 10)  # 单次防火墙API调用超时（秒）
+FORTIGATE_CONNECT_TIMEOUT = getattr(_config, "FORTIGATE_CONNECT_TIMEOUT", 3)  # 建立连接的超时（秒）
+FORTIGATE_ENDPOINT_TIMEOUTS = getattr(_config, "FORTIGATE_ENDPOINT_TIMEOUTS", {"status": 5})  # 按接口类别覆盖超时
+FORTIGATE_RETRIES = getattr(_config, "FORTIGATE_RETRIES", 2)  # 幂等请求（GET/PUT/DELETE）失败后的重试次数
+FORTIGATE_RETRY_BASE_DELAY = getattr(_config, "FORTIGATE_RETRY_BASE_DELAY", 0.2)  # 重试退避的基础间隔（秒）
+FORTIGATE_RETRY_MAX_DELAY = getattr(_config, "FORTIGATE_RETRY_MAX_DELAY", 2.0)  # 重试退避的最长间隔（秒）
+BREAKER_FAILURE_THRESHOLD = getattr(_config, "BREAKER_FAILURE_THRESHOLD", 5)  # 连续失败多少次后熔断
+BREAKER_RESET_TIMEOUT = getattr(_config, "BREAKER_RESET_TIMEOUT", 30)  # 熔断后多久放行一次探测请求（秒）
+FORTIGATE_POOL_SIZE = getattr(_config, "FORTIGATE_POOL_SIZE", 10)  # 异步客户端长连接池大小
+FORTIGATE_MAX_CONCURRENCY = getattr(_config, "FORTIGATE_MAX_CONCURRENCY", 8)  # 同时发往防火墙的请求上限
+EVENTS_HEARTBEAT_INTERVAL = getattr(_config, "EVENTS_HEARTBEAT_INTERVAL", 15)  # 推送连接的心跳/健康快照间隔（秒）
+EVENTS_RENEW_INTERVAL = getattr(_config, "EVENTS_RENEW_INTERVAL", 300)  # 推送连接打开期间自动续期的间隔（秒）
+EVENTS_QUEUE_SIZE = getattr(_config, "EVENTS_QUEUE_SIZE", 16)  # 每个推送连接最多缓存的消息数
+SHARED_STATE_PATH = getattr(_config, "SHARED_STATE_PATH", None)  # 多 worker 共享状态文件（相对于程序目录），为空则单进程运行
+SERVER_WORKERS = getattr(_config, "SERVER_WORKERS", 1)  # uvicorn worker 进程数（大于1时需要 SHARED_STATE_PATH）
+LEADER_LEASE_TTL = getattr(_config, "LEADER_LEASE_TTL", 10)  # 主节点租约有效期（秒）
+SHARED_STATE_POLL_INTERVAL = getattr(_config, "SHARED_STATE_POLL_INTERVAL", 0.05)  # 意图队列与租约变更的轮询间隔（秒）
+SHARED_INTENT_TIMEOUT = getattr(_config, "SHARED_INTENT_TIMEOUT", 30)  # 非主节点等待主节点处理的最长时间（秒）
+CONNECT_RATE_LIMIT = getattr(_config, "CONNECT_RATE_LIMIT", 1.0)  # 每个IP每秒允许的 /connect 请求数，0 表示不限流
+CONNECT_RATE_BURST = getattr(_config, "CONNECT_RATE_BURST", 10)  # 每个IP允许的突发请求数
+RENEW_DEDUPE_SLACK = getattr(_config, "RENEW_DEDUPE_SLACK", 10)  # 剩余时间与完整租期相差不超过该秒数时续期不再重置计时
+CONNECT_ASYNC = getattr(_config, "CONNECT_ASYNC", False)  # 新连接立即返回 202 和操作ID，防火墙操作在后台执行
+OPERATION_MAX_PENDING = getattr(_config, "OPERATION_MAX_PENDING", 1000)  # 后台进行中的连接操作上限，超出返回503
+OPERATION_RETENTION = getattr(_config, "OPERATION_RETENTION", 300)  # 已完成的操作保留多久供查询（秒）
+RECONCILE_INTERVAL = getattr(_config, "RECONCILE_INTERVAL", 300)  # 本地租约与防火墙核对的间隔（秒），0 表示不核对
+RECONCILE_MAX_CHANGES = getattr(_config, "RECONCILE_MAX_CHANGES", 100)  # 每个目标每轮最多修复的偏差数
+TRACE_SAMPLE_RATE = getattr(_config, "TRACE_SAMPLE_RATE", 0.01)  # 记录调用链的请求比例，0 表示不记录
+TRACE_KEEP_SLOWEST = getattr(_config, "TRACE_KEEP_SLOWEST", 20)  # 每种调用链保留的最慢记录数
+TRAFFIC_RECORD_PATH = getattr(_config, "TRAFFIC_RECORD_PATH", None)  # 连接/断开/状态请求的记录文件（每次会话一个文件），供 replay.py 重放
+ADMIN_API_TOKEN = getattr(_config, "ADMIN_API_TOKEN", None)  # 批量管理接口的令牌，为 None 时不开放管理接口
+ADMIN_BULK_MAX_IPS = getattr(_config, "ADMIN_BULK_MAX_IPS", 4096)  # 一次批量操作最多涉及的IP数
+ADDRESS_AGGREGATION = getattr(_config, "ADDRESS_AGGREGATION", False)  # 连续的客户端IP合并为一个 iprange 地址对象
+FIREWALL_TARGETS = getattr(_config, "FIREWALL_TARGETS", [])  # 按客户端子网路由到其他防火墙/地址组，未匹配的使用上面的默认配置
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -50,59 +135,358 @@ logger = logging.getLogger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动
-    await sync_from_fortigate() # 在启动时执行同步
+    # 启动（live 阶段）：先启动后台组件并开始提供服务，同步在后台进行，完成后进入 ready 阶段
+    global startup_phase, sync_task, event_task, election_task, reconcile_task
+    try:
+        index_page.load()
+    except FileNotFoundError:
+        logger.warning("前端页面 index.html 未找到。")
+    if ijson is None:
+        logger.warning("未安装 ijson，启动同步将整页解析防火墙的响应，地址对象很多时内存占用较高（pip install ijson）。")
+    if lease_journal:
+        lease_journal.start()
+        scheduler.add_job(
+            lease_journal.compact, "interval", seconds=LEASE_COMPACT_INTERVAL,
+            id="lease-journal-compact", name="Compact lease journal", replace_existing=True
+        )
+    if ADDRESS_POOL_SIZE > 0:
+        scheduler.add_job(
+            fill_address_pool, "interval", seconds=ADDRESS_POOL_FILL_INTERVAL,
+            id="address-pool-fill", name="Fill address object pool", replace_existing=True
+        )
     scheduler.start()
     logger.info("APScheduler scheduler started.")
-    cleanup_thread = threading.Thread(target=cleanup_expired_objects, daemon=True)
-    cleanup_thread.start()
-    logger.info("Cleanup thread started.")
+    if traffic_recorder:
+        # 会话头记下各目标的租约时长，重放时按加速比例缩短
+        traffic_recorder.metadata = {
+            "node": NODE_ID, "durations": {target.name: target.duration for target in targets.values()}
+        }
+        traffic_recorder.start()
+    if shared_state is None:
+        start_leader_components()
+    else:
+        # 多 worker 部署：先竞选一次，当选的 worker 负责到期清理和地址组提交，其余 worker 只处理请求
+        await try_acquire_leadership()
+        election_task = asyncio.create_task(run_leader_election())
+    startup_phase = "syncing"
+    sync_task = asyncio.create_task(run_startup_sync())
+    event_hub.bind(asyncio.get_running_loop())
+    event_task = asyncio.create_task(run_event_producer())
+    if RECONCILE_INTERVAL > 0:
+        reconcile_task = asyncio.create_task(run_reconciler())
     yield
     # 关闭
+    if sync_task and not sync_task.done():
+        sync_task.cancel()
+    if event_task:
+        event_task.cancel()
+    if reconcile_task:
+        reconcile_task.cancel()
+    connect_operations.cancel_all()
+    if election_task:
+        election_task.cancel()
+    for task in leader_tasks:
+        task.cancel()
+    if is_leader:
+        stop_leader_components()
     scheduler.shutdown()
     logger.info("APScheduler scheduler shut down.")
+    if shared_state is not None:
+        if is_leader:
+            shared_state.release_leadership(NODE_ID)
+        shared_state.close()
+    if lease_journal:
+        lease_journal.stop()
+    if traffic_recorder:
+        traffic_recorder.stop()
+    for target in targets.values():
+        if target.afortigate:
+            await target.afortigate.aclose()
 
 app = FastAPI(title="Fortigate Proxy Manager", version="1.0.0", lifespan=lifespan)
 
+# 热路径的采样调用链（/debug/traces），被采样的请求带有 Server-Timing 响应头
+tracer = Tracer(TRACE_SAMPLE_RATE, TRACE_KEEP_SLOWEST)
+app.add_middleware(TracingMiddleware, tracer=tracer, paths=("/connect", "/disconnect"))
+
 # 获取当前目录
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
+# 流量记录：连接/断开/状态请求的时间、IP、状态码和耗时，用 replay.py 按比例加速重放
+traffic_recorder = TrafficRecorder(os.path.join(current_dir, TRAFFIC_RECORD_PATH)) if TRAFFIC_RECORD_PATH else None
+if traffic_recorder:
+    app.add_middleware(TrafficRecorderMiddleware, recorder=traffic_recorder)
+
+# 前端页面：内存中的预压缩副本，文件修改后自动重新加载
+index_page = StaticAsset(os.path.join(current_dir, "index.html"))
+
+class FirewallTarget:
+    """
+    一个代理目标：防火墙 + 地址组 + 租约时长
+
+    每个目标有独立的防火墙客户端（连接池）、地址组缓存、批量提交引擎和地址对象池，
+    不同目标的同步、提交和清理互不等待。客户端按子网路由到目标（见 target_for）。
+    """
+
+    def __init__(self, name: str, host: str, api_token: str, group_name: str, duration: int,
+                 aggregate: bool = False):
+        self.name = name
+        self.host = host
+        self.api_token = api_token
+        self.group_name = group_name
+        self.duration = duration  # 租约时长（秒）
+        # 熔断器：同步与异步客户端共用，重新连接后保留状态
+        self.breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.fortigate = None  # FortigateAPI实例（同步，供清理线程与批量提交使用）
+        self.afortigate = None  # AsyncFortigateAPI实例（异步，供FastAPI端点使用）
+        # 地址组成员与 PROXY_* 地址对象的本地缓存
+        self.address_cache = AddressGroupCache(ttl=GROUP_CACHE_TTL)
+        # 预创建的空闲地址对象池（仅完整模式使用，聚合模式下不使用）
+        self.address_pool = (
+            AddressObjectPool(ADDRESS_POOL_SIZE, ADDRESS_POOL_LOW_WATER)
+            if ADDRESS_POOL_SIZE > 0 and not aggregate else None
+        )
+        # 地址组成员批量提交引擎，合并短时间内的增删操作
+        self.group_commit = GroupCommitEngine(
+            lambda: self.fortigate, group_name,
+            window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH,
+            cache=self.address_cache
+        )
+        # 地址聚合：连续的客户端IP由一个 iprange 对象覆盖，地址组成员数与区间数有关而不是与用户数有关
+        self.ranges = RangeCommitEngine(
+            lambda: self.fortigate, self.group_commit, lambda: f"PROXY_{uuid.uuid4()}",
+            window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX_BATCH, max_workers=FORTIGATE_MAX_CONCURRENCY,
+            on_relabel=lambda relabels: relabel_leases(relabels)
+        ) if aggregate else None
+
+    @property
+    def mode(self) -> str:
+        return self.fortigate.mode if self.fortigate else "unknown"
+
+    @property
+    def aggregating(self) -> bool:
+        """是否按区间管理地址对象（需要完整模式）"""
+        return self.ranges is not None and self.mode == "full"
+
+    def stats(self) -> dict:
+        return {
+            "host": self.host,
+            "address_group": self.group_name,
+            "duration": self.duration,
+            "connected": self.fortigate is not None,
+            "mode": self.mode,
+            "breaker": self.breaker.stats(),
+            "pending_group_changes": self.group_commit.pending_count(),
+            "cache": self.address_cache.stats(),
+            "address_pool": self.address_pool.stats() if self.address_pool is not None else None,
+            "ranges": self.ranges.stats() if self.ranges is not None else None
+        }
+
+
+def build_targets(specs: list) -> tuple:
+    """根据 FIREWALL_TARGETS 创建各个目标及子网路由表，返回 (名称 -> 目标, 路由表)；配置有误时抛出 ValueError"""
+    by_name = {default_target.name: default_target}
+    routes: RouteTable = RouteTable()
+    for spec in specs:
+        name = spec.get("name")
+        if not name or name in by_name:
+            raise ValueError(f"FIREWALL_TARGETS 中的目标名称为空或重复: {name!r}")
+        target = FirewallTarget(
+            name,
+            spec.get("host", FORTIGATE_IP),
+            spec.get("api_token", FORTIGATE_API_TOKEN),
+            spec.get("group", ADDRESS_GROUP_NAME),
+            spec.get("duration", TIMER_DURATION),
+            spec.get("aggregate", ADDRESS_AGGREGATION)
+        )
+        # 同一地址组由两个批量提交引擎各自读改写会互相覆盖
+        if any((t.host, t.group_name) == (target.host, target.group_name) for t in by_name.values()):
+            raise ValueError(f"目标 {name} 的地址组 {target.group_name}@{target.host} 已被其他目标使用")
+        if not spec.get("subnets"):
+            raise ValueError(f"目标 {name} 没有配置 subnets")
+        for subnet in spec["subnets"]:
+            routes.add(subnet, target)
+        by_name[name] = target
+    # 区间索引只保存在主节点进程内，非主节点无法据此修改区间
+    if shared_state is not None and any(t.ranges is not None for t in by_name.values()):
+        raise ValueError("地址聚合（ADDRESS_AGGREGATION / aggregate）暂不支持多 worker 部署")
+    return by_name, routes
+
+
+def target_for(client_ip: str) -> FirewallTarget:
+    """客户端IP对应的目标（最长前缀匹配，未匹配时为默认目标）"""
+    return route_table.lookup(client_ip) or default_target
+
+
+def ensure_available(target: FirewallTarget):
+    """目标的熔断器打开时直接返回503，不再排队等待过载的防火墙"""
+    if target.breaker.rejecting():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Fortigate暂时不可用，请稍后重试",
+            headers={"Retry-After": str(max(1, int(target.breaker.retry_after() + 0.999)))}
+        )
+
+
 # 全局变量
 # active_timers: Dict[str, threading.Timer] = {}  # 不再需要
-scheduler = BackgroundScheduler(timezone=TIMEZONE)
-address_objects: Dict[str, str] = {}  # IP -> 地址对象名称
-cleanup_queue = queue.Queue()  # 清理队列
-cleanup_futures: Dict[str, asyncio.Future] = {}  # IP -> Future对象，用于异步等待清理完成
-cleanup_lock = threading.Lock()  # 保证同时只处理一个清理任务
-fortigate = None  # FortigateAPI实例
+scheduler = BackgroundScheduler(timezone=TIMEZONE)  # 周期性维护任务（日志压缩等）
+# 多 worker 共享状态（租约表、选主、意图队列）；未配置时所有状态保存在本进程内
+shared_state = SqliteStateBackend(os.path.join(current_dir, SHARED_STATE_PATH)) if SHARED_STATE_PATH else None
+NODE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+is_leader = shared_state is None  # 单进程部署时本进程总是主节点
+election_task: Optional[asyncio.Task] = None  # 主节点竞选/续约任务
+leader_tasks: List[asyncio.Task] = []  # 仅主节点运行的后台任务（意图处理、租约变更跟踪）
+# 清理工作线程池：按IP分片并行处理，同一IP保持顺序，手动断开优先
+cleanup_pool = CleanupDispatcher(
+    lambda tasks: process_cleanup_batch(tasks), workers=CLEANUP_WORKERS, max_batch=CLEANUP_BATCH_SIZE,
+    abandon=lambda tasks: abandon_cleanup_tasks(tasks)
+)
+# 代理目标：默认目标使用 FORTIGATE_IP / ADDRESS_GROUP_NAME / TIMER_DURATION，其余按子网路由
+default_target = FirewallTarget(
+    "default", FORTIGATE_IP, FORTIGATE_API_TOKEN, ADDRESS_GROUP_NAME, TIMER_DURATION, ADDRESS_AGGREGATION
+)
+targets, route_table = build_targets(FIREWALL_TARGETS)
 start_time = datetime.now()  # 服务启动时间
 last_error = None  # 最后一次错误信息
+startup_phase = "starting"  # starting -> syncing（live，已可提供服务）-> ready（已完成同步）
+ready_event = asyncio.Event()  # 启动同步完成（无论成功与否）后置位
+sync_task: Optional[asyncio.Task] = None  # 后台启动同步任务
+sync_duration: Optional[float] = None  # 启动同步耗时（秒）
+# 租约状态与健康快照的推送中心（/events），由一个共享的后台任务定时产生心跳和快照
+event_hub = EventHub(queue_size=EVENTS_QUEUE_SIZE)
+event_task: Optional[asyncio.Task] = None
+reconcile_task: Optional[asyncio.Task] = None  # 本地租约与防火墙的定期核对（仅主节点执行）
+# 租约到期引擎（时间轮），到期的租约成批放入清理队列
+lease_timer = LeaseTimerWheel(lambda ips: enqueue_expired_leases(ips), tick=LEASE_TIMER_TICK, slots=LEASE_TIMER_SLOTS)
+# 租约表 IP -> 地址对象名称（带名称反向索引，按到期顺序的查询取自时间轮；多 worker 部署时保存在共享状态中）
+address_objects = SharedLeaseMap(shared_state) if shared_state is not None else LeaseTable(lease_timer)
+# 持久化的租约日志，重启后恢复租约的真实到期时间
+# 使用共享状态时租约已经持久化在共享状态中，不再需要单独的日志
+lease_journal = (
+    LeaseJournal(os.path.join(current_dir, LEASE_DB_PATH)) if LEASE_DB_PATH and shared_state is None else None
+)
+
+# /connect 的按IP限流，以及同一IP并发首次连接的合并
+connect_limiter = TokenBucketLimiter(CONNECT_RATE_LIMIT, CONNECT_RATE_BURST) if CONNECT_RATE_LIMIT > 0 else None
+connect_flight = SingleFlight()
+# 异步连接模式下在后台执行的连接操作（/operations/{id}）
+connect_operations = OperationTracker(
+    OPERATION_MAX_PENDING, OPERATION_RETENTION, on_finish=lambda operation: publish_operation(operation)
+)
+bulk_tasks: set = set()  # 批量管理操作中每个IP的任务（客户端提前断开时仍然执行完）
+
+# 运行指标（/metrics，Prometheus 文本格式）；计数按线程分片累加，热路径上不加锁
+metrics_registry = Registry()
+FORTIGATE_LATENCY = metrics_registry.histogram(
+    "fortigate_request_duration_seconds", "Latency of Fortigate API operations", ("operation",)
+)
+FORTIGATE_ERRORS = metrics_registry.counter(
+    "fortigate_request_errors_total", "Failed Fortigate API operations", ("operation",)
+)
+LEASE_EVENTS = metrics_registry.counter(
+    "proxy_lease_events_total", "Lease lifecycle events (connect, renew, disconnect, expire)", ("event",)
+)
+for _event in ("connect", "renew", "disconnect", "expire"):
+    LEASE_EVENTS.labels(_event)
+CONNECT_SHORTCUTS = metrics_registry.counter(
+    "proxy_connect_shortcuts_total",
+    "/connect requests answered without full work (rate_limited, renew_deduped, coalesced)", ("reason",)
+)
+for _reason in ("rate_limited", "renew_deduped", "coalesced"):
+    CONNECT_SHORTCUTS.labels(_reason)
+FORTIGATE_RETRIES_TOTAL = metrics_registry.counter(
+    "fortigate_request_retries_total", "Fortigate API requests retried after a transient failure"
+)
+RECONCILE_REPAIRS = metrics_registry.counter(
+    "proxy_reconcile_repairs_total", "Drift repaired by the reconciler (dropped, adopted, removed, deleted)", ("action",)
+)
+for _action in ("dropped", "adopted", "removed", "deleted"):
+    RECONCILE_REPAIRS.labels(_action)
+metrics_registry.gauge("proxy_active_leases", "Active proxy leases", lambda: len(address_objects))
+metrics_registry.gauge("proxy_cleanup_queue_depth", "Cleanup tasks waiting for a worker", lambda: cleanup_pool.qsize())
+metrics_registry.gauge("proxy_lease_timers", "Leases scheduled in the timer wheel", lambda: len(lease_timer))
+metrics_registry.gauge("proxy_lease_timer_lag_seconds", "Delay of the last timer wheel tick", lambda: lease_timer.lag)
+metrics_registry.gauge("proxy_group_commit_pending", "Address group changes waiting to be flushed",
+                       lambda: sum(t.group_commit.pending_count() for t in targets.values()))
+metrics_registry.gauge("fortigate_circuits_open", "Targets whose circuit breaker is not closed",
+                       lambda: sum(t.breaker.state != CircuitBreaker.CLOSED for t in targets.values()))
+metrics_registry.gauge("proxy_event_streams", "Open /events streams", lambda: len(event_hub))
+metrics_registry.gauge("proxy_pending_operations", "Asynchronous connects still running", lambda: len(connect_operations))
+metrics_registry.gauge("proxy_address_runs", "Range objects covering aggregated clients",
+                       lambda: sum(len(t.ranges.index) for t in targets.values() if t.ranges is not None))
+metrics_registry.gauge("proxy_address_pool_idle", "Idle objects in the address object pools",
+                       lambda: sum(len(t.address_pool) for t in targets.values()) if ADDRESS_POOL_SIZE > 0 else None)
+
+
+def fortigate_call(operation: str):
+    """记录一次防火墙API操作的耗时与失败次数，被采样的请求中同时记为一个阶段"""
+    record, trace = instrument(FORTIGATE_LATENCY, FORTIGATE_ERRORS, operation), traced(f"fortigate.{operation}")
+    return lambda func: trace(record(func))
+
+
+# 防火墙请求的重试策略（各目标共用），熔断器每个目标一个
+fortigate_retry = RetryPolicy(
+    FORTIGATE_RETRIES, FORTIGATE_RETRY_BASE_DELAY, FORTIGATE_RETRY_MAX_DELAY,
+    on_retry=lambda: FORTIGATE_RETRIES_TOTAL.inc()
+)
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+
+
+def endpoint_timeout(path: str) -> float:
+    """按接口类别（status / address / addrgrp / transaction）取读超时，未配置的类别使用 FORTIGATE_TIMEOUT"""
+    if path.startswith("/monitor/"):
+        category = "status"
+    elif "/addrgrp" in path:
+        category = "addrgrp"
+    elif "/address" in path:
+        category = "address"
+    else:
+        category = "transaction"
+    return FORTIGATE_ENDPOINT_TIMEOUTS.get(category, FORTIGATE_TIMEOUT)
 
 @dataclass
 class CleanupTask:
     """清理任务数据结构"""
     client_ip: str
-    future: Optional[asyncio.Future] = None
+    futures: List[asyncio.Future] = field(default_factory=list)  # 等待清理结果的请求
     is_manual: bool = False  # 是否是手动断开连接
+    trace: Optional[Trace] = None  # 被采样的断开请求的调用链，清理的各阶段会并入其中
 
 class FortigateAPI:
-    def __init__(self, host: str, api_token: str):
+    def __init__(self, host: str, api_token: str, breaker: Optional[CircuitBreaker] = None):
         self.host = host
         self.api_token = api_token
-        self.base_url = f"https://{host}/api/v2"
+        self.breaker = breaker or CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.base_url = f"{FORTIGATE_SCHEME}://{host}/api/v2"
         self.session = requests.Session()
         self.session.headers.update({
             'Authorization': f'Bearer {api_token}',
             'Content-Type': 'application/json'
         })
         self.session.verify = False  # 忽略SSL证书验证
+        # 批量删除时会并发使用同一个会话，连接池大小与并发上限一致
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=FORTIGATE_POOL_SIZE)
+        self.session.mount(f"{FORTIGATE_SCHEME}://", adapter)
         self.mode = "unknown"  # full, address_group_only, or unknown
+        self.transactions_supported = FORTIGATE_USE_TRANSACTIONS  # 首次开启事务失败后不再尝试
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """经由熔断器发送请求：按接口类别设置超时，幂等请求遇到连接异常或过载响应时退避重试"""
+        timeout = (FORTIGATE_CONNECT_TIMEOUT, endpoint_timeout(path))
+        return fortigate_retry.call(
+            self.breaker,
+            lambda: self.session.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs),
+            idempotent=method in IDEMPOTENT_METHODS,
+            transient=(requests.RequestException,)
+        )
         
+    @fortigate_call("test_connection")
     def test_connection(self) -> dict:
         """测试连接并检测权限模式"""
         try:
             # 测试基本连接
-            response = self.session.get(f"{self.base_url}/monitor/system/status")
+            response = self._request("GET", "/monitor/system/status")
             if response.status_code != 200:
                 return {
                     "success": False,
@@ -110,12 +494,12 @@ class FortigateAPI:
                     "mode": "unknown"
                 }
             
-            # 测试地址对象权限
-            addr_test = self.session.get(f"{self.base_url}/cmdb/firewall/address")
+            # 测试地址对象权限（只取一条记录的名称，地址对象很多时也不会下载整张表）
+            addr_test = self._request("GET", "/cmdb/firewall/address", params={"count": 1, "format": "name"})
             addr_writable = addr_test.status_code == 200
             
             # 测试地址组权限
-            group_test = self.session.get(f"{self.base_url}/cmdb/firewall/addrgrp")
+            group_test = self._request("GET", "/cmdb/firewall/addrgrp")
             group_writable = group_test.status_code == 200
             
             # 确定模式
@@ -144,36 +528,42 @@ class FortigateAPI:
                 "mode": "unknown"
             }
 
-    def get_all_address_objects(self) -> Optional[list]:
-        """获取所有地址对象"""
-        try:
-            response = self.session.get(f"{self.base_url}/cmdb/firewall/address")
-            if response.status_code == 200:
-                return response.json().get("results", [])
-            logger.error(f"获取所有地址对象失败: {response.status_code} - {response.text}")
-            return None
-        except Exception as e:
-            logger.error(f"获取所有地址对象异常: {str(e)}")
-            return None
-
-    def get_address_group_members(self, group_name: str) -> Optional[list]:
-        """获取地址组的成员列表"""
+    @fortigate_call("group_get")
+    def get_address_group(self, group_name: str) -> Optional[dict]:
+        """获取地址组的成员列表以及配置版本号（revision）"""
         try:
-            response = self.session.get(f"{self.base_url}/cmdb/firewall/addrgrp/{group_name}")
+            response = self._request("GET", f"/cmdb/firewall/addrgrp/{group_name}")
             if response.status_code == 200:
                 group_data = response.json()
-                return group_data.get("results", [{}])[0].get("member", [])
+                return {
+                    "member": group_data.get("results", [{}])[0].get("member", []),
+                    "revision": group_data.get("revision")
+                }
             # 如果地址组不存在，返回一个明确的空列表而不是None
             if response.status_code == 404:
                 logger.warning(f"地址组 {group_name} 不存在。")
-                return []
+                return {"member": [], "revision": None}
             logger.error(f"获取地址组 {group_name} 成员失败: {response.status_code} - {response.text}")
             return None
         except Exception as e:
             logger.error(f"获取地址组 {group_name} 成员异常: {str(e)}")
             return None
 
-    def create_address_object(self, name: str, ip: str) -> bool:
+    @fortigate_call("group_revision")
+    def get_address_group_revision(self, group_name: str) -> Optional[str]:
+        """只获取配置版本号（不含成员列表），用于确认缓存的地址组成员是否仍是最新的；失败或未知时返回 None"""
+        try:
+            response = self._request("GET", f"/cmdb/firewall/addrgrp/{group_name}", params={"format": "name"})
+            if response.status_code == 200:
+                return response.json().get("revision")
+            logger.error(f"获取地址组 {group_name} 版本号失败: {response.status_code} - {response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"获取地址组 {group_name} 版本号异常: {str(e)}")
+            return None
+
+    @fortigate_call("create")
+    def create_address_object(self, name: str, ip: str, comment: Optional[str] = None) -> bool:
         """创建地址对象"""
         if self.mode == "address_group_only":
             logger.warning(f"当前模式 {self.mode} 不支持创建地址对象")
@@ -183,12 +573,12 @@ class FortigateAPI:
             "name": name,
             "type": "ipmask",
             "subnet": f"{ip}/32",
-            "comment": f"Auto-created proxy address for {ip}"
+            "comment": comment or f"Auto-created proxy address for {ip}"
         }
         
         try:
-            response = self.session.post(
-                f"{self.base_url}/cmdb/firewall/address",
+            response = self._request(
+                "POST", "/cmdb/firewall/address",
                 json=data
             )
             
@@ -203,15 +593,18 @@ class FortigateAPI:
             logger.error(f"创建地址对象异常: {str(e)}")
             return False
 
-    def delete_address_object(self, name: str) -> bool:
-        """删除地址对象"""
+    @fortigate_call("delete")
+    def delete_address_object(self, name: str, transaction_id: Optional[int] = None) -> bool:
+        """删除地址对象（transaction_id 不为空时在该配置事务中执行）"""
         if self.mode == "address_group_only":
             logger.warning(f"当前模式 {self.mode} 不支持删除地址对象")
             return False
             
+        headers = {"X-TRANSACTION-ID": str(transaction_id)} if transaction_id is not None else None
         try:
-            response = self.session.delete(
-                f"{self.base_url}/cmdb/firewall/address/{name}"
+            response = self._request(
+                "DELETE", f"/cmdb/firewall/address/{name}",
+                headers=headers
             )
             
             if response.status_code in [200, 204]:
@@ -225,383 +618,1572 @@ class FortigateAPI:
             logger.error(f"删除地址对象异常: {str(e)}")
             return False
 
-    def add_to_address_group(self, group_name: str, address_name: str) -> bool:
-        """将地址对象添加到地址组"""
+    @fortigate_call("transaction")
+    def _transaction(self, action: str, transaction_id: Optional[int] = None) -> Optional[int]:
+        """FortiOS 配置事务：action 为 start / commit / abort，start 成功时返回事务ID"""
+        headers = {"X-TRANSACTION-ID": str(transaction_id)} if transaction_id is not None else None
         try:
-            # 首先获取现有的地址组配置
-            response = self.session.get(
-                f"{self.base_url}/cmdb/firewall/addrgrp/{group_name}"
+            response = self._request(
+                "POST", "/cmdb/",
+                params={"action": f"transaction-{action}"},
+                json={"timeout": 60} if action == "start" else {},
+                headers=headers
             )
-            
             if response.status_code != 200:
-                logger.error(f"获取地址组 {group_name} 失败: {response.status_code}")
-                return False
-                
-            group_data = response.json()
-            current_members = group_data.get("results", [{}])[0].get("member", [])
-            
-            # 检查是否已经存在
-            for member in current_members:
-                if member.get("name") == address_name:
-                    logger.info(f"地址对象 {address_name} 已在地址组 {group_name} 中")
-                    return True
-            
-            # 添加新成员
-            new_members = current_members + [{"name": address_name}]
-            
-            # 更新地址组
-            update_data = {
-                "member": new_members
-            }
-            
-            response = self.session.put(
-                f"{self.base_url}/cmdb/firewall/addrgrp/{group_name}",
-                json=update_data
-            )
+                logger.warning(f"配置事务 {action} 失败: {response.status_code}")
+                return None
+            if action == "start":
+                return response.json().get("results", {}).get("transaction-id")
+            return transaction_id
+        except Exception as e:
+            logger.warning(f"配置事务 {action} 异常: {str(e)}")
+            return None
+
+    def delete_address_objects(self, names: list) -> Dict[str, bool]:
+        """
+        批量删除地址对象，返回 名称 -> 是否成功。
+        请求并发发出（上限 FORTIGATE_MAX_CONCURRENCY）；防火墙支持配置事务时在一个事务中提交，
+        事务提交失败则回退为逐个删除。
+        """
+        if not names:
+            return {}
+        if self.mode == "address_group_only":
+            logger.warning(f"当前模式 {self.mode} 不支持删除地址对象")
+            return {name: False for name in names}
+
+        transaction_id = self._transaction("start") if self.transactions_supported else None
+        if self.transactions_supported and transaction_id is None:
+            logger.info("防火墙不支持配置事务，批量删除改为并发逐个提交。")
+            self.transactions_supported = False
+
+        def delete(name: str) -> bool:
+            return self.delete_address_object(name, transaction_id)
+
+        with ThreadPoolExecutor(max_workers=FORTIGATE_MAX_CONCURRENCY) as executor:
+            results = dict(zip(names, executor.map(delete, names)))
+
+        if transaction_id is not None:
+            if not all(results.values()):
+                self._transaction("abort", transaction_id)
+                staged = [name for name, ok in results.items() if ok]
+                logger.warning(f"事务中有删除失败，已中止事务，重新逐个删除 {len(staged)} 个对象。")
+            elif self._transaction("commit", transaction_id) is None:
+                staged = names
+                logger.warning("配置事务提交失败，改为逐个删除。")
+            else:
+                staged = []
+            if staged:
+                with ThreadPoolExecutor(max_workers=FORTIGATE_MAX_CONCURRENCY) as executor:
+                    results.update(zip(staged, executor.map(self.delete_address_object, staged)))
+
+        logger.info(f"批量删除地址对象完成: 成功 {sum(results.values())}/{len(names)}")
+        return results
+
+    @fortigate_call("update")
+    def update_address_object(self, name: str, ip: str, comment: Optional[str] = None) -> bool:
+        """修改已有地址对象指向的IP（用于地址对象池）"""
+        if self.mode == "address_group_only":
+            logger.warning(f"当前模式 {self.mode} 不支持修改地址对象")
+            return False
             
+        data = {
+            "subnet": f"{ip}/32",
+            "comment": comment or f"Auto-created proxy address for {ip}"
+        }
+        try:
+            response = self._request("PUT", f"/cmdb/firewall/address/{name}", json=data)
             if response.status_code == 200:
-                logger.info(f"成功将 {address_name} 添加到地址组 {group_name}")
                 return True
-            else:
-                logger.error(f"添加到地址组失败: {response.status_code} - {response.text}")
-                return False
-                
+            logger.error(f"修改地址对象 {name} 失败: {response.status_code} - {response.text}")
+            return False
         except Exception as e:
-            logger.error(f"添加到地址组异常: {str(e)}")
+            logger.error(f"修改地址对象 {name} 异常: {str(e)}")
             return False
 
-    def remove_from_address_group(self, group_name: str, address_name: str) -> bool:
-        """从地址组中移除地址对象"""
+    def update_address_objects(self, updates: Dict[str, str], comment: Optional[str] = None) -> Dict[str, bool]:
+        """并发修改多个地址对象（名称 -> IP），返回 名称 -> 是否成功"""
+        if not updates:
+            return {}
+        with ThreadPoolExecutor(max_workers=FORTIGATE_MAX_CONCURRENCY) as executor:
+            futures = {name: executor.submit(self.update_address_object, name, ip, comment)
+                       for name, ip in updates.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    @fortigate_call("create")
+    def create_range_object(self, name: str, start_ip: str, end_ip: str) -> bool:
+        """创建覆盖一段连续IP的 iprange 地址对象（地址聚合模式）"""
+        data = {
+            "name": name,
+            "type": "iprange",
+            "start-ip": start_ip,
+            "end-ip": end_ip,
+            "comment": f"Auto-created proxy range {start_ip}-{end_ip}"
+        }
         try:
-            # 获取现有的地址组配置
-            response = self.session.get(
-                f"{self.base_url}/cmdb/firewall/addrgrp/{group_name}"
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"获取地址组 {group_name} 失败: {response.status_code}")
-                return False
-                
-            group_data = response.json()
-            current_members = group_data.get("results", [{}])[0].get("member", [])
-            
-            # 过滤掉要移除的成员
-            new_members = [member for member in current_members if member.get("name") != address_name]
-            
-            # 更新地址组
-            update_data = {
-                "member": new_members
-            }
-            
-            response = self.session.put(
-                f"{self.base_url}/cmdb/firewall/addrgrp/{group_name}",
-                json=update_data
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"成功从地址组 {group_name} 中移除 {address_name}")
+            response = self._request("POST", "/cmdb/firewall/address", json=data)
+            if response.status_code in [200, 201]:
+                logger.info(f"成功创建地址区间对象: {name} ({start_ip}-{end_ip})")
                 return True
-            else:
-                logger.error(f"从地址组移除失败: {response.status_code} - {response.text}")
-                return False
-                
+            logger.error(f"创建地址区间对象失败: {response.status_code} - {response.text}")
+            return False
         except Exception as e:
-            logger.error(f"从地址组移除异常: {str(e)}")
+            logger.error(f"创建地址区间对象异常: {str(e)}")
             return False
 
-    def get_available_addresses(self) -> list:
-        """获取可用的地址对象列表（用于仅地址组模式）"""
+    @fortigate_call("update")
+    def update_range_object(self, name: str, start_ip: str, end_ip: str) -> bool:
+        """修改 iprange 地址对象的范围（区间延长、缩短或合并）"""
+        data = {
+            "start-ip": start_ip,
+            "end-ip": end_ip,
+            "comment": f"Auto-created proxy range {start_ip}-{end_ip}"
+        }
         try:
-            response = self.session.get(f"{self.base_url}/cmdb/firewall/address")
+            response = self._request("PUT", f"/cmdb/firewall/address/{name}", json=data)
             if response.status_code == 200:
-                data = response.json()
-                return [addr["name"] for addr in data.get("results", [])]
-            return []
+                return True
+            logger.error(f"修改地址区间对象 {name} 失败: {response.status_code} - {response.text}")
+            return False
         except Exception as e:
-            logger.error(f"获取地址对象列表失败: {str(e)}")
-            return []
-
+            logger.error(f"修改地址区间对象 {name} 异常: {str(e)}")
+            return False
 
-def cleanup_expired_objects():
-    """清理过期的对象"""
-    global last_error
-    
-    while True:
-        task: Optional[CleanupTask] = None
+    @fortigate_call("group_put")
+    def set_address_group_members(self, group_name: str, members: list) -> Optional[dict]:
+        """
+        用完整的成员列表更新地址组（由批量提交引擎使用）。
+        成功时返回 {"revision": 写入后的配置版本号}，失败时返回 None
+        """
         try:
-            # 从队列中获取需要清理的对象
-            task = cleanup_queue.get(timeout=1)
-            if not isinstance(task, CleanupTask):
-                continue
-            client_ip = task.client_ip
+            response = self._request(
+                "PUT", f"/cmdb/firewall/addrgrp/{group_name}",
+                json={"member": members}
+            )
             
-            cleanup_success = False
-            error_message = None
-            address_name = None
+            if response.status_code == 200:
+                return {"revision": response.json().get("revision")}
+            logger.error(f"更新地址组 {group_name} 成员失败: {response.status_code} - {response.text}")
+            return None
             
-            with cleanup_lock:
-                # 计时器逻辑由APScheduler处理，这里不需要手动取消
-                
-                if client_ip in address_objects:
-                    address_name = address_objects[client_ip]
-                    
-                    # 从地址组中移除
-                    if fortigate:
-                        success = fortigate.remove_from_address_group(ADDRESS_GROUP_NAME, address_name)
-                        if success:
-                            logger.info(f"已从地址组中移除 {address_name}")
-                            
-                            # 如果是完整模式，也删除地址对象
-                            if fortigate.mode == "full":
-                                delete_success = fortigate.delete_address_object(address_name)
-                                if delete_success:
-                                    logger.info(f"已删除地址对象 {address_name}")
-                                    cleanup_success = True
-                                else:
-                                    logger.warning(f"删除地址对象 {address_name} 失败")
-                                    cleanup_success = True  # 即使删除地址对象失败，从地址组移除成功也算成功
-                            else:
-                                # 仅地址组模式下，只需要从地址组移除成功即可
-                                cleanup_success = True
-                        else:
-                            logger.error(f"从地址组移除 {address_name} 失败")
-                            error_message = f"从地址组移除失败: {address_name}"
-                    else:
-                        error_message = "Fortigate连接不可用"
-                    
-                    # 从本地记录中移除
-                    if cleanup_success:
-                        del address_objects[client_ip]
-                        logger.info(f"清理完成: {client_ip}")
-                    else:
-                        logger.error(f"清理失败: {client_ip} - {error_message}")
-                
-                # 如果有Future对象，设置结果
-                if task and task.future and not task.future.done():
-                    if cleanup_success:
-                        # 设置成功结果
-                        result = {
-                            "message": "代理连接已断开",
-                            "client_ip": client_ip,
-                            "address_name": address_name or "unknown",
-                            "cleanup_success": True
-                        }
-                        task.future.get_loop().call_soon_threadsafe(
-                            task.future.set_result, result
-                        )
-                    else:
-                        # 设置异常结果
-                        error = HTTPException(
-                            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=error_message or "清理操作失败"
-                        )
-                        task.future.get_loop().call_soon_threadsafe(
-                            task.future.set_exception, error
-                        )
-                
-        except queue.Empty:
-            continue
         except Exception as e:
-            last_error = f"清理异常: {str(e)}"
-            logger.error(last_error)
-            
-            # 如果有Future对象，设置异常
-            if task and task.future and not task.future.done():
-                try:
-                    error = HTTPException(
-                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                        detail=f"清理过程中发生异常: {str(e)}"
-                    )
-                    task.future.get_loop().call_soon_threadsafe(
-                        task.future.set_exception, error
-                    )
-                except:
-                    pass  # 忽略设置异常时的错误
-
-
-def schedule_cleanup(client_ip: str):
-    """使用 APScheduler 安排或重置清理任务"""
-    run_date = datetime.now(scheduler.timezone) + timedelta(seconds=TIMER_DURATION)
-    
-    def cleanup_task():
-        """由调度器运行的实际任务"""
-        task = CleanupTask(client_ip=client_ip, is_manual=False)
-        cleanup_queue.put(task)
-
-    # 使用 client_ip 作为 job_id，如果已存在则替换
-    scheduler.add_job(
-        cleanup_task,
-        trigger=DateTrigger(run_date=run_date),
-        id=client_ip,
-        name=f"Cleanup for {client_ip}",
-        replace_existing=True
-    )
-    
-    logger.info(f"已安排/重置清理任务: {client_ip}, 将在 {run_date.isoformat()} 执行")
+            logger.error(f"更新地址组 {group_name} 成员异常: {str(e)}")
+            return None
 
 
-async def sync_from_fortigate():
-    """从Fortigate同步现有的代理对象"""
-    global fortigate, last_error, address_objects
-    logger.info("正在尝试从Fortigate同步现有的代理对象...")
+class _AsyncByteReader:
+    """把 httpx 的字节流包装成 ijson 需要的异步文件对象"""
 
-    # 1. 初始化并连接
-    # 使用临时变量，避免在同步失败时污染全局fortigate实例
-    fgt = FortigateAPI(FORTIGATE_IP, FORTIGATE_API_TOKEN)
-    test_result = fgt.test_connection()
+    def __init__(self, response: httpx.Response):
+        self._chunks = response.aiter_bytes()
 
-    if not test_result["success"]:
-        last_error = f"启动时同步失败: {test_result['error']}"
-        logger.error(last_error)
-        fortigate = None # 确保全局实例为空
-        return
+    async def read(self, size: int = -1) -> bytes:
+        if size == 0:
+            return b""  # ijson 会先用 read(0) 判断流的类型
+        # 空字节串对 ijson 表示流结束，跳过中途的空块
+        async for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return b""
 
-    fortigate = fgt # 将成功的连接赋给全局变量
-    logger.info(f"启动时连接成功，模式: {fortigate.mode}")
 
-    # 2. 仅在完整模式下执行同步
-    if fortigate.mode != 'full':
-        logger.warning(f"当前模式为 {fortigate.mode}，不支持对象同步。跳过同步过程。")
-        return
+async def _iter_results(response: httpx.Response):
+    """逐个产出响应中 results 数组的元素；安装了 ijson 时流式解析，否则整页解析"""
+    if ijson is not None:
+        async for obj in ijson.items_async(_AsyncByteReader(response), "results.item"):
+            yield obj
+    else:
+        await response.aread()
+        for obj in response.json().get("results", []):
+            yield obj
 
-    group_members_list = fortigate.get_address_group_members(ADDRESS_GROUP_NAME)
-    all_addr_objects = fortigate.get_all_address_objects()
 
-    if group_members_list is None or all_addr_objects is None:
-        last_error = "启动时同步失败: 无法获取地址组或地址对象列表。"
-        logger.error(last_error)
-        return
+class AsyncFortigateAPI:
+    """
+    FortigateAPI 的异步版本，供 FastAPI 端点使用，避免阻塞事件循环。
+    使用有上限的长连接池、单次调用超时以及并发上限；同步版本仍保留给后台线程使用。
+    """
 
-    # 3. 创建地址名称到IP的映射
-    addr_name_to_ip = {
-        obj.get("name"): obj.get("subnet", "").split('/')[0]
-        for obj in all_addr_objects if obj.get("subnet")
-    }
-    
-    group_member_names = {member.get("name") for member in group_members_list}
+    def __init__(self, host: str, api_token: str, breaker: Optional[CircuitBreaker] = None):
+        self.host = host
+        self.api_token = api_token
+        self.breaker = breaker or CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+        self.base_url = f"{FORTIGATE_SCHEME}://{host}/api/v2"
+        headers = {'Content-Type': 'application/json'}
+        if api_token:
+            # httpx 不允许以空白结尾的请求头，未配置Token时不发送该头
+            headers['Authorization'] = f'Bearer {api_token}'
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=headers,
+            verify=False,  # 忽略SSL证书验证
+            timeout=httpx.Timeout(FORTIGATE_TIMEOUT, connect=FORTIGATE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=FORTIGATE_POOL_SIZE,
+                max_keepalive_connections=FORTIGATE_POOL_SIZE,
+                keepalive_expiry=30
+            )
+        )
+        self._semaphore = asyncio.Semaphore(FORTIGATE_MAX_CONCURRENCY)  # 同时发往防火墙的请求上限
+        self.mode = "unknown"  # full, address_group_only, or unknown
 
-    # 4. 识别并加载代理对象
-    synced_count = 0
-    for addr_name in group_member_names:
-        if addr_name and addr_name.startswith("PROXY_"):
-            client_ip = addr_name_to_ip.get(addr_name)
-            if client_ip:
-                if client_ip not in address_objects:
-                    address_objects[client_ip] = addr_name
-                    schedule_cleanup(client_ip)
-                    logger.info(f"已同步: {addr_name} -> {client_ip}，并已安排清理任务。")
-                    synced_count += 1
-                else:
-                    logger.warning(f"同步冲突：IP {client_ip} 已存在于本地记录中，跳过 {addr_name}。")
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """经由熔断器发送请求：按接口类别设置超时，幂等请求遇到连接异常或过载响应时退避重试（退避期间不占用并发名额）"""
+        timeout = httpx.Timeout(endpoint_timeout(path), connect=FORTIGATE_CONNECT_TIMEOUT)
 
-    logger.info(f"同步完成，共加载了 {synced_count} 个现有的代理对象。")
+        async def send() -> httpx.Response:
+            async with self._semaphore:
+                return await self.client.request(method, path, timeout=timeout, **kwargs)
 
+        return await fortigate_retry.acall(
+            self.breaker, send, idempotent=method in IDEMPOTENT_METHODS, transient=(httpx.TransportError,)
+        )
 
-@app.get("/", response_class=HTMLResponse)
-async def root():
-    """根端点，提供前端页面"""
-    try:
-        with open(os.path.join(current_dir, "index.html"), "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        return HTMLResponse("""
-        <html>
-        <head><title>Fortigate Proxy Manager</title></head>
-        <body>
-        <h1>Fortigate Proxy Manager</h1>
-        <p>前端页面未找到，请确保 index.html 文件存在</p>
-        <p><a href="/api">API 文档</a></p>
-        </body>
-        </html>
-        """)
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.aclose()
 
+    @fortigate_call("test_connection")
+    async def test_connection(self) -> dict:
+        """测试连接并检测权限模式"""
+        try:
+            response = await self._request("GET", "/monitor/system/status")
+            if response.status_code != 200:
+                return {
+                    "success": False,
+                    "error": f"连接失败: HTTP {response.status_code}",
+                    "mode": "unknown"
+                }
 
-@app.get("/api")
-async def api_info():
-    """API信息端点"""
-    return {
-        "service": "Fortigate Proxy Manager",
-        "version": "1.0.0",
-        "endpoints": {
-            "/connect": "Connect and create proxy address object",
-            "/disconnect": "Disconnect and cleanup address object", 
-            "/status": "Check connection status",
-            "/health": "Health check endpoint"
-        },
-        "fortigate_ip": FORTIGATE_IP,
-        "address_group": ADDRESS_GROUP_NAME,
-        "timer_duration_hours": TIMER_DURATION / 3600
-    }
+            # 地址对象和地址组的权限检测互不依赖，并发执行
+            # 地址对象只取一条记录的名称，地址对象很多时也不会下载整张表
+            addr_test, group_test = await asyncio.gather(
+                self._request("GET", "/cmdb/firewall/address", params={"count": 1, "format": "name"}),
+                self._request("GET", "/cmdb/firewall/addrgrp")
+            )
+            addr_writable = addr_test.status_code == 200
+            group_writable = group_test.status_code == 200
 
+            if addr_writable and group_writable:
+                self.mode = "full"
+            elif group_writable:
+                self.mode = "address_group_only"
+            else:
+                self.mode = "unknown"
+                return {
+                    "success": False,
+                    "error": "权限不足：无法访问地址对象或地址组",
+                    "mode": self.mode
+                }
 
-@app.post("/connect")
-async def connect_proxy(request: Request):
-    """连接代理并创建地址对象"""
-    global fortigate, last_error
-    
-    try:
-        # 获取客户端IP
-        client_ip = request.client.host if request.client else "127.0.0.1"
-        
-        # 如果还没有连接到Fortigate，先连接
-        if not fortigate:
-            fortigate = FortigateAPI(FORTIGATE_IP, FORTIGATE_API_TOKEN)
-            test_result = fortigate.test_connection()
-            
-            if not test_result["success"]:
-                last_error = test_result["error"]
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail=f"无法连接到Fortigate: {test_result['error']}"
-                )
+            return {
+                "success": True,
+                "mode": self.mode,
+                "message": f"连接成功，模式: {self.mode}"
+            }
 
-        # 检查IP是否已经存在活动连接，如果存在则只重置计时器（续期）
-        if client_ip in address_objects:
-            address_name = address_objects[client_ip]
-            schedule_cleanup(client_ip)  # 重置计时器
-            logger.info(f"IP {client_ip} 的连接已存在，重置计时器。")
+        except Exception as e:
             return {
-                "message": "代理连接已续期",
-                "client_ip": client_ip,
-                "address_name": address_name,
-                "mode": fortigate.mode,
-                "cleanup_in_seconds": TIMER_DURATION
+                "success": False,
+                "error": f"连接异常: {str(e)}",
+                "mode": "unknown"
             }
-        
-        # 生成地址对象名称，严格遵守 PROXY_uuid.uuid4() 格式
-        address_name = f"PROXY_{uuid.uuid4()}"
-        
-        # 完整模式：创建地址对象并添加到地址组
-        if fortigate.mode == "full":
-            if not fortigate.create_address_object(address_name, client_ip):
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail="创建地址对象失败"
-                )
-        
-        if not fortigate.add_to_address_group(ADDRESS_GROUP_NAME, address_name):
-            # 如果添加到地址组失败，且是完整模式，则删除刚创建的地址对象
-            if fortigate.mode == "full":
-                fortigate.delete_address_object(address_name)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="添加到地址组失败"
-            )
-        
-        # 记录地址对象 (IP -> 地址对象名称)
-        address_objects[client_ip] = address_name
-        
-        # 安排清理任务
-        schedule_cleanup(client_ip)
-        
-        return {
-            "message": "代理连接成功",
-            "client_ip": client_ip,
-            "address_name": address_name,
-            "mode": fortigate.mode,
-            "cleanup_in_seconds": TIMER_DURATION
-        }
-        
+
+    async def _iter_address_objects(self, name_prefix: str, fields: str, page_size: int):
+        """按名称前缀分页（服务端过滤）逐个产出地址对象，每页的响应以流的方式解析；失败时抛出 RuntimeError"""
+        start = 0
+        while True:
+            params = {
+                "filter": f"name=@{name_prefix}",
+                "format": fields,
+                "start": start,
+                "count": page_size
+            }
+            page_count = 0
+            # 流式读取不重试，但结果同样计入熔断器
+            if not self.breaker.allow():
+                raise CircuitOpenError(self.breaker.retry_after())
+            timeout = httpx.Timeout(endpoint_timeout("/cmdb/firewall/address"), connect=FORTIGATE_CONNECT_TIMEOUT)
+            try:
+                async with self._semaphore:
+                    async with self.client.stream("GET", "/cmdb/firewall/address", params=params,
+                                                  timeout=timeout) as response:
+                        if response.status_code in RETRY_STATUSES:
+                            self.breaker.record_failure()
+                        else:
+                            self.breaker.record_success()
+                        if response.status_code != 200:
+                            await response.aread()
+                            raise RuntimeError(f"HTTP {response.status_code} - {response.text}")
+                        async for obj in _iter_results(response):
+                            page_count += 1
+                            name = obj.get("name")
+                            if name and name.startswith(name_prefix):
+                                yield obj
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                raise
+            except (RuntimeError, GeneratorExit):
+                raise
+            except BaseException:
+                self.breaker.abandon()
+                raise
+            if page_count < page_size:
+                return
+            start += page_count
+
+    @fortigate_call("address_list")
+    async def get_address_objects_paged(self, name_prefix: str, wanted: Optional[set] = None,
+                                        page_size: int = 500) -> Optional[Dict[str, str]]:
+        """
+        按名称前缀分页获取地址对象（服务端过滤），返回 名称 -> IP 的映射。
+        wanted 不为空时只保留其中的名称；每页的响应以流的方式解析，内存占用与地址表大小无关。
+        """
+        result: Dict[str, str] = {}
+        try:
+            async for obj in self._iter_address_objects(name_prefix, "name|subnet", page_size):
+                if obj.get("subnet") and (wanted is None or obj["name"] in wanted):
+                    result[obj["name"]] = subnet_to_ip(obj["subnet"])
+            return result
+        except Exception as e:
+            logger.error(f"分页获取地址对象异常: {str(e)}")
+            return None
+
+    @fortigate_call("address_list")
+    async def get_address_ranges_paged(self, name_prefix: str, wanted: Optional[set] = None,
+                                       page_size: int = 500) -> Optional[Dict[str, tuple]]:
+        """
+        按名称前缀分页获取地址对象的范围，返回 名称 -> (起始IP, 结束IP)（地址聚合模式）。
+        iprange 对象取 start-ip / end-ip，单个IP的 ipmask 对象视为只含一个IP的区间。
+        """
+        result: Dict[str, tuple] = {}
+        try:
+            async for obj in self._iter_address_objects(name_prefix, "name|type|subnet|start-ip|end-ip", page_size):
+                if wanted is not None and obj["name"] not in wanted:
+                    continue
+                if obj.get("type") == "iprange" and obj.get("start-ip") and obj.get("end-ip"):
+                    result[obj["name"]] = (obj["start-ip"], obj["end-ip"])
+                elif obj.get("subnet"):
+                    ip = subnet_to_ip(obj["subnet"])
+                    result[obj["name"]] = (ip, ip)
+            return result
+        except Exception as e:
+            logger.error(f"分页获取地址区间对象异常: {str(e)}")
+            return None
+
+    @fortigate_call("group_get")
+    async def get_address_group(self, group_name: str) -> Optional[dict]:
+        """获取地址组的成员列表以及配置版本号（revision）"""
+        try:
+            response = await self._request("GET", f"/cmdb/firewall/addrgrp/{group_name}")
+            if response.status_code == 200:
+                group_data = response.json()
+                return {
+                    "member": group_data.get("results", [{}])[0].get("member", []),
+                    "revision": group_data.get("revision")
+                }
+            if response.status_code == 404:
+                logger.warning(f"地址组 {group_name} 不存在。")
+                return {"member": [], "revision": None}
+            logger.error(f"获取地址组 {group_name} 成员失败: {response.status_code} - {response.text}")
+            return None
+        except Exception as e:
+            logger.error(f"获取地址组 {group_name} 成员异常: {str(e)}")
+            return None
+
+    @fortigate_call("create")
+    async def create_address_object(self, name: str, ip: str, comment: Optional[str] = None) -> bool:
+        """创建地址对象"""
+        if self.mode == "address_group_only":
+            logger.warning(f"当前模式 {self.mode} 不支持创建地址对象")
+            return False
+
+        data = {
+            "name": name,
+            "type": "ipmask",
+            "subnet": f"{ip}/32",
+            "comment": comment or f"Auto-created proxy address for {ip}"
+        }
+
+        try:
+            response = await self._request("POST", "/cmdb/firewall/address", json=data)
+            if response.status_code in [200, 201]:
+                logger.info(f"成功创建地址对象: {name}")
+                return True
+            logger.error(f"创建地址对象失败: {response.status_code} - {response.text}")
+            return False
+        except Exception as e:
+            logger.error(f"创建地址对象异常: {str(e)}")
+            return False
+
+    @fortigate_call("update")
+    async def update_address_object(self, name: str, ip: str, comment: Optional[str] = None) -> bool:
+        """修改已有地址对象指向的IP（用于地址对象池）"""
+        if self.mode == "address_group_only":
+            logger.warning(f"当前模式 {self.mode} 不支持修改地址对象")
+            return False
+
+        data = {
+            "subnet": f"{ip}/32",
+            "comment": comment or f"Auto-created proxy address for {ip}"
+        }
+        try:
+            response = await self._request("PUT", f"/cmdb/firewall/address/{name}", json=data)
+            if response.status_code == 200:
+                return True
+            logger.error(f"修改地址对象 {name} 失败: {response.status_code} - {response.text}")
+            return False
+        except Exception as e:
+            logger.error(f"修改地址对象 {name} 异常: {str(e)}")
+            return False
+
+    @fortigate_call("delete")
+    async def delete_address_object(self, name: str) -> bool:
+        """删除地址对象"""
+        if self.mode == "address_group_only":
+            logger.warning(f"当前模式 {self.mode} 不支持删除地址对象")
+            return False
+
+        try:
+            response = await self._request("DELETE", f"/cmdb/firewall/address/{name}")
+            if response.status_code in [200, 204]:
+                logger.info(f"成功删除地址对象: {name}")
+                return True
+            logger.error(f"删除地址对象失败: {response.status_code} - {response.text}")
+            return False
+        except Exception as e:
+            logger.error(f"删除地址对象异常: {str(e)}")
+            return False
+
+
+def _resolve_future(future: asyncio.Future, result=None, error: Optional[Exception] = None):
+    """从工作线程中设置事件循环里的Future结果"""
+    def _set():
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    future.get_loop().call_soon_threadsafe(_set)
+
+
+def process_cleanup_batch(tasks: List[CleanupTask]):
+    """
+    批量处理一组清理任务（由清理工作线程池调用，同一IP的任务按顺序执行）
+    一次性提交所有地址组移除（合并为一次成员列表更新），完整模式下再批量删除地址对象。
+    """
+    global last_error
+    
+    results: Dict[str, tuple] = {}  # IP -> (是否成功, 地址对象名称, 错误信息)
+    unavailable = set()  # 因防火墙不可用而失败的IP（返回503）
+    # 批次中有被采样的断开请求时总是记录，清理结束后并入这些请求的调用链
+    waiting = [task.trace for task in tasks if task.trace is not None]
+    trace = tracer.start("cleanup", force=bool(waiting), batch=len(tasks))
+    with activate(trace):
+        try:
+            to_remove: Dict[FirewallTarget, Dict[str, str]] = {}  # 目标 -> (IP -> 地址对象名称)
+            manual_ips = {task.client_ip for task in tasks if task.is_manual}
+            for task in tasks:
+                client_ip = task.client_ip
+                # 到期后、清理前客户端又续期了，跳过本次到期清理
+                if not task.is_manual and (client_ip in lease_timer or renewed_elsewhere(client_ip)):
+                    logger.info(f"{client_ip} 在清理前已续期，跳过到期清理。")
+                    results[client_ip] = (False, None, None)
+                elif client_ip in address_objects:
+                    to_remove.setdefault(target_for(client_ip), {})[client_ip] = address_objects[client_ip]
+                else:
+                    results[client_ip] = (False, None, None)
+        
+            for target in [target for target in to_remove if not target.fortigate or target.breaker.rejecting()]:
+                for client_ip, address_name in to_remove.pop(target).items():
+                    if client_ip not in manual_ips:
+                        # 防火墙不可用期间的到期清理推迟重试，而不是丢弃
+                        defer_expiry(target, client_ip)
+                        results[client_ip] = (False, address_name, None)
+                    else:
+                        results[client_ip] = (False, address_name, "Fortigate连接不可用")
+                        unavailable.add(client_ip)
+        
+            # 从地址组中移除：同一批次的所有移除在同一个提交窗口内，合并为一次PUT（各目标的提交引擎并行刷新）
+            # 地址聚合模式下交给区间引擎，由它缩短、拆分或删除覆盖该IP的区间对象
+            futures = {
+                client_ip: (target.ranges.submit_remove(client_ip) if target.aggregating
+                            else target.group_commit.submit_remove(address_name))
+                for target, batch in to_remove.items() for client_ip, address_name in batch.items()
+            }
+            with span("group_commit"):
+                wait(futures.values())
+            removed: Dict[FirewallTarget, Dict[str, str]] = {}
+            for target, batch in to_remove.items():
+                for client_ip, address_name in batch.items():
+                    if futures[client_ip].result():
+                        logger.info(f"已从地址组中移除 {address_name}")
+                        removed.setdefault(target, {})[client_ip] = address_name
+                    else:
+                        logger.error(f"从地址组移除 {address_name} 失败")
+                        results[client_ip] = (False, address_name, f"从地址组移除失败: {address_name}")
+                        if client_ip not in manual_ips:
+                            defer_expiry(target, client_ip)
+        
+            # 如果是完整模式，地址对象放回对象池（池满则批量删除），多个目标之间并行
+            full_mode = [target for target in removed if target.mode == "full" and not target.aggregating]
+            with span("release"):
+                if len(full_mode) > 1:
+                    with ThreadPoolExecutor(max_workers=len(full_mode)) as executor:
+                        list(executor.map(
+                            lambda target: release_address_objects(target, list(removed[target].values())), full_mode
+                        ))
+                elif full_mode:
+                    release_address_objects(full_mode[0], list(removed[full_mode[0]].values()))
+        
+            # 即使删除地址对象失败，从地址组移除成功也算成功；仅地址组模式下只需要从地址组移除
+            for batch in removed.values():
+                for client_ip, address_name in batch.items():
+                    results[client_ip] = (True, address_name, None)
+                    address_objects.pop(client_ip, None)  # 核对任务可能已经移除了本地记录
+                    if lease_journal:
+                        lease_journal.record_remove(client_ip)
+                    logger.info(f"清理完成: {client_ip}")
+        except Exception as e:
+            last_error = f"清理异常: {str(e)}"
+            logger.error(last_error)
+            for task in tasks:
+                if not results.get(task.client_ip, (False,))[0]:
+                    results[task.client_ip] = (False, None, f"清理过程中发生异常: {str(e)}")
+    if trace is not None:
+        tracer.finish(trace)
+        for waiting_trace in waiting:
+            waiting_trace.adopt(trace)
+
+    # 通知所有等待清理结果的请求（同一IP重复的断开请求会被合并到同一个任务）
+    for task in tasks:
+        cleanup_success, address_name, error_message = results.get(task.client_ip, (False, None, None))
+        if cleanup_success:
+            LEASE_EVENTS.labels("disconnect" if task.is_manual else "expire").inc()
+            event_hub.publish_threadsafe(task.client_ip, "lease", lease_state(task.client_ip))
+        elif error_message:
+            logger.error(f"清理失败: {task.client_ip} - {error_message}")
+        for future in task.futures:
+            if cleanup_success:
+                _resolve_future(future, result={
+                    "message": "代理连接已断开",
+                    "client_ip": task.client_ip,
+                    "address_name": address_name or "unknown",
+                    "cleanup_success": True
+                })
+            else:
+                _resolve_future(future, error=HTTPException(
+                    status_code=(status.HTTP_503_SERVICE_UNAVAILABLE if task.client_ip in unavailable
+                                 else status.HTTP_500_INTERNAL_SERVER_ERROR),
+                    detail=error_message or "清理操作失败"
+                ))
+
+
+def abandon_cleanup_tasks(tasks: List[CleanupTask]):
+    """
+    清理工作线程池停止（失去主节点身份或关闭）时尚未处理的任务：等待中的断开请求返回503，由客户端重试；
+    到期清理不需要处理，租约仍在共享状态中，由新的主节点按到期时间接管
+    """
+    for task in tasks:
+        for future in task.futures:
+            _resolve_future(future, error=HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="本节点已停止处理清理任务，请重试"
+            ))
+
+
+def relabel_leases(relabels: List[tuple]):
+    """区间合并或拆分后，更新改由其他区间对象覆盖的租约记录的名称（由区间引擎线程调用）"""
+    for client_ip, address_name in relabels:
+        if client_ip in address_objects:
+            address_objects[client_ip] = address_name
+
+
+def defer_expiry(target: FirewallTarget, client_ip: str):
+    """到期清理失败（防火墙不可用等）时，在熔断器下一次探测之后重新尝试"""
+    retry_at = time.time() + max(target.breaker.retry_after(), BREAKER_RESET_TIMEOUT)
+    lease_timer.schedule(client_ip, retry_at)
+    logger.warning(f"{client_ip} 的到期清理失败，将在 {datetime.fromtimestamp(retry_at).isoformat()} 重试。")
+
+
+POOL_OBJECT_COMMENT = "Pooled proxy address (idle)"
+
+
+def release_address_objects(target: FirewallTarget, names: List[str]):
+    """已移出地址组的地址对象：放回对象池，放不下的批量删除"""
+    recycled = recycle_address_objects(target, names)
+    deleted = target.fortigate.delete_address_objects([name for name in names if name not in recycled])
+    for address_name, ok in deleted.items():
+        if ok:
+            target.address_cache.remove_object(address_name)
+        else:
+            logger.warning(f"删除地址对象 {address_name} 失败")
+
+
+def fill_address_pool():
+    """后台任务：各目标的空闲对象低于低水位时预先创建地址对象补充到池大小"""
+    if not is_leader:
+        return
+    for target in targets.values():
+        fortigate, address_pool = target.fortigate, target.address_pool
+        if address_pool is None or not fortigate or fortigate.mode != "full" or target.breaker.rejecting():
+            continue
+        count = address_pool.deficit()
+        if count <= 0:
+            continue
+        names = [f"PROXY_{uuid.uuid4()}" for _ in range(count)]
+        with ThreadPoolExecutor(max_workers=FORTIGATE_MAX_CONCURRENCY) as executor:
+            created = list(executor.map(
+                lambda name: fortigate.create_address_object(name, ADDRESS_POOL_PLACEHOLDER, POOL_OBJECT_COMMENT),
+                names
+            ))
+        added = 0
+        for name, ok in zip(names, created):
+            if not ok:
+                continue
+            if address_pool.add(name):
+                added += 1
+            else:
+                fortigate.delete_address_object(name)
+        logger.info(f"目标 {target.name} 的地址对象池已补充 {added} 个对象，当前空闲 {len(address_pool)} 个。")
+
+
+def recycle_address_objects(target: FirewallTarget, names: List[str]) -> set:
+    """把已移出地址组的对象改回占位地址并放回对象池，返回成功放回的名称集合"""
+    address_pool = target.address_pool
+    if address_pool is None or not names:
+        return set()
+    candidates = names[:address_pool.room()]
+    results = target.fortigate.update_address_objects(
+        {name: ADDRESS_POOL_PLACEHOLDER for name in candidates}, POOL_OBJECT_COMMENT
+    )
+    recycled = set()
+    for name, ok in results.items():
+        if ok and address_pool.add(name, recycled=True):
+            target.address_cache.remove_object(name)
+            recycled.add(name)
+    return recycled
+
+
+@traced("schedule_cleanup")
+def schedule_cleanup(client_ip: str, expires_at: Optional[float] = None, persist: bool = True):
+    """
+    在租约时间轮中安排或重置清理任务（续期为 O(1)）
+    expires_at 为到期时间戳（默认为该IP所属目标的租约时长之后）；persist 为 False 时不写入租约日志（例如从日志恢复时）
+    """
+    if expires_at is None:
+        expires_at = time.time() + target_for(client_ip).duration
+    # 已经过期的租约（例如停机期间到期）会在下一个 tick 被清理；非主节点只更新共享状态，由主节点跟踪到期
+    if is_leader:
+        lease_timer.schedule(client_ip, expires_at)
+    
+    if persist and shared_state is not None:
+        shared_state.set_expiry(client_ip, expires_at)
+    elif persist and lease_journal and client_ip in address_objects:
+        lease_journal.record_put(client_ip, address_objects[client_ip], expires_at)
+    
+    logger.info(f"已安排/重置清理任务: {client_ip}, 将在 {datetime.fromtimestamp(expires_at).isoformat()} 执行")
+
+
+def enqueue_expired_leases(client_ips: List[str]):
+    """时间轮回调：把一批到期的租约放入清理队列"""
+    for client_ip in client_ips:
+        cleanup_pool.submit(CleanupTask(client_ip=client_ip, is_manual=False))
+    logger.info(f"{len(client_ips)} 个租约已到期，已加入清理队列。")
+
+
+async def restore_leases_from_journal() -> Dict[str, tuple]:
+    """重放租约日志，恢复上次运行时的租约及其真实到期时间，返回 IP -> (地址对象名称, 到期时间戳)"""
+    if shared_state is not None:
+        # 共享状态中的租约已经是最新的，只需放入本节点的时间轮（尚未设置到期时间的按新租约处理）
+        leases = await asyncio.to_thread(shared_state.leases)
+        for client_ip, (_, expires_at) in leases.items():
+            schedule_cleanup(client_ip, expires_at=expires_at, persist=expires_at is None)
+        logger.info(f"已从共享状态恢复 {len(leases)} 个租约。")
+        return leases
+    if not lease_journal:
+        return {}
+    try:
+        leases = await asyncio.to_thread(lease_journal.replay)
+    except Exception as e:
+        logger.error(f"读取租约日志失败: {str(e)}")
+        return {}
+    for client_ip, (address_name, expires_at) in leases.items():
+        address_objects[client_ip] = address_name
+        schedule_cleanup(client_ip, expires_at=expires_at, persist=False)
+    logger.info(f"已从租约日志恢复 {len(leases)} 个租约。")
+    return leases
+
+
+def drop_lease(client_ip: str):
+    """仅移除本地租约记录（防火墙上已不存在对应的地址组成员）"""
+    address_objects.pop(client_ip, None)
+    lease_timer.cancel(client_ip)
+    if lease_journal:
+        lease_journal.record_remove(client_ip)
+
+
+async def run_shared(func, *args, **kwargs):
+    """
+    在事件循环中调用会访问共享状态的函数：多 worker 部署时 SQLite 的写事务可能要等待其他进程释放文件锁
+    （最长 busy_timeout），放到线程中执行，不阻塞其他请求；单进程部署时直接调用
+    """
+    if shared_state is None:
+        return func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def lease_name(client_ip: str) -> Optional[str]:
+    """IP 当前租约的地址对象名称，没有租约时为 None（多 worker 部署时查询共享状态）"""
+    return await run_shared(address_objects.get, client_ip)
+
+
+def lease_remaining(client_ip: str) -> Optional[float]:
+    """租约剩余秒数；多 worker 部署时以共享状态为准（续期可能发生在其他 worker）"""
+    if shared_state is None:
+        return lease_timer.remaining(client_ip)
+    lease = shared_state.get_lease(client_ip)
+    if lease is None or lease[1] is None:
+        return None
+    return max(0.0, lease[1] - time.time())
+
+
+def renewed_elsewhere(client_ip: str) -> bool:
+    """
+    时间轮到期时再核对一次共享状态：其他 worker 的续期还没经变更跟踪同步到时间轮时，
+    按共享状态中的到期时间重新安排并返回 True。
+    """
+    if shared_state is None:
+        return False
+    lease = shared_state.get_lease(client_ip)
+    if lease is None or lease[1] is None or lease[1] <= time.time():
+        return False
+    lease_timer.schedule(client_ip, lease[1])
+    return True
+
+
+def lease_state(client_ip: str) -> dict:
+    """某个IP当前的租约状态（/events 推送的内容）"""
+    return {
+        "client_ip": client_ip,
+        "has_active_proxy": client_ip in address_objects,
+        "address_name": address_objects.get(client_ip),
+        "timer_remaining": lease_remaining(client_ip),
+        "mode": target_for(client_ip).mode,
+        "ready": ready_event.is_set()
+    }
+
+
+def renew_streaming_lease(client_ip: str, force: bool = False) -> Optional[dict]:
+    """
+    续期推送连接对应的租约（距上次续期超过 EVENTS_RENEW_INTERVAL 时，force 为 True 时只要有租约就续期），
+    返回续期后的租约状态；无需续期或没有租约时返回 None
+    """
+    remaining = lease_remaining(client_ip)
+    if client_ip not in address_objects or remaining is None:
+        return None
+    if not force and remaining > target_for(client_ip).duration - EVENTS_RENEW_INTERVAL:
+        return None
+    schedule_cleanup(client_ip)
+    return lease_state(client_ip)
+
+
+async def renew_streaming_leases():
+    """为打开了续期推送连接的IP续期（代替页面每5分钟调用一次 /connect）"""
+    for client_ip in event_hub.renewing_ips():
+        started_at, started = time.time(), time.perf_counter()
+        state = await run_shared(renew_streaming_lease, client_ip)
+        if state is not None:
+            LEASE_EVENTS.labels("renew").inc()
+            event_hub.publish(client_ip, "lease", state)
+            if traffic_recorder:
+                traffic_recorder.record(RENEW, client_ip, 200, started_at, time.perf_counter() - started)
+
+
+async def run_event_producer():
+    """
+    推送连接的共享生产者：定时续期打开的连接、生成一次健康快照分发给调试面板，并发送心跳。
+    所有页面共用这一个任务，开销与打开的页面数基本无关。
+    """
+    while True:
+        await asyncio.sleep(EVENTS_HEARTBEAT_INTERVAL)
+        try:
+            await renew_streaming_leases()
+            if shared_state is not None:
+                # 租约可能由其他 worker 修改或清理，定期推送最新状态
+                for client_ip in event_hub.client_ips():
+                    event_hub.publish(client_ip, "lease", await run_shared(lease_state, client_ip))
+            if event_hub.wants_health():
+                event_hub.broadcast(format_event("health", await run_shared(health_snapshot)), health_only=True)
+            event_hub.broadcast(HEARTBEAT)
+        except Exception as e:
+            logger.error(f"推送任务异常: {str(e)}")
+
+
+def subnet_to_ip(subnet: str) -> str:
+    """从地址对象的 subnet 字段中取出IP（FortiOS 返回 "IP 掩码"，也兼容 "IP/前缀" 格式）"""
+    return subnet.replace('/', ' ').split()[0] if subnet.strip() else ""
+
+
+async def connect_fortigate(target: FirewallTarget) -> dict:
+    """
+    建立到目标防火墙的连接（异步客户端用于端点，同步客户端用于后台线程）。
+    只有在连接测试成功后才会替换目标上的实例，避免失败时污染已有状态。
+    """
+    client = AsyncFortigateAPI(target.host, target.api_token, target.breaker)
+    test_result = await client.test_connection()
+    if not test_result["success"]:
+        await client.aclose()
+        return test_result
+
+    fgt = FortigateAPI(target.host, target.api_token, target.breaker)
+    fgt.mode = client.mode  # 权限模式已由异步客户端检测，无需再次探测
+
+    old_client = target.afortigate
+    target.afortigate, target.fortigate = client, fgt
+    if old_client:
+        await old_client.aclose()
+    return test_result
+
+
+async def sync_from_fortigate():
+    """从各目标的防火墙同步现有的代理对象（各目标并行）"""
+    logger.info("正在尝试从Fortigate同步现有的代理对象...")
+
+    # 同步不频繁，总是记录调用链
+    with tracer.trace("sync", force=True, leader=is_leader):
+        # 0. 先从租约日志恢复，即使防火墙暂时不可达，已有租约也保留真实的到期时间
+        #    非主节点不跟踪到期（租约保存在共享状态中），只需要连接防火墙
+        with span("journal_restore"):
+            journaled = await restore_leases_from_journal() if is_leader else {}
+
+        await asyncio.gather(*(sync_target(target, journaled) for target in targets.values()))
+
+
+@traced("sync_target")
+async def sync_target(target: FirewallTarget, journaled: Dict[str, tuple]):
+    """连接一个目标的防火墙，并与其地址组中的代理对象核对"""
+    global last_error
+
+    # 1. 初始化并连接
+    test_result = await connect_fortigate(target)
+
+    if not test_result["success"]:
+        last_error = f"启动时同步失败（{target.name}）: {test_result['error']}"
+        logger.error(last_error)
+        return
+
+    logger.info(f"目标 {target.name} 启动时连接成功，模式: {target.mode}")
+
+    if not is_leader:
+        logger.info("本节点不是主节点，由主节点负责同步。")
+        return
+
+    # 2. 仅在完整模式下执行同步
+    if target.mode != 'full':
+        logger.warning(f"目标 {target.name} 的模式为 {target.mode}，不支持对象同步。跳过同步过程。")
+        return
+
+    afortigate, address_cache, address_pool = target.afortigate, target.address_cache, target.address_pool
+
+    # 先获取地址组成员，再只获取其中的 PROXY_* 地址对象（服务端过滤 + 分页），不下载整个地址表
+    group = await afortigate.get_address_group(target.group_name)
+    if group is None:
+        last_error = f"启动时同步失败（{target.name}）: 无法获取地址组。"
+        logger.error(last_error)
+        return
+
+    group_members_list = group["member"]
+    address_cache.store_members(group_members_list, group["revision"])
+    proxy_member_names = {
+        member.get("name") for member in group_members_list
+        if member.get("name", "").startswith("PROXY_")
+    }
+
+    if target.aggregating:
+        await sync_target_ranges(target, proxy_member_names, journaled)
+        return
+
+    # 2.1 与租约日志对比：日志中已知的对象无需再向防火墙查询；地址组中已不存在的租约从本地移除
+    journaled_names = set()
+    for client_ip, (addr_name, _) in journaled.items():
+        if target_for(client_ip) is not target:
+            continue
+        if addr_name in proxy_member_names:
+            address_cache.put_object(addr_name, client_ip)
+            journaled_names.add(addr_name)
+        elif address_objects.get(client_ip) == addr_name:
+            drop_lease(client_ip)
+            logger.info(f"租约 {addr_name} -> {client_ip} 已不在地址组中，移除本地记录。")
+    unknown_names = proxy_member_names - journaled_names
+
+    # 启用对象池时还需要找出不在地址组中、指向占位地址的空闲对象
+    if unknown_names or address_pool is not None:
+        proxy_objects = await afortigate.get_address_objects_paged(
+            "PROXY_", wanted=None if address_pool is not None else unknown_names, page_size=SYNC_PAGE_SIZE
+        )
+        if proxy_objects is None:
+            last_error = f"启动时同步失败（{target.name}）: 无法获取代理地址对象。"
+            logger.error(last_error)
+            return
+        # 3. 缓存 PROXY_* 地址对象（名称 -> IP），并收回空闲的池对象
+        for addr_name, ip in proxy_objects.items():
+            if addr_name in unknown_names:
+                address_cache.put_object(addr_name, ip)
+            elif (address_pool is not None and addr_name not in proxy_member_names
+                    and ip == ADDRESS_POOL_PLACEHOLDER and address_pool.add(addr_name)):
+                logger.info(f"已收回空闲的池对象: {addr_name}")
+
+    # 4. 识别并加载日志中没有记录的代理对象
+    synced_count = 0
+    for addr_name in unknown_names:
+        client_ip = address_cache.get_object_ip(addr_name)
+        if client_ip:
+            if target_for(client_ip) is not target:
+                # 租约按IP路由，路由到其他目标的对象无法由本目标清理（多半是修改了 FIREWALL_TARGETS）
+                logger.warning(f"同步冲突：{addr_name} -> {client_ip} 不属于目标 {target.name} 的子网，跳过。")
+            elif client_ip not in address_objects:
+                address_objects[client_ip] = addr_name
+                schedule_cleanup(client_ip)
+                logger.info(f"已同步: {addr_name} -> {client_ip}，并已安排清理任务。")
+                synced_count += 1
+            else:
+                logger.warning(f"同步冲突：IP {client_ip} 已存在于本地记录中，跳过 {addr_name}。")
+
+    logger.info(f"目标 {target.name} 同步完成，从日志恢复 {len(journaled_names)} 个、新加载 {synced_count} 个现有的代理对象。")
+
+
+async def sync_target_ranges(target: FirewallTarget, member_names: set, journaled: Dict[str, tuple]):
+    """地址聚合模式的同步：载入地址组中的区间对象，区间内的每个IP都是一个租约"""
+    global last_error
+
+    ranges = await target.afortigate.get_address_ranges_paged("PROXY_", wanted=member_names, page_size=SYNC_PAGE_SIZE)
+    if ranges is None:
+        last_error = f"启动时同步失败（{target.name}）: 无法获取代理地址区间对象。"
+        logger.error(last_error)
+        return
+
+    runs = []
+    for addr_name, (start_ip, end_ip) in ranges.items():
+        try:
+            first, last = ip_to_int(start_ip), ip_to_int(end_ip)
+        except ValueError:
+            logger.warning(f"同步冲突：区间 {addr_name} ({start_ip}-{end_ip}) 不是 IPv4 地址，跳过。")
+            continue
+        if not 0 <= last - first < MAX_LOADED_RANGE:
+            # 不展开过大的区间（不会是本程序按客户端合并出来的），也不接管它
+            logger.warning(f"同步冲突：区间 {addr_name} ({start_ip}-{end_ip}) 超过 {MAX_LOADED_RANGE} 个IP，跳过。")
+            continue
+        client_ips = [int_to_ip(value) for value in range(first, last + 1)]
+        if any(target_for(client_ip) is not target for client_ip in client_ips):
+            logger.warning(f"同步冲突：区间 {addr_name} ({start_ip}-{end_ip}) 超出目标 {target.name} 的子网，跳过。")
+            continue
+        runs.append((addr_name, start_ip, end_ip, client_ips))
+    rejected = {name for name, _, _ in target.ranges.load((name, start, end) for name, start, end, _ in runs)}
+
+    covered = set()
+    synced_count = 0
+    for addr_name, start_ip, end_ip, client_ips in runs:
+        if addr_name in rejected:
+            logger.warning(f"同步冲突：区间 {addr_name} ({start_ip}-{end_ip}) 与其他区间重叠，跳过。")
+            continue
+        for client_ip in client_ips:
+            covered.add(client_ip)
+            address_objects[client_ip] = addr_name
+            if client_ip not in journaled:
+                schedule_cleanup(client_ip)
+                synced_count += 1
+
+    # 日志中有、但已不在任何区间中的租约从本地移除
+    for client_ip in journaled:
+        if target_for(client_ip) is target and client_ip not in covered:
+            drop_lease(client_ip)
+            logger.info(f"租约 {client_ip} 已不在地址组的区间中，移除本地记录。")
+
+    logger.info(f"目标 {target.name} 同步完成，载入 {len(runs) - len(rejected)} 个区间，新加载 {synced_count} 个租约。")
+
+
+async def run_startup_sync():
+    """后台执行启动同步，结束后（无论成功与否）将应用标记为就绪"""
+    global startup_phase, sync_duration, last_error
+    started = time.monotonic()
+    try:
+        await sync_from_fortigate()
+    except Exception as e:
+        last_error = f"启动同步异常: {str(e)}"
+        logger.error(last_error)
+    finally:
+        sync_duration = time.monotonic() - started
+        startup_phase = "ready"
+        ready_event.set()
+        for client_ip in event_hub.client_ips():
+            event_hub.publish(client_ip, "lease", await run_shared(lease_state, client_ip))
+        logger.info(f"启动同步结束，耗时 {sync_duration:.2f} 秒，服务已就绪。")
+
+
+async def wait_until_ready():
+    """在启动同步完成前到达的请求共享同一个就绪事件等待，超时返回503"""
+    if ready_event.is_set():
+        return
+    try:
+        await asyncio.wait_for(ready_event.wait(), timeout=READY_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="服务正在与Fortigate同步，请稍后重试"
+        )
+
+
+async def run_reconciler():
+    """
+    后台核对：定期把本地租约与各目标防火墙上的地址组成员、PROXY_* 对象比对并修复偏差。
+    优先级低于用户请求：只在主节点、启动同步完成后运行，目标的提交或清理队列繁忙时推迟到下一轮。
+    """
+    suspects: Dict[str, set] = {}  # 目标名称 -> 上一轮发现、尚待确认的偏差
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        if not is_leader or not ready_event.is_set():
+            continue
+        for target in list(targets.values()):
+            # 聚合模式下地址对象按区间管理，不参与按对象的核对
+            if target.mode != "full" or target.aggregating or target.breaker.state != CircuitBreaker.CLOSED:
+                continue
+            if target.group_commit.pending_count() or cleanup_pool.qsize():
+                logger.info(f"目标 {target.name} 正忙，推迟本轮核对。")
+                continue
+            try:
+                suspects[target.name] = await reconcile_target(target, suspects.get(target.name, set()))
+            except Exception as e:
+                logger.error(f"目标 {target.name} 核对异常: {str(e)}")
+
+
+async def reconcile_target(target: FirewallTarget, previous: set) -> set:
+    """
+    核对一个目标，返回本轮发现的偏差 (类型, 对象名称, IP)：
+    stale   本地有租约、地址组中已没有（管理员手动移除等），只移除本地记录
+    unknown 地址组中有、本地没有租约（连接中途崩溃等），重新接管；该IP已有其他租约时移出地址组并删除
+    orphan  既不在地址组、也不在对象池中的 PROXY_* 对象（删除失败等遗留），放回对象池或删除
+    进行中的连接与清理也会短暂表现为偏差，因此同一偏差连续两轮出现才修复，每轮最多修复 RECONCILE_MAX_CHANGES 项。
+    """
+    # 先取本地快照再读取防火墙：快照中的租约在读取之前就已经加入了地址组
+    leases = await run_shared(lambda: {ip: name for ip, name in list(address_objects.items()) if target_for(ip) is target})
+    group = await target.afortigate.get_address_group(target.group_name)
+    if group is None:
+        return previous
+    objects = await target.afortigate.get_address_objects_paged("PROXY_", page_size=SYNC_PAGE_SIZE)
+    if objects is None:
+        return previous
+    target.address_cache.store_members(group["member"], group["revision"])
+
+    members = {member.get("name") for member in group["member"] if member.get("name", "").startswith("PROXY_")}
+    leased_names = set(leases.values())
+    pool = target.address_pool
+    drift = {("stale", name, ip) for ip, name in leases.items() if name not in members}
+    drift.update(("unknown", name, objects[name]) for name in members - leased_names if name in objects)
+    drift.update(
+        ("orphan", name, ip) for name, ip in objects.items()
+        if name not in members and name not in leased_names and not (pool is not None and name in pool)
+    )
+
+    confirmed = sorted(drift & previous)[:RECONCILE_MAX_CHANGES]
+    if confirmed:
+        await repair_drift(target, confirmed)
+    elif drift:
+        logger.info(f"目标 {target.name} 发现 {len(drift)} 项疑似偏差，下一轮确认。")
+    return drift
+
+
+def repair_local_drift(target: FirewallTarget, confirmed: List[tuple], counts: dict) -> Tuple[list, list]:
+    """修复偏差中只涉及本地租约的部分，返回需要移出地址组的对象与需要删除的对象"""
+    removals, deletions = [], []
+    for kind, name, client_ip in confirmed:
+        if kind == "stale":
+            # 不在时间轮中说明正在清理，交给清理任务处理
+            if address_objects.get(client_ip) == name and client_ip in lease_timer:
+                drop_lease(client_ip)
+                counts["dropped"] += 1
+        elif kind == "unknown":
+            if target_for(client_ip) is not target:
+                logger.warning(f"核对：{name} -> {client_ip} 不属于目标 {target.name} 的子网，跳过。")
+            elif client_ip not in address_objects:
+                address_objects[client_ip] = name
+                target.address_cache.put_object(name, client_ip)
+                schedule_cleanup(client_ip)
+                counts["adopted"] += 1
+            elif address_objects.get(client_ip) != name:
+                removals.append(name)
+        elif kind == "orphan":
+            # 快照之后可能已被新的租约使用（例如从对象池取出），按名称再确认一次
+            if address_objects.ip_for(name) is None:
+                deletions.append(name)
+    return removals, deletions
+
+
+async def repair_drift(target: FirewallTarget, confirmed: List[tuple]):
+    """修复已确认的偏差：地址组移除经由批量提交引擎合并为一次写入，对象删除批量执行"""
+    counts = {"dropped": 0, "adopted": 0, "removed": 0, "deleted": 0}
+    removals, deletions = await run_shared(repair_local_drift, target, confirmed, counts)
+    if removals:
+        results = await asyncio.gather(
+            *(asyncio.wrap_future(target.group_commit.submit_remove(name)) for name in removals)
+        )
+        removed = [name for name, ok in zip(removals, results) if ok]
+        counts["removed"] = len(removed)
+        deletions.extend(removed)
+    if deletions:
+        await asyncio.to_thread(release_address_objects, target, deletions)
+        counts["deleted"] = len(deletions)
+
+    for action, count in counts.items():
+        if count:
+            RECONCILE_REPAIRS.labels(action).inc(count)
+    logger.info(f"目标 {target.name} 核对修复完成: {counts}")
+
+
+def start_leader_components():
+    """启动只在主节点运行的组件：各目标的地址组批量提交、租约到期时间轮和清理工作线程池"""
+    for target in targets.values():
+        target.group_commit.start()
+        if target.ranges is not None:
+            target.ranges.start()
+    lease_timer.start()
+    logger.info("Lease timer wheel started.")
+    cleanup_pool.start()
+    logger.info(f"Cleanup worker pool started ({CLEANUP_WORKERS} workers).")
+
+
+def stop_leader_components():
+    lease_timer.stop()
+    cleanup_pool.stop()
+    for target in targets.values():
+        if target.ranges is not None:
+            target.ranges.stop()
+        target.group_commit.stop()
+
+
+async def try_acquire_leadership():
+    """竞选或续约主节点；角色发生变化时启动或停止主节点组件"""
+    global is_leader
+    try:
+        acquired = await asyncio.to_thread(shared_state.acquire_leadership, NODE_ID, LEADER_LEASE_TTL)
+    except Exception as e:
+        logger.error(f"主节点竞选异常: {str(e)}")
+        acquired = False
+
+    if acquired and not is_leader:
+        is_leader = True
+        logger.info(f"本节点 {NODE_ID} 成为主节点。")
+        start_leader_components()
+        leader_tasks.append(asyncio.create_task(run_lease_feed(shared_state.current_seq())))
+        leader_tasks.append(asyncio.create_task(run_intent_consumer()))
+        if ready_event.is_set():
+            # 运行中接替主节点：从共享状态恢复租约并与防火墙核对
+            leader_tasks.append(asyncio.create_task(sync_from_fortigate()))
+    elif not acquired and is_leader:
+        is_leader = False
+        logger.warning(f"本节点 {NODE_ID} 失去主节点身份，停止到期清理与地址组提交。")
+        for task in leader_tasks:
+            task.cancel()
+        leader_tasks.clear()
+        await asyncio.to_thread(stop_leader_components)
+
+
+async def run_leader_election():
+    """定期续约主节点租约（其他 worker 则在主节点租约过期后接替）"""
+    while True:
+        await asyncio.sleep(LEADER_LEASE_TTL / 3)
+        await try_acquire_leadership()
+
+
+async def run_lease_feed(seq: int):
+    """主节点：把其他 worker 创建或续期的租约同步到本节点的时间轮"""
+    while True:
+        await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+        try:
+            seq, changes = await asyncio.to_thread(shared_state.changes_since, seq)
+            for client_ip, expires_at in changes:
+                lease_timer.schedule(client_ip, expires_at)
+        except Exception as e:
+            logger.error(f"租约变更跟踪异常: {str(e)}")
+
+
+async def run_intent_consumer():
+    """主节点：执行其他 worker 提交的地址组加入与手动断开操作"""
+    while True:
+        try:
+            intents = await asyncio.to_thread(shared_state.claim_intents, 100, SHARED_INTENT_TIMEOUT)
+        except Exception as e:
+            logger.error(f"读取意图队列异常: {str(e)}")
+            intents = []
+        if not intents:
+            await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+            continue
+        await asyncio.gather(*(handle_intent(intent) for intent in intents))
+
+
+async def handle_intent(intent):
+    ok, result = False, {}
+    try:
+        if intent.kind == "group_add":
+            ok = await asyncio.wrap_future(target_for(intent.client_ip).group_commit.submit_add(intent.name))
+        elif intent.kind == "discard":
+            ok = await discard_address_object(target_for(intent.client_ip), intent.client_ip, intent.name)
+        elif intent.kind == "release":
+            if await lease_name(intent.client_ip) is not None:
+                result = await release_lease(intent.client_ip)
+                ok = True
+            else:
+                result = {"status_code": status.HTTP_404_NOT_FOUND, "detail": "没有找到活动的代理连接"}
+    except HTTPException as e:
+        result = {"status_code": e.status_code, "detail": e.detail}
+    except Exception as e:
+        result = {"status_code": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": f"内部错误: {str(e)}"}
+    await asyncio.to_thread(shared_state.complete_intent, intent.id, ok, result)
+
+
+async def submit_intent(kind: str, client_ip: Optional[str] = None, name: Optional[str] = None) -> tuple:
+    """非主节点：把操作交给主节点执行并等待结果，返回 (是否成功, 结果)"""
+    intent_id = await asyncio.to_thread(shared_state.submit_intent, kind, client_ip, name)
+    deadline = time.monotonic() + SHARED_INTENT_TIMEOUT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(SHARED_STATE_POLL_INTERVAL)
+        result = await asyncio.to_thread(shared_state.intent_result, intent_id)
+        if result is not None:
+            return result
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="等待主节点处理超时，请稍后重试"
+    )
+
+
+async def add_to_group(target: FirewallTarget, client_ip: str, address_name: str) -> bool:
+    """把地址对象加入目标的地址组：主节点经由批量提交引擎，其他 worker 交给主节点执行"""
+    with span("group_commit"):
+        if is_leader:
+            return await asyncio.wrap_future(target.group_commit.submit_add(address_name))
+        ok, _ = await submit_intent("group_add", client_ip, address_name)
+        return ok
+
+
+async def discard_address_object(target: FirewallTarget, client_ip: str, address_name: str) -> bool:
+    """把已加入地址组、但没有租约指向的地址对象移出地址组并释放（放回对象池或删除）；非主节点交给主节点执行"""
+    if not is_leader:
+        ok, _ = await submit_intent("discard", client_ip, address_name)
+        return ok
+    if not await asyncio.wrap_future(target.group_commit.submit_remove(address_name)):
+        return False
+    if target.mode == "full":
+        await asyncio.to_thread(release_address_objects, target, [address_name])
+    return True
+
+
+async def record_lease(target: FirewallTarget, client_ip: str, address_name: str) -> str:
+    """
+    记录新租约 IP -> 地址对象名称，返回最终使用的名称。
+    多 worker 部署时同一IP的首次连接可能在两个 worker 上并发（进程内的请求合并管不到），各自创建了地址对象：
+    先记录的一方生效，后记录的一方改用其名称，并释放自己创建的对象
+    """
+    if shared_state is None:
+        address_objects[client_ip] = address_name
+        return address_name
+    winner = await asyncio.to_thread(shared_state.claim_lease, client_ip, address_name)
+    if winner != address_name:
+        logger.info(f"IP {client_ip} 的租约已由其他 worker 记录为 {winner}，释放本次创建的 {address_name}。")
+        try:
+            if not await discard_address_object(target, client_ip, address_name):
+                logger.warning(f"释放多余的地址对象 {address_name} 失败，将由后台核对清理。")
+        except HTTPException as e:
+            logger.warning(f"释放多余的地址对象 {address_name} 失败（{e.detail}），将由后台核对清理。")
+    return winner
+
+
+async def release_lease(client_ip: str) -> dict:
+    """主节点：取消到期计时并提交高优先级的清理任务，等待清理完成（失败时抛出 HTTPException）"""
+    # 从时间轮中移除清理任务
+    if lease_timer.cancel(client_ip):
+        logger.info(f"已从时间轮中移除对 {client_ip} 的清理任务。")
+
+    # 创建Future对象等待清理完成
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    
+    # 创建清理任务
+    task = CleanupTask(client_ip=client_ip, futures=[future], is_manual=True, trace=current_trace())
+    cleanup_pool.submit(task)
+    
+    # 等待清理完成
+    return await future
+
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request):
+    """根端点，提供前端页面（内存中的预压缩副本，支持 ETag/304）"""
+    if index_page.stale():
+        try:
+            await asyncio.to_thread(index_page.load)
+            logger.info("前端页面已重新加载。")
+        except FileNotFoundError:
+            pass
+    bodies, etags = index_page.bodies, index_page.etags
+    if bodies:
+        encoding = index_page.negotiate(request.headers.get("accept-encoding", ""))
+        headers = {"ETag": etags[encoding], "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if index_page.not_modified(request.headers.get("if-none-match", "")):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(bodies[encoding], media_type="text/html; charset=utf-8", headers=headers)
+    else:
+        return HTMLResponse("""
+        <html>
+        <head><title>Fortigate Proxy Manager</title></head>
+        <body>
+        <h1>Fortigate Proxy Manager</h1>
+        <p>前端页面未找到，请确保 index.html 文件存在</p>
+        <p><a href="/api">API 文档</a></p>
+        </body>
+        </html>
+        """)
+
+
+@app.get("/api")
+async def api_info():
+    """API信息端点"""
+    return {
+        "service": "Fortigate Proxy Manager",
+        "version": "1.0.0",
+        "endpoints": {
+            "/connect": "Connect and create proxy address object",
+            "/disconnect": "Disconnect and cleanup address object", 
+            "/status": "Check connection status",
+            "/operations/{id}": "Progress of an asynchronous connect",
+            "/events": "Server-Sent Events stream of lease state (and health snapshots)",
+            "/ready": "Readiness check (startup sync finished)",
+            "/health": "Health check endpoint",
+            "/metrics": "Prometheus metrics",
+            "/debug/traces": "Slowest sampled traces with per-stage timing",
+            "/admin/leases": "Bulk provision (POST), revoke (POST /admin/leases/revoke) and list leases; requires ADMIN_API_TOKEN"
+        },
+        "fortigate_ip": FORTIGATE_IP,
+        "address_group": ADDRESS_GROUP_NAME,
+        "timer_duration_hours": TIMER_DURATION / 3600,
+        "targets": {
+            target.name: {"host": target.host, "address_group": target.group_name, "duration": target.duration}
+            for target in targets.values()
+        },
+        "routes": {subnet: target.name for subnet, target in route_table.routes()}
+    }
+
+
+async def establish_lease(target: FirewallTarget, client_ip: str, duration: Optional[float] = None,
+                          barrier: Optional["BulkBarrier"] = None) -> dict:
+    """
+    为新的IP创建（或从对象池领取）地址对象并加入目标的地址组，失败时抛出 HTTPException
+    duration 为租约时长（默认为目标的时长）；批量开通时给出 barrier，所有IP的地址对象就绪后再一起加入地址组
+    """
+    afortigate, address_cache, address_pool = target.afortigate, target.address_cache, target.address_pool
+    # 生成地址对象名称，严格遵守 PROXY_uuid.uuid4() 格式（对象池中的对象同样如此）
+    address_name = f"PROXY_{uuid.uuid4()}"
+    
+    if target.aggregating:
+        # 地址聚合模式：并入相邻的区间对象（或新建一个区间），区间引擎负责地址对象与地址组
+        if not is_ipv4(client_ip):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="地址聚合模式只支持 IPv4 客户端"
+            )
+        if barrier is not None:
+            await barrier.wait(client_ip)
+        with span("range_commit"):
+            address_name = await asyncio.wrap_future(target.ranges.submit_add(client_ip))
+        if address_name is None:
+            ensure_available(target)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="添加到地址区间失败"
+            )
+    else:
+        # 完整模式：优先从对象池领取并改写地址，否则创建地址对象，然后添加到地址组
+        if target.mode == "full":
+            pooled_name = address_pool.claim() if address_pool is not None and is_leader else None
+            if pooled_name and await afortigate.update_address_object(pooled_name, client_ip):
+                address_name = pooled_name
+            else:
+                if pooled_name:
+                    logger.warning(f"改写池中的地址对象 {pooled_name} 失败，改为新建地址对象")
+                if not await afortigate.create_address_object(address_name, client_ip):
+                    ensure_available(target)
+                    raise HTTPException(
+                        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                        detail="创建地址对象失败"
+                    )
+            address_cache.put_object(address_name, client_ip)
+        
+        if barrier is not None:
+            await barrier.wait(client_ip)
+        # 经由批量提交引擎加入地址组，等待包含本次变更的那次刷新完成
+        if not await add_to_group(target, client_ip, address_name):
+            # 如果添加到地址组失败，且是完整模式，则删除刚创建的地址对象
+            if target.mode == "full":
+                if await afortigate.delete_address_object(address_name):
+                    address_cache.remove_object(address_name)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="添加到地址组失败"
+            )
+    
+    # 记录地址对象 (IP -> 地址对象名称)
+    address_name = await record_lease(target, client_ip, address_name)
+    
+    # 安排清理任务
+    await run_shared(schedule_cleanup, client_ip, expires_at=time.time() + duration if duration else None)
+    LEASE_EVENTS.labels("connect").inc()
+    event_hub.publish(client_ip, "lease", await run_shared(lease_state, client_ip))
+    
+    return {
+        "message": "代理连接成功",
+        "client_ip": client_ip,
+        "address_name": address_name,
+        "mode": target.mode,
+        "cleanup_in_seconds": duration or target.duration
+    }
+
+
+async def ensure_connected(target: FirewallTarget):
+    """还没有连接到目标的Fortigate时先连接，失败时抛出 503"""
+    global last_error
+    if target.fortigate:
+        return
+    test_result = await connect_fortigate(target)
+    if not test_result["success"]:
+        last_error = test_result["error"]
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"无法连接到Fortigate: {test_result['error']}"
+        )
+
+
+async def renew_lease(target: FirewallTarget, client_ip: str, duration: Optional[float] = None) -> dict:
+    """
+    已有租约只重置到期时间（续期）。未给出 duration 时按目标的时长续期，
+    且刚续期过（到期时间几乎不变）的不再重置计时和写入持久化状态
+    """
+    address_name = await run_shared(address_objects.__getitem__, client_ip)
+    remaining = await run_shared(lease_remaining, client_ip)
+    if duration is None and remaining is not None and target.duration - remaining <= RENEW_DEDUPE_SLACK:
+        CONNECT_SHORTCUTS.labels("renew_deduped").inc()
+        cleanup_in_seconds = int(remaining)
+    else:
+        await run_shared(schedule_cleanup, client_ip, expires_at=time.time() + duration if duration else None)  # 重置计时器
+        LEASE_EVENTS.labels("renew").inc()
+        event_hub.publish(client_ip, "lease", await run_shared(lease_state, client_ip))
+        logger.info(f"IP {client_ip} 的连接已存在，重置计时器。")
+        cleanup_in_seconds = duration or target.duration
+    return {
+        "message": "代理连接已续期",
+        "client_ip": client_ip,
+        "address_name": address_name,
+        "mode": target.mode,
+        "cleanup_in_seconds": cleanup_in_seconds
+    }
+
+
+async def connect_lease(client_ip: str) -> dict:
+    """为IP建立或续期租约（等待就绪、连接防火墙、写入地址对象与地址组），失败时抛出 HTTPException"""
+    # 启动同步尚未完成时等待，避免把已有连接当作新连接重复创建
+    with span("ready_wait"):
+        await wait_until_ready()
+    
+    # 如果还没有连接到该IP所属目标的Fortigate，先连接
+    target = target_for(client_ip)
+    await ensure_connected(target)
+
+    # 检查IP是否已经存在活动连接，如果存在则只重置计时器（续期）
+    if await lease_name(client_ip) is not None:
+        return await renew_lease(target, client_ip)
+    
+    # 新连接需要写防火墙，防火墙熔断期间快速失败（续期只改本地状态，不受影响）
+    ensure_available(target)
+    
+    # 同一IP并发的首次连接共用一次防火墙操作，避免创建两个 PROXY_* 对象
+    if client_ip in connect_flight:
+        CONNECT_SHORTCUTS.labels("coalesced").inc()
+    return await connect_flight.do(client_ip, lambda: establish_lease(target, client_ip))
+
+
+async def run_connect_operation(client_ip: str) -> dict:
+    """异步连接模式下在后台执行的连接操作（单独采样调用链）"""
+    global last_error
+    with tracer.trace("connect_operation", client_ip=client_ip):
+        try:
+            return await connect_lease(client_ip)
+        except HTTPException:
+            raise
+        except Exception as e:
+            last_error = f"连接异常: {str(e)}"
+            logger.error(last_error)
+            raise
+
+
+def wants_async_connect(request: Request) -> bool:
+    """CONNECT_ASYNC 开启，或请求带有 Prefer: respond-async 时使用异步连接"""
+    return CONNECT_ASYNC or "respond-async" in request.headers.get("prefer", "")
+
+
+def publish_operation(operation: Operation):
+    """后台操作结束时推送给该IP的 /events 订阅者"""
+    event_hub.publish(operation.key, "operation", operation.to_dict())
+
+
+@app.post("/connect")
+async def connect_proxy(request: Request):
+    """
+    连接代理并创建地址对象
+
+    异步模式下（见 wants_async_connect），需要写防火墙的连接立即返回 202 和操作ID，
+    防火墙操作在后台执行，进度可通过 /operations/{id}、/status 或 /events 获取；续期仍直接返回 200。
+    """
+    global last_error
+    
+    try:
+        # 获取客户端IP
+        client_ip = request.client.host if request.client else "127.0.0.1"
+        
+        # 按IP限流，防止页面异常或多个标签页在循环中反复调用
+        if connect_limiter is not None:
+            allowed, retry_after = connect_limiter.acquire(client_ip)
+            if not allowed:
+                CONNECT_SHORTCUTS.labels("rate_limited").inc()
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="请求过于频繁，请稍后再试",
+                    headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+                )
+        
+        if not wants_async_connect(request) or (ready_event.is_set() and await lease_name(client_ip) is not None):
+            return await connect_lease(client_ip)
+        
+        # 异步连接：防火墙熔断时仍然快速失败，而不是登记一个注定失败的操作
+        ensure_available(target_for(client_ip))
+        operation = connect_operations.submit("connect", client_ip, lambda: run_connect_operation(client_ip))
+        if operation is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="待处理的连接过多，请稍后重试",
+                headers={"Retry-After": "1"}
+            )
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={
+                "message": "代理连接处理中",
+                "client_ip": client_ip,
+                "operation_id": operation.id,
+                "status_url": f"/operations/{operation.id}",
+                "lease": await run_shared(lease_state, client_ip)
+            },
+            headers={"Location": f"/operations/{operation.id}"}
+        )
+        
     except HTTPException:
         raise
     except Exception as e:
@@ -612,35 +2194,54 @@ async def connect_proxy(request: Request):
             detail=f"内部错误: {str(e)}"
         )
 
+
+@app.get("/operations/{operation_id}")
+async def get_operation(operation_id: str):
+    """异步连接操作的状态（pending / succeeded / failed）与结果，完成后保留 OPERATION_RETENTION 秒"""
+    operation = connect_operations.get(operation_id)
+    if operation is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="操作不存在或已过期"
+        )
+    return operation.to_dict()
+
+async def disconnect_lease(client_ip: str) -> dict:
+    """移出地址组并清理IP的租约（非主节点交给主节点执行），失败时抛出 HTTPException"""
+    if await lease_name(client_ip) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="没有找到活动的代理连接"
+        )
+    
+    ensure_available(target_for(client_ip))
+    
+    if is_leader:
+        with span("cleanup"):
+            return await release_lease(client_ip)
+
+    # 非主节点：交给主节点清理
+    with span("cleanup"):
+        ok, result = await submit_intent("release", client_ip)
+    if not ok:
+        raise HTTPException(
+            status_code=result.get("status_code", status.HTTP_500_INTERNAL_SERVER_ERROR),
+            detail=result.get("detail", "清理操作失败")
+        )
+    return result
+
+
 @app.post("/disconnect")
 async def disconnect_proxy(request: Request):
     """断开代理连接并清理地址对象"""
     try:
         client_ip = request.client.host if request.client else "127.0.0.1"
         
-        if client_ip not in address_objects:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="没有找到活动的代理连接"
-            )
-        
-        # 从调度器中移除计划任务
-        if scheduler.get_job(client_ip):
-            scheduler.remove_job(client_ip)
-            logger.info(f"已从调度器中移除对 {client_ip} 的清理任务。")
-
-        # 创建Future对象等待清理完成
-        loop = asyncio.get_event_loop()
-        future = loop.create_future()
-        
-        # 创建清理任务
-        task = CleanupTask(client_ip=client_ip, future=future, is_manual=True)
-        cleanup_queue.put(task)
+        # 启动同步完成前本地记录不完整，先等待就绪
+        with span("ready_wait"):
+            await wait_until_ready()
         
-        # 等待清理完成
-        result = await future
-        
-        return result
+        return await disconnect_lease(client_ip)
         
     except HTTPException:
         raise
@@ -658,24 +2259,22 @@ async def get_status(request: Request):
     """获取连接状态"""
     try:
         client_ip = request.client.host if request.client else "127.0.0.1"
-        timer_remaining = None
-        
-        job = scheduler.get_job(client_ip)
-        if job:
-            # 使用调度器的时区来获取当前时间，以保证一致性
-            now = datetime.now(scheduler.timezone)
-            remaining = job.next_run_time - now
-            timer_remaining = max(0, remaining.total_seconds())
+        lease = await run_shared(lease_state, client_ip)
+        target = target_for(client_ip)
+        operation = connect_operations.latest(client_ip)
 
         return {
-            "connected": fortigate is not None,
+            "connected": target.fortigate is not None,
             "client_ip": client_ip,
-            "has_active_proxy": client_ip in address_objects,
-            "host": FORTIGATE_IP,
-            "address_group": ADDRESS_GROUP_NAME,
-            "mode": fortigate.mode if fortigate else "unknown",
-            "address_name": address_objects.get(client_ip),
-            "timer_remaining": timer_remaining
+            "has_active_proxy": lease["has_active_proxy"],
+            "host": target.host,
+            "address_group": target.group_name,
+            "target": target.name,
+            "mode": target.mode,
+            "address_name": lease["address_name"],
+            "timer_remaining": lease["timer_remaining"],
+            "operation": operation.to_dict() if operation is not None else None,
+            "ready": ready_event.is_set()
         }
         
     except Exception as e:
@@ -687,33 +2286,298 @@ async def get_status(request: Request):
         )
 
 
+class BulkBarrier:
+    """
+    批量开通的汇合点：每个IP的地址对象就绪（或确定不再需要）时到达，全部到达后才一起提交地址组变更，
+    使它们落在同一个批量提交窗口中，合并为一次（超过 GROUP_COMMIT_MAX_BATCH 时为几次）地址组更新
+    """
+
+    def __init__(self, keys):
+        self._pending = set(keys)
+        self._event = asyncio.Event()
+        if not self._pending:
+            self._event.set()
+
+    def arrive(self, key):
+        self._pending.discard(key)
+        if not self._pending:
+            self._event.set()
+
+    async def wait(self, key):
+        self.arrive(key)
+        await self._event.wait()
+
+
+class BulkLeaseRequest(BaseModel):
+    """批量管理请求：IP列表和/或网段；开通时可以指定租约时长（秒，默认为各IP所属目标的时长）"""
+    ips: List[str] = []
+    cidrs: List[str] = []
+    duration: Optional[float] = None
+
+
+def require_admin(request: Request):
+    """管理接口鉴权：Authorization: Bearer <ADMIN_API_TOKEN>；未配置令牌时管理接口不开放"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="管理接口未启用"
+        )
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), ADMIN_API_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="管理令牌无效",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+def bulk_client_ips(body: BulkLeaseRequest, leased_only: bool) -> List[str]:
+    """
+    批量请求涉及的IP（去重并保持顺序）：ips 中的地址加上 cidrs 网段内的地址，总数不超过 ADMIN_BULK_MAX_IPS。
+    leased_only 为 True（撤销）时网段只匹配已有租约的IP，而不是展开整个网段
+    """
+    try:
+        client_ips = dict.fromkeys(str(ipaddress.ip_address(ip.strip())) for ip in body.ips)
+        networks = [ipaddress.ip_network(cidr.strip(), strict=False) for cidr in body.cidrs]
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"无效的IP或网段: {str(e)}"
+        )
+    if leased_only and networks:
+        for client_ip in list(address_objects):
+            try:
+                address = ipaddress.ip_address(client_ip)
+            except ValueError:
+                continue
+            if any(address in network for network in networks):
+                client_ips[client_ip] = None
+    elif networks:
+        if sum(network.num_addresses for network in networks) > ADMIN_BULK_MAX_IPS + 2 * len(networks):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"网段过大，一次最多 {ADMIN_BULK_MAX_IPS} 个IP"
+            )
+        for network in networks:
+            client_ips.update(dict.fromkeys(str(host) for host in network.hosts()))
+    if len(client_ips) > ADMIN_BULK_MAX_IPS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"一次最多 {ADMIN_BULK_MAX_IPS} 个IP"
+        )
+    return list(client_ips)
+
+
+async def provision_lease(client_ip: str, duration: Optional[float], barrier: BulkBarrier) -> dict:
+    """批量开通中的一个IP：已有租约的按 duration 续期，否则建立新租约（与同一IP进行中的 /connect 共用一次防火墙操作）"""
+    try:
+        target = target_for(client_ip)
+        await ensure_connected(target)
+        if await lease_name(client_ip) is not None:
+            return await renew_lease(target, client_ip, duration)
+        ensure_available(target)
+        coalesced = client_ip in connect_flight
+        result = await connect_flight.do(client_ip, lambda: establish_lease(target, client_ip, duration, barrier))
+        # 并入的是进行中的 /connect（按目标的时长建立），再按请求的时长续期
+        return await renew_lease(target, client_ip, duration) if coalesced and duration else result
+    finally:
+        barrier.arrive(client_ip)
+
+
+def bulk_response(client_ips: List[str], operation) -> StreamingResponse:
+    """并发执行每个IP的操作，按完成顺序以 NDJSON 逐行返回结果，最后一行是汇总"""
+    async def run(client_ip: str) -> dict:
+        try:
+            return {"client_ip": client_ip, "ok": True, "status_code": 200, "result": await operation(client_ip)}
+        except HTTPException as e:
+            return {"client_ip": client_ip, "ok": False, "status_code": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"批量操作 {client_ip} 异常: {str(e)}")
+            return {"client_ip": client_ip, "ok": False, "status_code": 500, "detail": f"内部错误: {str(e)}"}
+
+    async def stream():
+        started = time.perf_counter()
+        tasks = [asyncio.ensure_future(run(client_ip)) for client_ip in client_ips]
+        for task in tasks:
+            bulk_tasks.add(task)
+            task.add_done_callback(bulk_tasks.discard)
+        succeeded = 0
+        for next_result in asyncio.as_completed(tasks):
+            line = await next_result
+            succeeded += line["ok"]
+            yield (json.dumps(line, ensure_ascii=False) + "\n").encode()
+        summary = {
+            "total": len(client_ips),
+            "succeeded": succeeded,
+            "failed": len(client_ips) - succeeded,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+        yield (json.dumps({"summary": summary}, ensure_ascii=False) + "\n").encode()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/admin/leases", dependencies=[Depends(require_admin)])
+async def admin_provision_leases(body: BulkLeaseRequest):
+    """
+    批量开通（或续期）租约：所有新地址对象并发创建，全部就绪后一起加入地址组（一次批量提交），
+    每个IP的结果按完成顺序以 NDJSON 逐行返回
+    """
+    if body.duration is not None and body.duration <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="duration 必须大于 0"
+        )
+    client_ips = bulk_client_ips(body, leased_only=False)
+    await wait_until_ready()
+    barrier = BulkBarrier(client_ips)
+    return bulk_response(client_ips, lambda client_ip: provision_lease(client_ip, body.duration, barrier))
+
+
+@app.post("/admin/leases/revoke", dependencies=[Depends(require_admin)])
+async def admin_revoke_leases(body: BulkLeaseRequest):
+    """
+    批量撤销租约（cidrs 匹配网段内所有已有租约的IP）：清理任务同时提交，地址组移除合并为一次批量提交，
+    地址对象批量删除；每个IP的结果按完成顺序以 NDJSON 逐行返回
+    """
+    client_ips = await run_shared(bulk_client_ips, body, leased_only=True)
+    await wait_until_ready()
+    return bulk_response(client_ips, disconnect_lease)
+
+
+def ip_in_network(client_ip: str, network) -> bool:
+    try:
+        return ipaddress.ip_address(client_ip) in network
+    except ValueError:
+        return False
+
+
+@app.get("/admin/leases", dependencies=[Depends(require_admin)])
+async def admin_list_leases(limit: int = 1000, cidr: Optional[str] = None):
+    """按到期时间从早到晚列出租约（NDJSON），cidr 只列出该网段内的IP"""
+    limit = max(1, min(limit, ADMIN_BULK_MAX_IPS))
+    try:
+        network = ipaddress.ip_network(cidr, strict=False) if cidr else None
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"无效的网段: {str(e)}"
+        )
+    leases = await run_shared(lambda: address_objects.expiring(len(address_objects) if network else limit))
+    if network:
+        leases = [lease for lease in leases if ip_in_network(lease[0], network)][:limit]
+    now = time.time()
+    lines = [
+        json.dumps({
+            "client_ip": client_ip,
+            "address_name": address_name,
+            "expires_at": datetime.fromtimestamp(expires_at).isoformat(),
+            "remaining": max(0.0, round(expires_at - now, 1))
+        }, ensure_ascii=False) + "\n"
+        for client_ip, address_name, expires_at in leases
+    ]
+    return Response("".join(lines), media_type="application/x-ndjson")
+
+
+@app.get("/ready")
+async def ready():
+    """就绪检查端点：启动同步完成后返回200，之前返回503"""
+    body = {
+        "ready": ready_event.is_set(),
+        "phase": startup_phase,
+        "connected": all(target.fortigate is not None for target in targets.values()),
+        "sync_duration": sync_duration,
+        "address_objects": await run_shared(len, address_objects)
+    }
+    if not ready_event.is_set():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的运行指标"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/traces")
+async def debug_traces(name: Optional[str] = None, reset: bool = False):
+    """
+    各种调用链（POST /connect、POST /disconnect、cleanup、sync 等）中耗时最长的记录，含各阶段耗时。
+    name 只返回指定名称；reset=true 在返回后清空记录。
+    """
+    body = {
+        "sample_rate": tracer.sample_rate,
+        "sampled": tracer.sampled,
+        "traces": tracer.slowest([name] if name else None)
+    }
+    if reset:
+        tracer.reset()
+    return body
+
+
+@app.get("/events")
+async def events(request: Request, renew: bool = False, health: bool = False):
+    """
+    SSE 推送：本机IP的租约状态变化（lease 事件），health=true 时附带定时的健康快照（health 事件）。
+    renew=true 时连接打开期间由服务端自动续期，页面不需要再定时调用 /connect。
+    """
+    client_ip = request.client.host if request.client else "127.0.0.1"
+    subscriber = event_hub.subscribe(client_ip, health=health, renew=renew)
+    initial = [
+        f"retry: {EVENTS_HEARTBEAT_INTERVAL * 1000}\n\n".encode(),
+        format_event("lease", await run_shared(lease_state, client_ip))
+    ]
+    if health:
+        initial.append(format_event("health", await run_shared(health_snapshot)))
+    return StreamingResponse(
+        event_hub.stream(subscriber, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def health_snapshot() -> dict:
+    """健康状态快照（/health 端点与推送连接共用）"""
+    # 获取系统信息
+    process = psutil.Process()
+    memory_info = process.memory_info()
+    memory_usage = memory_info.rss / 1024 / 1024  # MB
+    
+    # 计算运行时间
+    uptime = datetime.now() - start_time
+    uptime_str = str(uptime).split('.')[0]  # 移除微秒
+    
+    return {
+        "status": "healthy" if all(t.breaker.state == CircuitBreaker.CLOSED for t in targets.values()) else "degraded",
+        "phase": startup_phase,
+        "connected": default_target.fortigate is not None,
+        "host": default_target.host if default_target.fortigate else None,
+        "mode": default_target.mode,
+        # 多 worker 部署时到期计时只在主节点上运行，以共享租约表中已设置到期时间的租约为准
+        "active_timers": shared_state.timed_lease_count() if shared_state is not None else len(lease_timer),
+        "address_objects": len(address_objects),
+        "queue_size": cleanup_pool.qsize(),
+        "event_streams": len(event_hub),
+        "operations": connect_operations.stats(),
+        "node": {
+            "id": NODE_ID,
+            "leader": is_leader,
+            "current_leader": shared_state.leader() if shared_state is not None else NODE_ID
+        },
+        "targets": {target.name: target.stats() for target in targets.values()},
+        "memory_usage": memory_usage,
+        "uptime": uptime_str,
+        "last_error": last_error,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
 @app.get("/health")
 async def health():
     """健康检查端点"""
     try:
-        # 获取系统信息
-        process = psutil.Process()
-        memory_info = process.memory_info()
-        memory_usage = memory_info.rss / 1024 / 1024  # MB
-        
-        # 计算运行时间
-        uptime = datetime.now() - start_time
-        uptime_str = str(uptime).split('.')[0]  # 移除微秒
-        
-        return {
-            "status": "healthy",
-            "connected": fortigate is not None,
-            "host": FORTIGATE_IP if fortigate else None,
-            "mode": fortigate.mode if fortigate else "unknown",
-            "active_timers": len(scheduler.get_jobs()),
-            "address_objects": len(address_objects),
-            "queue_size": cleanup_queue.qsize(),
-            "memory_usage": memory_usage,
-            "uptime": uptime_str,
-            "last_error": last_error,
-            "timestamp": datetime.now().isoformat()
-        }
-        
+        return await run_shared(health_snapshot)
     except Exception as e:
         logger.error(f"健康检查异常: {str(e)}")
         return {
@@ -728,6 +2592,17 @@ if __name__ == "__main__":
     logger.info(f"Fortigate: {FORTIGATE_IP}")
     logger.info(f"地址组: {ADDRESS_GROUP_NAME}")
     logger.info(f"计时器持续时间: {TIMER_DURATION}秒")
+    for _target in targets.values():
+        if _target is not default_target:
+            logger.info(f"目标 {_target.name}: {_target.group_name}@{_target.host}，租约 {_target.duration}秒")
     logger.info(f"时区: {TIMEZONE}")
     
-    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
+    if SERVER_WORKERS > 1 and shared_state is not None:
+        # 多 worker 时 uvicorn 需要以导入字符串的方式加载应用
+        logger.info(f"以 {SERVER_WORKERS} 个 worker 运行，共享状态: {SHARED_STATE_PATH}")
+        os.chdir(current_dir)
+        uvicorn.run("app:app", host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS)
+    else:
+        if SERVER_WORKERS > 1:
+            logger.warning("未配置 SHARED_STATE_PATH，多个 worker 会产生重复的租约和到期清理，仍以单进程运行。")
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
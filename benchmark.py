@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import httpx
+
+from lease_table import LeaseTable, pack_ip
+from lease_timer import LeaseTimerWheel
+from mock_fortigate import MockFortiOS, serve_in_thread
+
+
+@dataclass
+class PhaseResult:
+    """一个压测阶段的结果"""
+    name: str
+    requests: int = 0
+    errors: int = 0
+    duration: float = 0.0
+    latencies: List[float] = field(default_factory=list)  # 秒
+    status_codes: Dict[int, int] = field(default_factory=dict)
+    firewall_calls: Dict[str, int] = field(default_factory=dict)
+
+    def percentile(self, p: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def summary(self) -> dict:
+        return {
+            "phase": self.name,
+            "requests": self.requests,
+            "errors": self.errors,
+            "duration_s": round(self.duration, 3),
+            "throughput_rps": round(self.requests / self.duration, 1) if self.duration else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "max_ms": round(max(self.latencies, default=0.0) * 1000, 2),
+            "status_codes": self.status_codes,
+            "firewall_calls": self.firewall_calls,
+            "firewall_calls_total": sum(self.firewall_calls.values())
+        }
+
+
+class Benchmark:
+    """
+    在进程内驱动 app：每个模拟客户端使用独立的源IP（ASGITransport），
+    防火墙由后台线程中的 MockFortiOS 模拟，依次执行 连接 -> 续期 -> 断开 -> 到期 各阶段。
+    """
+
+    def __init__(self, app_module, mock: MockFortiOS, clients: int, concurrency: int):
+        self.m = app_module
+        self.mock = mock
+        self.ips = [f"10.{100 + i // 65024}.{i // 254 % 256}.{i % 254 + 1}" for i in range(clients)]
+        self.concurrency = concurrency
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def client(self, ip: str) -> httpx.AsyncClient:
+        if ip not in self._clients:
+            transport = httpx.ASGITransport(app=self.m.app, client=(ip, 50000))
+            self._clients[ip] = httpx.AsyncClient(transport=transport, base_url="http://proxy-manager", timeout=60)
+        return self._clients[ip]
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+
+    async def run_requests(self, name: str, ips: List[str], method: str, path: str) -> PhaseResult:
+        """对每个IP发出一次请求，并发上限为 concurrency"""
+        result = PhaseResult(name)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def one(ip: str):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await self.client(ip).request(method, path)
+                    code = response.status_code
+                except Exception:
+                    code = 0
+                result.latencies.append(time.perf_counter() - started)
+                result.status_codes[code] = result.status_codes.get(code, 0) + 1
+                if code != 200:
+                    result.errors += 1
+
+        self.mock.reset_stats()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(ip) for ip in ips))
+        result.duration = time.perf_counter() - started
+        result.requests = len(ips)
+        result.firewall_calls = dict(self.mock.calls)
+        return result
+
+    async def run_expiry(self, ips: List[str], timeout: float) -> PhaseResult:
+        """把一批租约的到期时间设为现在，测量时间轮到期 + 批量清理全部完成所需的时间"""
+        result = PhaseResult("expire")
+        self.mock.reset_stats()
+        started = time.perf_counter()
+        now = time.time()
+        for ip in ips:
+            self.m.schedule_cleanup(ip, expires_at=now, persist=False)
+        pending = set(ips)
+        while pending and time.perf_counter() - started < timeout:
+            await asyncio.sleep(0.05)
+            for ip in [ip for ip in pending if ip not in self.m.address_objects]:
+                pending.discard(ip)
+                result.latencies.append(time.perf_counter() - started)
+        result.duration = time.perf_counter() - started
+        result.requests = len(ips)
+        result.errors = len(pending)
+        result.firewall_calls = dict(self.mock.calls)
+        return result
+
+    async def run(self, renew_rounds: int, expire_timeout: float) -> List[PhaseResult]:
+        results = []
+        async with self.m.app.router.lifespan_context(self.m.app):
+            await self.m.wait_until_ready()
+            results.append(await self.run_requests("connect", self.ips, "POST", "/connect"))
+            for round_index in range(renew_rounds):
+                results.append(await self.run_requests(f"renew#{round_index + 1}", self.ips, "POST", "/connect"))
+            half = len(self.ips) // 2
+            results.append(await self.run_requests("disconnect", self.ips[:half], "POST", "/disconnect"))
+            results.append(await self.run_expiry(self.ips[half:], expire_timeout))
+            results.append(await self.run_requests("status", self.ips, "GET", "/status"))
+            await self.close()
+        return results
+
+
+def print_report(results: List[PhaseResult]):
+    header = f"{'phase':<12}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'fw calls':>10}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        s = result.summary()
+        print(f"{s['phase']:<12}{s['requests']:>9}{s['errors']:>8}{s['throughput_rps']:>10}"
+              f"{s['p50_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}{s['firewall_calls_total']:>10}")
+    print()
+    for result in results:
+        calls = ", ".join(f"{key}={value}" for key, value in sorted(result.firewall_calls.items()))
+        print(f"{result.name:<12}{calls}")
+
+
+class _SlotsLease:
+    """每个租约一个 __slots__ 记录的布局（只用于对比）"""
+    __slots__ = ("key", "name", "expires_at")
+
+    def __init__(self, key, name: str, expires_at: float):
+        self.key = key
+        self.name = name
+        self.expires_at = expires_at
+
+
+def measure_lease_table(count: int) -> List[dict]:
+    """
+    对比原来的布局（IP -> 名称 的字典，时间轮另存一份 IP -> 到期时间）、每个租约一个 __slots__ 记录的布局与 LeaseTable
+    保存 count 个租约时的内存和查找耗时。各布局共有的部分（名称字符串、时间轮的槽）不计入内存。
+    """
+    def ip_of(i: int) -> str:
+        return f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+
+    names = [f"PROXY_{uuid.uuid4()}" for _ in range(count)]
+    now = time.time()
+    timer = LeaseTimerWheel(lambda keys: None, slots=3600)
+    for i in range(count):
+        timer.schedule(ip_of(i), now + i % 7200)
+    probes = [ip_of(i) for i in range(0, count, max(1, count // 1000))]
+    wanted = names[count // 2]
+
+    # IP 字符串在构建时生成（与请求中解析出的IP一样是新对象），计入各自的内存
+    def build_dict():
+        leases, deadlines = {}, {}
+        for i in range(count):
+            ip = ip_of(i)
+            leases[ip] = names[i]
+            deadlines[ip] = now + i % 7200
+        return leases, deadlines
+
+    def build_slots():
+        records, by_name = {}, {}
+        for i in range(count):
+            record = _SlotsLease(pack_ip(ip_of(i)), names[i], now + i % 7200)
+            records[record.key] = record
+            by_name[record.name] = record
+        return records, by_name
+
+    def build_table():
+        table = LeaseTable(timer)
+        for i in range(count):
+            table[ip_of(i)] = names[i]
+        return table
+
+    def timed(fn, repeat: int) -> float:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - started) / repeat
+
+    results = []
+    for layout, build in (("dict", build_dict), ("slots", build_slots), ("lease_table", build_table)):
+        tracemalloc.start()
+        structure = build()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if layout == "dict":
+            leases, deadlines = structure
+            by_ip = lambda: [leases.get(ip) for ip in probes]
+            by_name = lambda: next(ip for ip, name in leases.items() if name == wanted)
+            earliest = lambda: sorted(deadlines.items(), key=lambda item: item[1])[:100]
+        elif layout == "slots":
+            records, by_name_index = structure
+            by_ip = lambda: [records.get(pack_ip(ip)) for ip in probes]
+            by_name = lambda: by_name_index[wanted].key
+            earliest = lambda: heapq.nsmallest(100, records.values(), key=lambda record: record.expires_at)
+        else:
+            by_ip = lambda: [structure.get(ip) for ip in probes]
+            by_name = lambda: structure.ip_for(wanted)
+            earliest = lambda: structure.expiring(100)
+        results.append({
+            "layout": layout,
+            "leases": count,
+            "bytes_per_lease": round(used / count, 1),
+            "ip_lookup_ns": round(timed(by_ip, 20) / len(probes) * 1e9, 1),
+            "name_lookup_us": round(timed(by_name, 20) * 1e6, 2),
+            "earliest_100_ms": round(timed(earliest, 3) * 1000, 2)
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在模拟的 FortiOS 上压测连接/续期/断开/到期的热路径")
+    parser.add_argument("--clients", type=int, default=1000, help="模拟的客户端IP数")
+    parser.add_argument("--concurrency", type=int, default=200, help="同时进行的请求数")
+    parser.add_argument("--renew-rounds", type=int, default=1, help="续期轮数")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟防火墙的平均响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.01, help="延迟的随机抖动范围（±秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟防火墙随机返回 500 的比例")
+    parser.add_argument("--no-transactions", action="store_true", help="模拟防火墙不支持配置事务")
+    parser.add_argument("--port", type=int, default=18443, help="模拟防火墙监听端口")
+    parser.add_argument("--journal", action="store_true", help="启用租约日志（写入临时目录）")
+    parser.add_argument("--expire-timeout", type=float, default=60.0, help="到期阶段的最长等待时间（秒）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--verbose", action="store_true", help="输出 app 的日志")
+    parser.add_argument("--lease-table", type=int, metavar="N",
+                        help="只测量保存 N 个租约时租约表的内存与查找耗时（不启动 app）")
+    args = parser.parse_args()
+
+    if args.lease_table:
+        results = measure_lease_table(args.lease_table)
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            for result in results:
+                print("  ".join(f"{key}={value}" for key, value in result.items()))
+        return
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        logging.getLogger("urllib3").setLevel(logging.ERROR)
+
+    mock = MockFortiOS(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       transactions=not args.no_transactions, group_name=app_module.ADDRESS_GROUP_NAME)
+    server = serve_in_thread(mock, port=args.port)
+
+    app_module.default_target.host = f"127.0.0.1:{args.port}"
+    app_module.FORTIGATE_SCHEME = "http"
+    journal_dir = tempfile.mkdtemp(prefix="proxy-bench-") if args.journal else None
+    app_module.lease_journal = (
+        app_module.LeaseJournal(os.path.join(journal_dir, "leases.db")) if journal_dir else None
+    )
+    if app_module.traffic_recorder:
+        app_module.traffic_recorder.enabled = False  # 压测请求不写入流量记录
+
+    benchmark = Benchmark(app_module, mock, args.clients, args.concurrency)
+    try:
+        results = asyncio.run(benchmark.run(args.renew_rounds, args.expire_timeout))
+    finally:
+        server.should_exit = True
+
+    if args.json:
+        print(json.dumps([result.summary() for result in results], ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import heapq
+import itertools
+import threading
+import zlib
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_MANUAL = 0  # 手动断开连接，优先处理
+PRIORITY_TIMER = 1  # 计时器到期
+
+
+class _Shard:
+    """一个工作线程负责的分片：优先队列 + 每个IP至多一个待处理任务"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.heap: list = []  # (优先级, 序号, IP)
+        self.pending: Dict[str, object] = {}  # IP -> 待处理的清理任务
+
+
+class CleanupDispatcher:
+    """
+    清理任务工作线程池
+
+    按客户端IP分片，同一IP的任务总是由同一个工作线程按顺序处理，不同IP之间并行；
+    同一IP尚未处理的重复任务会合并为一个，手动断开连接优先于计时器到期。
+    工作线程每次取出同一优先级的一批任务（最多 max_batch 个）交给 handler，便于批量清理。
+    任务对象需要有 client_ip、is_manual 和 futures 属性。
+    停止时尚未处理的任务（以及停止后提交的任务）交给 abandon，由调用方通知等待者。
+    """
+
+    def __init__(self, handler: Callable[[list], None], workers: int = 4, max_batch: int = 200,
+                 abandon: Optional[Callable[[list], None]] = None):
+        self.handler = handler
+        self.abandon = abandon
+        self.max_batch = max(1, max_batch)
+        self._shards = [_Shard() for _ in range(max(1, workers))]
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._stopped = False  # stop() 之后、下一次 start() 之前
+        self.merged_count = 0  # 被合并的重复任务数
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._stopped = False
+        for i, shard in enumerate(self._shards):
+            thread = threading.Thread(target=self._run, args=(shard,), name=f"cleanup-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """停止工作线程（正在处理的批次会完成），尚未处理的任务交给 abandon"""
+        self._running = False
+        self._stopped = True
+        for shard in self._shards:
+            with shard.cond:
+                shard.cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+        abandoned = []
+        for shard in self._shards:
+            with shard.cond:
+                abandoned.extend(shard.pending.values())
+                shard.pending.clear()
+                shard.heap.clear()
+        self._abandon(abandoned)
+
+    def _abandon(self, tasks: list):
+        if not tasks or self.abandon is None:
+            return
+        try:
+            self.abandon(tasks)
+        except Exception as e:
+            logger.error(f"放弃清理任务时异常: {str(e)}")
+
+    def qsize(self) -> int:
+        """等待处理的任务数"""
+        return sum(len(shard.pending) for shard in self._shards)
+
+    def _shard_for(self, client_ip: str) -> _Shard:
+        return self._shards[zlib.crc32(client_ip.encode()) % len(self._shards)]
+
+    def submit(self, task) -> None:
+        """提交清理任务；同一IP已有待处理任务时合并。已停止时直接交给 abandon"""
+        if self._stopped:
+            self._abandon([task])
+            return
+        shard = self._shard_for(task.client_ip)
+        priority = PRIORITY_MANUAL if task.is_manual else PRIORITY_TIMER
+        with shard.cond:
+            existing = shard.pending.get(task.client_ip)
+            if existing is not None:
+                self.merged_count += 1
+                existing.futures.extend(task.futures)
+                if task.is_manual and not existing.is_manual:
+                    # 升级为手动任务，以更高优先级重新入队（旧的堆条目在弹出时被忽略）
+                    existing.is_manual = True
+                    heapq.heappush(shard.heap, (priority, next(self._seq), task.client_ip))
+                    shard.cond.notify()
+                return
+            shard.pending[task.client_ip] = task
+            heapq.heappush(shard.heap, (priority, next(self._seq), task.client_ip))
+            shard.cond.notify()
+
+    def _run(self, shard: _Shard):
+        while True:
+            with shard.cond:
+                while self._running and not shard.pending:
+                    shard.cond.wait()
+                if not self._running:
+                    return  # 剩余的任务由 stop() 交给 abandon
+                tasks = []
+                batch_priority = None
+                while shard.heap and len(tasks) < self.max_batch:
+                    priority = shard.heap[0][0]
+                    if batch_priority is not None and priority != batch_priority:
+                        break  # 手动断开不与计时器到期混在同一批，避免被大批量清理拖慢
+                    _, _, client_ip = heapq.heappop(shard.heap)
+                    task = shard.pending.pop(client_ip, None)  # 为空说明是已被处理的重复条目
+                    if task is not None:
+                        tasks.append(task)
+                        batch_priority = priority
+            if not tasks:
+                continue
+            try:
+                self.handler(tasks)
+            except Exception as e:
+                logger.error(f"清理任务处理异常: {str(e)}")
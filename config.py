@@ -17,3 +17,110 @@ SERVER_PORT = 8000
 
 # 时区配置 (例如 "Asia/Shanghai", "UTC", "America/New_York")
 TIMEZONE = "Asia/Shanghai"
+
+# 地址组批量提交：在该时间窗口（秒）内到达的增删操作会合并为一次地址组更新
+GROUP_COMMIT_WINDOW = 0.2
+GROUP_COMMIT_MAX_BATCH = 500  # 单次提交的最大操作数
+# 地址组缓存：本地写入直接更新缓存，每隔该时间（秒）与防火墙核对一次，0 表示不缓存；
+# 写入地址组前总会先核对配置版本号，版本号变化（或本进程刚写入过）时重新获取成员列表，不会覆盖外部修改
+GROUP_CACHE_TTL = 30
+
+# 启动同步时分页获取 PROXY_* 地址对象的每页数量
+SYNC_PAGE_SIZE = 500
+# 启动同步在后台进行，期间到达的连接请求最多等待该时间（秒），超时返回503
+READY_WAIT_TIMEOUT = 30
+
+# 租约日志（SQLite），重启后恢复租约的到期时间；设为 None 则不持久化
+LEASE_DB_PATH = "leases.db"
+LEASE_COMPACT_INTERVAL = 600  # 日志压缩检查间隔（秒）
+
+# 租约到期时间轮：精度（秒）与槽数，槽数 × 精度 最好不小于 TIMER_DURATION
+LEASE_TIMER_TICK = 1.0
+LEASE_TIMER_SLOTS = 3600
+
+# 清理工作线程数（不同IP的清理并行处理，同一IP保持顺序）
+CLEANUP_WORKERS = 4
+CLEANUP_BATCH_SIZE = 200  # 每个工作线程一次批量清理的最大租约数
+# 批量删除地址对象时尝试使用 FortiOS 配置事务（不支持时自动回退为并发逐个删除）
+FORTIGATE_USE_TRANSACTIONS = True
+
+# Fortigate API 调用配置
+FORTIGATE_SCHEME = "https"  # API 协议，对接本地模拟服务器（mock_fortigate.py）压测时可用 "http"
+FORTIGATE_TIMEOUT = 10  # 单次API调用超时（秒）
+FORTIGATE_CONNECT_TIMEOUT = 3  # 建立连接的超时（秒）
+# 按接口类别覆盖读超时：status（系统状态）/ address（地址对象）/ addrgrp（地址组）/ transaction（配置事务）
+FORTIGATE_ENDPOINT_TIMEOUTS = {"status": 5}
+FORTIGATE_RETRIES = 2  # 幂等请求（GET/PUT/DELETE）遇到连接异常或 429/502/503/504 时的重试次数
+FORTIGATE_RETRY_BASE_DELAY = 0.2  # 指数退避的基础间隔（秒），每次重试的等待时间在 [0, 基础间隔×2^n] 内随机
+FORTIGATE_RETRY_MAX_DELAY = 2.0  # 单次退避的最长等待（秒）
+BREAKER_FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断，熔断期间新连接和断开直接返回 503
+BREAKER_RESET_TIMEOUT = 30  # 熔断后多久放行一次探测请求（秒）
+FORTIGATE_POOL_SIZE = 10  # 异步客户端长连接池大小
+FORTIGATE_MAX_CONCURRENCY = 8  # 同时发往防火墙的请求上限
+
+# 预创建地址对象池（仅完整模式）：新连接直接改写池中对象的地址，到期对象放回池中而不是删除
+ADDRESS_POOL_SIZE = 0  # 池大小，0 表示不启用
+ADDRESS_POOL_LOW_WATER = 0  # 空闲对象低于该数量时后台补充到池大小
+ADDRESS_POOL_PLACEHOLDER = "0.0.0.0"  # 空闲对象指向的占位地址
+ADDRESS_POOL_FILL_INTERVAL = 5  # 补充检查间隔（秒）
+
+# 推送连接（/events，SSE）：页面打开期间由服务端推送状态并自动续期，代替定时轮询
+EVENTS_HEARTBEAT_INTERVAL = 15  # 心跳与健康快照的推送间隔（秒）
+EVENTS_RENEW_INTERVAL = 300  # 连接打开期间自动续期的间隔（秒）
+EVENTS_QUEUE_SIZE = 16  # 每个推送连接最多缓存的消息数，读取过慢的连接会丢弃多余消息
+
+# 多 worker 部署：设置共享状态文件后可以用多个 uvicorn worker 处理请求，
+# 由其中一个当选的 worker（主节点）负责到期清理和地址组提交，其余 worker 把这些操作交给主节点执行
+SHARED_STATE_PATH = None  # 例如 "shared_state.db"；为 None 时单进程运行
+SERVER_WORKERS = 1  # worker 进程数，大于1时需要设置 SHARED_STATE_PATH
+LEADER_LEASE_TTL = 10  # 主节点租约有效期（秒），主节点退出后其他 worker 最多等待该时间接替
+SHARED_STATE_POLL_INTERVAL = 0.05  # 意图队列与租约变更的轮询间隔（秒）
+SHARED_INTENT_TIMEOUT = 30  # 非主节点等待主节点处理的最长时间（秒）
+
+# /connect 限流与续期去重
+CONNECT_RATE_LIMIT = 1.0  # 每个IP每秒允许的 /connect 请求数（令牌补充速度），0 表示不限流
+CONNECT_RATE_BURST = 10  # 每个IP允许的突发请求数，超出后返回 429
+RENEW_DEDUPE_SLACK = 10  # 续期时剩余时间与完整租期相差不超过该秒数则不重置计时（应远小于 TIMER_DURATION）
+
+# 异步连接：新连接立即返回 202 和操作ID，创建地址对象和加入地址组在后台执行，
+# 进度通过 /operations/{id}、/status 或 /events 获取；未开启时客户端也可以用 Prefer: respond-async 请求头单独使用
+CONNECT_ASYNC = False
+OPERATION_MAX_PENDING = 1000  # 后台进行中的连接操作上限，超出时返回 503
+OPERATION_RETENTION = 300  # 已完成的操作保留多久供查询（秒）
+
+# 后台核对：定期比对本地租约与防火墙上的地址组成员和 PROXY_* 对象，修复手动修改、删除失败等造成的偏差
+RECONCILE_INTERVAL = 300  # 核对间隔（秒），0 表示不核对
+RECONCILE_MAX_CHANGES = 100  # 每个目标每轮最多修复的偏差数
+
+# 调用链采样：被采样的连接/断开请求记录各阶段耗时（防火墙调用、地址组批量提交、计时等），
+# 响应带有 Server-Timing 头；每种调用链耗时最长的记录可在 /debug/traces 查看，清理和同步也会记录
+TRACE_SAMPLE_RATE = 0.01  # 采样比例，0 表示不记录
+TRACE_KEEP_SLOWEST = 20  # 每种调用链保留的最慢记录数
+
+# 流量记录：把 /connect、/disconnect、/status 请求（以及推送连接的服务端续期）的时间、客户端IP、状态码和耗时写入 gzip 压缩的记录文件，
+# 之后可以用 replay.py 按比例加速重放。每次启动（每个 worker）写入文件名带开始时间和进程号的单独文件，
+# 例如 traffic.20240101-080000.1234.jsonl.gz；每秒落盘一次，进程被杀死时最多丢失最后一秒的记录
+TRAFFIC_RECORD_PATH = None  # 例如 "traffic.jsonl.gz"；为 None 时不记录
+
+# 批量管理接口（/admin/leases）：按IP列表或网段批量开通/撤销租约，请求头需带 Authorization: Bearer <ADMIN_API_TOKEN>；
+# 为 None 时这些接口不可用（返回 404）
+ADMIN_API_TOKEN = None
+ADMIN_BULK_MAX_IPS = 4096  # 单次批量请求（展开网段后）最多包含的IP数
+
+# 地址区间聚合（仅完整模式、单进程、IPv4）：相邻的客户端IP合并为一个 iprange 地址对象，
+# 大量客户端同时连接时防火墙上的对象数和地址组成员数随连续区间数而不是客户端数增长；启用后不使用地址对象池和后台核对
+ADDRESS_AGGREGATION = False
+
+# 多目标：按客户端子网路由到其他防火墙/地址组（最长前缀匹配），未匹配任何子网的客户端使用上面的默认配置。
+# host / api_token / group / duration 省略时与默认配置相同；同一防火墙上的同一地址组只能属于一个目标。
+FIREWALL_TARGETS = [
+    # {
+    #     "name": "site-b",
+    #     "host": "10.2.0.1",
+    #     "api_token": "your_token",
+    #     "group": "Proxied Devices",
+    #     "duration": 60 * 60,
+    #     "subnets": ["10.2.0.0/16", "10.3.1.0/24"],
+    #     "aggregate": False  # 该目标是否聚合地址区间，省略时与 ADDRESS_AGGREGATION 相同
+    # },
+]
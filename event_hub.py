@@ -0,0 +1,110 @@
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+HEARTBEAT = b": ping\n\n"  # SSE 注释行，用于保持连接并及时发现已断开的客户端
+
+
+def format_event(event: str, data) -> bytes:
+    """编码一条 SSE 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+class _Subscriber:
+    __slots__ = ("client_ip", "queue", "health", "renew")
+
+    def __init__(self, client_ip: str, queue_size: int, health: bool, renew: bool):
+        self.client_ip = client_ip
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.health = health  # 是否接收健康快照（调试面板）
+        self.renew = renew  # 连接保持打开期间是否由服务端为该IP续期
+
+
+class EventHub:
+    """
+    SSE 推送中心
+
+    每个打开的页面对应一个订阅者（按客户端IP分组），租约状态变化只推送给对应IP的订阅者；
+    健康快照和心跳由一个共享的生产者定时生成一次后分发给所有订阅者，
+    因此空闲的页面除了一个长连接外几乎没有开销。
+    除 publish_threadsafe 外的方法都只能在事件循环线程中调用。
+    """
+
+    def __init__(self, queue_size: int = 16):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[_Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.dropped = 0  # 因订阅者队列已满而丢弃的消息数
+
+    def __len__(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """绑定事件循环，供其他线程推送消息"""
+        self._loop = loop
+
+    def subscribe(self, client_ip: str, health: bool = False, renew: bool = False) -> _Subscriber:
+        subscriber = _Subscriber(client_ip, self.queue_size, health, renew)
+        self._subscribers.setdefault(client_ip, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        subs = self._subscribers.get(subscriber.client_ip)
+        if subs is None:
+            return
+        subs.discard(subscriber)
+        if not subs:
+            del self._subscribers[subscriber.client_ip]
+
+    def client_ips(self) -> List[str]:
+        """有打开的连接的IP"""
+        return list(self._subscribers)
+
+    def renewing_ips(self) -> List[str]:
+        """有打开的续期连接的IP"""
+        return [ip for ip, subs in self._subscribers.items() if any(sub.renew for sub in subs)]
+
+    def wants_health(self) -> bool:
+        return any(sub.health for subs in self._subscribers.values() for sub in subs)
+
+    def _put(self, subscriber: _Subscriber, message: bytes):
+        try:
+            subscriber.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 客户端读取太慢，丢弃本条；租约状态每次都是完整快照，下一条即可恢复
+            self.dropped += 1
+
+    def publish(self, client_ip: str, event: str, data):
+        """向某个IP的所有订阅者推送一条消息"""
+        subs = self._subscribers.get(client_ip)
+        if not subs:
+            return
+        message = format_event(event, data)
+        for subscriber in subs:
+            self._put(subscriber, message)
+
+    def publish_threadsafe(self, client_ip: str, event: str, data):
+        """从其他线程（清理工作线程等）推送消息"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            self._loop.call_soon_threadsafe(self.publish, client_ip, event, data)
+        except RuntimeError:
+            pass  # 事件循环已关闭
+
+    def broadcast(self, message: bytes, health_only: bool = False):
+        """向所有（或只向订阅了健康快照的）订阅者分发同一条已编码的消息"""
+        for subs in self._subscribers.values():
+            for subscriber in subs:
+                if not health_only or subscriber.health:
+                    self._put(subscriber, message)
+
+    async def stream(self, subscriber: _Subscriber, initial: List[bytes]) -> AsyncIterator[bytes]:
+        """订阅者的消息流；客户端断开时（生成器被关闭）自动取消订阅"""
+        try:
+            for message in initial:
+                yield message
+            while True:
+                yield await subscriber.queue.get()
+        finally:
+            self.unsubscribe(subscriber)
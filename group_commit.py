@@ -0,0 +1,194 @@
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from address_cache import AddressGroupCache
+from tracing import Trace, activate, current_trace
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """一个待提交批次：地址对象名称 -> (操作, 等待该操作结果的Future列表)"""
+
+    def __init__(self):
+        self.opened_at = time.monotonic()
+        self.ops: Dict[str, str] = {}  # 名称 -> "add" / "remove"
+        self.waiters: Dict[str, List[Future]] = {}
+        self.sealed = False  # 封口后不再接收新的操作
+        self.traces: List[Trace] = []  # 被采样的提交方的调用链，刷新的各阶段会并入其中
+
+
+class GroupCommitEngine:
+    """
+    地址组成员批量提交引擎
+
+    在一个很短的时间窗口内收集所有待添加/移除的地址对象，合并为一次成员列表差异，
+    每次刷新只执行一次 GET + PUT（缓存命中时以只取版本号的 GET 确认缓存仍是最新的）。调用方拿到一个 Future，在包含其变更的那次刷新完成后得到结果（bool）。
+    """
+
+    def __init__(self, client_getter: Callable[[], object], group_name: str,
+                 window: float = 0.2, max_batch: int = 500,
+                 cache: Optional[AddressGroupCache] = None):
+        self.client_getter = client_getter  # 返回当前的 FortigateAPI 实例（可能为 None）
+        self.group_name = group_name
+        self.cache = cache  # 命中且版本号未变时省去刷新前读取完整成员列表
+        self.window = window
+        self.max_batch = max_batch
+        self._batches: List[_Batch] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # 统计信息
+        self.flush_count = 0
+        self.op_count = 0
+
+    def start(self):
+        """启动后台刷新线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程，剩余的批次会在退出前刷新"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def submit_add(self, address_name: str) -> Future:
+        """提交一个添加操作"""
+        return self._submit(address_name, "add")
+
+    def submit_remove(self, address_name: str) -> Future:
+        """提交一个移除操作"""
+        return self._submit(address_name, "remove")
+
+    def pending_count(self) -> int:
+        """当前尚未提交的操作数量"""
+        with self._cond:
+            return sum(len(batch.ops) for batch in self._batches)
+
+    def _submit(self, address_name: str, op: str) -> Future:
+        future: Future = Future()
+        with self._cond:
+            batch = self._batches[-1] if self._batches else None
+            # 同一名称的相反操作不能合并进同一次PUT，封口当前批次，放入下一批
+            if (batch is None or batch.sealed or len(batch.ops) >= self.max_batch
+                    or batch.ops.get(address_name, op) != op):
+                if batch is not None:
+                    batch.sealed = True
+                batch = _Batch()
+                self._batches.append(batch)
+            batch.ops[address_name] = op
+            batch.waiters.setdefault(address_name, []).append(future)
+            trace = current_trace()
+            if trace is not None and trace not in batch.traces:
+                batch.traces.append(trace)
+            self.op_count += 1
+            self._cond.notify_all()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._batches:
+                        batch = self._batches[0]
+                        if not self._running or batch.sealed:
+                            break
+                        remaining = batch.opened_at + self.window - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    elif not self._running:
+                        return
+                    else:
+                        self._cond.wait()
+                batch = self._batches.pop(0)
+                batch.sealed = True
+
+            flush_trace = Trace("group_flush") if batch.traces else None
+            try:
+                with activate(flush_trace):
+                    success = self._flush(batch)
+            except Exception as e:
+                logger.error(f"地址组批量提交异常: {str(e)}")
+                success = False
+            for trace in batch.traces:
+                trace.adopt(flush_trace)
+
+            for futures in batch.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(success)
+
+    def _flush(self, batch: _Batch) -> bool:
+        """将一个批次合并为一次成员列表更新"""
+        client = self.client_getter()
+        if client is None:
+            logger.error("地址组批量提交失败: Fortigate连接不可用")
+            return False
+
+        current_members = self._cached_members(client)
+        from_cache = current_members is not None
+        if current_members is None:
+            current_members = self._fetch_members(client)
+            if current_members is None:
+                return False
+
+        self.flush_count += 1
+        success = self._apply(client, batch, current_members)
+        if not success and self.cache:
+            # 失败可能是缓存与防火墙不一致导致的，丢弃缓存；若本次使用的是缓存则重新获取后重试一次
+            self.cache.invalidate()
+            if from_cache:
+                current_members = self._fetch_members(client)
+                if current_members is not None:
+                    success = self._apply(client, batch, current_members)
+        return success
+
+    def _cached_members(self, client) -> Optional[list]:
+        """
+        缓存的成员列表，仅当防火墙上的配置版本号与缓存时一致才可用于写入；
+        不一致时返回 None，由调用方重新获取，避免覆盖其他人在缓存期间做的修改
+        """
+        if not self.cache:
+            return None
+        return self.cache.get_members(
+            lambda revision: client.get_address_group_revision(self.group_name) == revision
+        )
+
+    def _fetch_members(self, client) -> Optional[list]:
+        group = client.get_address_group(self.group_name)
+        if group is None:
+            return None
+        if self.cache:
+            self.cache.store_members(group["member"], group["revision"])
+        return group["member"]
+
+    def _apply(self, client, batch: _Batch, current_members: list) -> bool:
+        adds = {name for name, op in batch.ops.items() if op == "add"}
+        removes = {name for name, op in batch.ops.items() if op == "remove"}
+        current_names = {member.get("name") for member in current_members}
+
+        new_members = [member for member in current_members if member.get("name") not in removes]
+        new_members += [{"name": name} for name in batch.ops if name in adds and name not in current_names]
+
+        if len(new_members) == len(current_members) and not (removes & current_names):
+            logger.info(f"地址组 {self.group_name} 无需更新（{len(batch.ops)} 个操作已满足）")
+            return True
+
+        result = client.set_address_group_members(self.group_name, new_members)
+        if not result:
+            return False
+        logger.info(f"地址组 {self.group_name} 批量提交完成: +{len(adds)} -{len(removes)}")
+        if self.cache:
+            self.cache.apply_write(new_members, result.get("revision"))
+        return True
@@ -0,0 +1,144 @@
+import queue
+import sqlite3
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_COMPACT = object()  # 写线程队列中的压缩标记
+_STOP = object()  # 写线程队列中的停止标记
+
+
+class LeaseJournal:
+    """
+    持久化的租约日志（SQLite，WAL 模式）
+
+    每次创建/续期/移除租约都追加一条记录（IP、地址对象名称、到期时间），
+    重启时按顺序重放即可恢复所有租约及其真实的到期时间。
+    写入由后台线程批量提交，不阻塞调用方；定期压缩为每个租约只保留一条记录。
+    """
+
+    def __init__(self, path: str, batch_size: int = 500):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.row_count = 0  # 日志中的记录数（用于判断是否需要压缩）
+        self.lease_count = 0  # 上次重放/压缩时的有效租约数
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS lease_journal ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "op TEXT NOT NULL, "  # put / del
+            "ip TEXT NOT NULL, "
+            "name TEXT, "
+            "expires_at REAL)"
+        )
+        conn.commit()
+        return conn
+
+    def replay(self) -> Dict[str, Tuple[str, float]]:
+        """按顺序重放日志，返回 IP -> (地址对象名称, 到期时间戳)"""
+        conn = self._connect()
+        try:
+            leases = self._replay(conn)
+        finally:
+            conn.close()
+        self.lease_count = len(leases)
+        return leases
+
+    def _replay(self, conn: sqlite3.Connection) -> Dict[str, Tuple[str, float]]:
+        leases: Dict[str, Tuple[str, float]] = {}
+        rows = 0
+        for op, ip, name, expires_at in conn.execute(
+                "SELECT op, ip, name, expires_at FROM lease_journal ORDER BY seq"):
+            rows += 1
+            if op == "put":
+                leases[ip] = (name, expires_at)
+            else:
+                leases.pop(ip, None)
+        self.row_count = rows
+        return leases
+
+    def start(self):
+        """启动后台写线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="lease-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """写完队列中剩余的记录后停止写线程"""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+
+    def record_put(self, ip: str, name: str, expires_at: float):
+        """记录租约的创建或续期"""
+        self._queue.put(("put", ip, name, expires_at))
+
+    def record_remove(self, ip: str):
+        """记录租约的移除"""
+        self._queue.put(("del", ip, None, None))
+
+    def compact(self, min_rows: int = 1000):
+        """记录数明显多于有效租约数时，把日志重写为每个租约一条记录"""
+        if self.row_count > max(min_rows, self.lease_count * 2):
+            self._queue.put(_COMPACT)
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                item = self._queue.get()
+                batch = []
+                control = None
+                while True:
+                    if item is _STOP or item is _COMPACT:
+                        control = item
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                if batch:
+                    try:
+                        with conn:
+                            conn.executemany(
+                                "INSERT INTO lease_journal (op, ip, name, expires_at) VALUES (?, ?, ?, ?)",
+                                batch
+                            )
+                        self.row_count += len(batch)
+                    except Exception as e:
+                        logger.error(f"写入租约日志失败: {str(e)}")
+
+                if control is _COMPACT:
+                    self._compact(conn)
+                elif control is _STOP:
+                    return
+        finally:
+            conn.close()
+
+    def _compact(self, conn: sqlite3.Connection):
+        try:
+            leases = self._replay(conn)
+            with conn:
+                conn.execute("DELETE FROM lease_journal")
+                conn.executemany(
+                    "INSERT INTO lease_journal (op, ip, name, expires_at) VALUES ('put', ?, ?, ?)",
+                    [(ip, name, expires_at) for ip, (name, expires_at) in leases.items()]
+                )
+            self.row_count = len(leases)
+            self.lease_count = len(leases)
+            logger.info(f"租约日志压缩完成，保留 {len(leases)} 条记录")
+        except Exception as e:
+            logger.error(f"压缩租约日志失败: {str(e)}")
@@ -0,0 +1,105 @@
+import socket
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+_IPV6_TAG = 1 << 128  # IPv6 地址的键加上该偏移，与 IPv4 的键区分
+
+Key = Union[int, str]
+
+
+def pack_ip(client_ip: str) -> Key:
+    """IP 字符串 -> 整数键（IPv4 为 32 位整数，IPv6 带偏移）；无法解析的（例如测试客户端的主机名）原样返回"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, client_ip), "big")
+    except OSError:
+        pass
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, client_ip), "big") | _IPV6_TAG
+    except OSError:
+        return client_ip
+
+
+def unpack_ip(key: Key) -> str:
+    if isinstance(key, str):
+        return key
+    if key >= _IPV6_TAG:
+        return socket.inet_ntop(socket.AF_INET6, (key ^ _IPV6_TAG).to_bytes(16, "big"))
+    return socket.inet_ntop(socket.AF_INET, key.to_bytes(4, "big"))
+
+
+class LeaseTable(MutableMapping):
+    """
+    进程内的租约表，按 IP -> 地址对象名称 的字典使用（代替原来的 address_objects 字典）
+
+    以打包后的整数IP为键，另有 名称 -> IP 的反向索引，按名称查找租约为 O(1)。
+    到期时间只保存在时间轮中（不再另存一份），expiring 从时间轮按到期顺序取出最早的若干条。线程安全。
+    没有为每个租约建 __slots__ 记录：记录对象本身的开销比两个字典条目还大（见 benchmark.py --lease-table）。
+    """
+
+    def __init__(self, timer=None):
+        self.timer = timer  # LeaseTimerWheel，提供到期时间
+        self._names: Dict[Key, str] = {}
+        self._by_name: Dict[str, Key] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, client_ip: str) -> str:
+        return self._names[pack_ip(client_ip)]
+
+    def __setitem__(self, client_ip: str, name: str):
+        key = pack_ip(client_ip)
+        with self._lock:
+            previous = self._names.get(key)
+            if previous is not None and self._by_name.get(previous) == key:
+                del self._by_name[previous]
+            self._names[key] = name
+            self._by_name[name] = key
+
+    def __delitem__(self, client_ip: str):
+        self.pop(client_ip)
+
+    def pop(self, client_ip: str, *default):
+        key = pack_ip(client_ip)
+        with self._lock:
+            name = self._names.pop(key, None)
+            if name is None:
+                if default:
+                    return default[0]
+                raise KeyError(client_ip)
+            if self._by_name.get(name) == key:
+                del self._by_name[name]
+            return name
+
+    def __contains__(self, client_ip) -> bool:
+        return pack_ip(client_ip) in self._names
+
+    def get(self, client_ip: str, default=None):
+        return self._names.get(pack_ip(client_ip), default)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter([unpack_ip(key) for key in list(self._names)])
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def items(self) -> List[Tuple[str, str]]:
+        """(IP, 名称) 的快照列表"""
+        with self._lock:
+            items = list(self._names.items())
+        return [(unpack_ip(key), name) for key, name in items]
+
+    def ip_for(self, name: str) -> Optional[str]:
+        """地址对象名称对应的IP（地址聚合时一个名称覆盖多个IP，应由区间索引按名称查找）"""
+        key = self._by_name.get(name)
+        return None if key is None else unpack_ip(key)
+
+    def expiring(self, limit: int, before: Optional[float] = None) -> List[Tuple[str, str, float]]:
+        """按到期时间从早到晚返回最多 limit 条 (IP, 名称, 到期时间)；已到期、正在清理的租约不在其中"""
+        if self.timer is None:
+            return []
+        leases = []
+        for client_ip, deadline in self.timer.earliest(limit, before):
+            name = self.get(client_ip)
+            if name is not None:
+                leases.append((client_ip, name, deadline))
+        return leases
@@ -0,0 +1,139 @@
+import heapq
+import math
+import threading
+import time
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseTimerWheel:
+    """
+    租约到期引擎（哈希时间轮）
+
+    每个槽是一个 dict（键 -> 到期时间），另有 键 -> 槽 的索引，因此续期和取消都是 O(1)。
+    后台线程每个 tick 推进一格，把该槽中已到期的租约成批交给回调；
+    到期时间超过一圈的租约留在槽中，等转到对应的那一圈再处理。
+    """
+
+    def __init__(self, on_expire: Callable[[List[str]], None], tick: float = 1.0, slots: int = 3600):
+        self.on_expire = on_expire  # 回调参数为一批到期的键（客户端IP）
+        self.tick = tick
+        self.slot_count = slots
+        self._slots: List[Dict[str, float]] = [{} for _ in range(slots)]
+        self._index: Dict[str, int] = {}  # 键 -> 所在槽（到期时间只保存在槽中）
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_tick = int(time.time() // tick)  # 已处理到的 tick
+        self.lag = 0.0  # 最近一次推进相对预定时间的延迟（秒）
+        self.expired_count = 0
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def schedule(self, key: str, deadline: float):
+        """安排或重置一个租约的到期时间（时间戳）"""
+        with self._lock:
+            self._remove_locked(key)
+            # 向上取整保证转到该槽时租约已到期；不能放进已经处理过的槽，否则要等一整圈
+            tick_index = max(math.ceil(deadline / self.tick), self._last_tick + 1)
+            slot = tick_index % self.slot_count
+            self._slots[slot][key] = deadline
+            self._index[key] = slot
+
+    def cancel(self, key: str) -> bool:
+        """取消一个租约，返回它是否存在"""
+        with self._lock:
+            return self._remove_locked(key)
+
+    def deadline(self, key: str) -> Optional[float]:
+        slot = self._index.get(key)
+        return None if slot is None else self._slots[slot].get(key)
+
+    def remaining(self, key: str) -> Optional[float]:
+        """距离到期的剩余秒数，不存在时返回 None"""
+        deadline = self.deadline(key)
+        if deadline is None:
+            return None
+        return max(0.0, deadline - time.time())
+
+    def earliest(self, limit: int, before: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        按到期时间从早到晚返回最多 limit 个 (键, 到期时间)，before 限定到期时间上限。
+        从下一个 tick 起按顺序遍历槽，本圈内到期的租约就是按槽排好序的，取够 limit 个即可停止；
+        本圈内不够时再从下一圈及以后的租约中补齐。
+        """
+        found: List[Tuple[str, float]] = []
+        later: List[Tuple[str, float]] = []
+        with self._lock:
+            for tick_index in range(self._last_tick + 1, self._last_tick + 1 + self.slot_count):
+                if len(found) >= limit or (before is not None and (tick_index - 1) * self.tick >= before):
+                    break
+                round_end = tick_index * self.tick
+                slot = self._slots[tick_index % self.slot_count]
+                due = []
+                for entry in slot.items():
+                    (due if entry[1] <= round_end else later).append(entry)
+                found.extend(sorted(due, key=lambda entry: entry[1]))
+            else:
+                found.extend(heapq.nsmallest(limit - len(found), later, key=lambda entry: entry[1]))
+        if before is not None:
+            found = [entry for entry in found if entry[1] <= before]
+        return found[:limit]
+
+    def _remove_locked(self, key: str) -> bool:
+        slot = self._index.pop(key, None)
+        if slot is None:
+            return False
+        self._slots[slot].pop(key, None)
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="lease-timer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            next_tick_time = (self._last_tick + 1) * self.tick
+            delay = next_tick_time - time.time()
+            if delay > 0 and self._stop_event.wait(delay):
+                return
+            try:
+                self._advance()
+            except Exception as e:
+                logger.error(f"租约时间轮推进异常: {str(e)}")
+
+    def _advance(self):
+        """处理从上次推进到现在的所有 tick（线程被延迟时会一次追上）"""
+        now = time.time()
+        current_tick = int(now // self.tick)
+        expired: List[str] = []
+        with self._lock:
+            self.lag = max(0.0, now - (self._last_tick + 1) * self.tick)
+            # 落后超过一圈时，每个槽只需检查一次
+            first_tick = max(self._last_tick + 1, current_tick - self.slot_count + 1)
+            for tick_index in range(first_tick, current_tick + 1):
+                slot = self._slots[tick_index % self.slot_count]
+                due = [key for key, deadline in slot.items() if deadline <= now]
+                for key in due:
+                    del slot[key]
+                    del self._index[key]
+                expired.extend(due)
+            self._last_tick = current_tick
+
+        if expired:
+            self.expired_count += len(expired)
+            self.on_expire(expired)
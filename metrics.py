@@ -0,0 +1,260 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 默认的耗时分桶（秒），覆盖从局域网内的快速响应到接近超时的慢请求
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadCells:
+    """
+    每个线程独占一组累加单元，写入时无需加锁；读取时汇总所有线程的值。
+    已结束线程的值在读取时并入 _retired，避免线程池反复创建线程时无限增长。
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()  # 仅在线程首次写入和读取汇总时使用
+        self._cells: List[Tuple[threading.Thread, list]] = []
+        self._retired = [0] * size
+
+    def cells(self) -> list:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = [0] * self._size
+            with self._lock:
+                self._cells.append((threading.current_thread(), cells))
+            self._local.cells = cells
+            return cells
+
+    def totals(self) -> list:
+        with self._lock:
+            totals = list(self._retired)
+            alive = []
+            for thread, cells in self._cells:
+                values = list(cells)
+                for i, value in enumerate(values):
+                    totals[i] += value
+                if thread.is_alive():
+                    alive.append((thread, cells))
+                else:
+                    for i, value in enumerate(values):
+                        self._retired[i] += value
+            self._cells = alive
+            return totals
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str):
+        """返回指定标签值的子指标（首次使用时创建，之后的查找不加锁）"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    def __init__(self):
+        self._cells = _ThreadCells(1)
+
+    def inc(self, amount: float = 1):
+        self._cells.cells()[0] += amount
+
+    def value(self) -> float:
+        return self._cells.totals()[0]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def value(self) -> float:
+        return self._children[()].value()
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{self._label_text(key)} {child.value()}"]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        # 各分桶计数（非累计）+ 超出最大分桶的计数 + 总和
+        self._cells = _ThreadCells(len(buckets) + 2)
+
+    def observe(self, value: float):
+        cells = self._cells.cells()
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+    def snapshot(self) -> Tuple[List[int], int, float]:
+        """返回 (累计分桶计数, 总数, 总和)"""
+        totals = self._cells.totals()
+        cumulative = []
+        running = 0
+        for count in totals[:-2]:
+            running += count
+            cumulative.append(running)
+        return cumulative, running + totals[-2], totals[-1]
+
+
+class Histogram(_Metric):
+    """耗时分布直方图"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def _render_child(self, key, child) -> List[str]:
+        cumulative, count, total = child.snapshot()
+        lines = []
+        for bound, value in zip(self.buckets, cumulative):
+            le = 'le="%s"' % bound
+            lines.append(f"{self.name}_bucket{self._label_text(key, le)} {value}")
+        le = 'le="+Inf"'
+        lines.append(f"{self.name}_bucket{self._label_text(key, le)} {count}")
+        labels = self._label_text(key)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """在抓取时通过回调读取当前值的仪表（队列深度、租约数等本来就有现成的状态可读）"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, callback: Callable[[], Optional[float]]):
+        self.callback = callback
+        super().__init__(name, help_text)
+
+    def _new_child(self):
+        return None
+
+    def _render_child(self, key, child) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            value = None
+        return [f"{self.name} {value if value is not None else 'NaN'}"]
+
+
+class Registry:
+    """指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, callback: Callable[[], Optional[float]]) -> Gauge:
+        return self.register(Gauge(name, help_text, callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def instrument(histogram: Histogram, errors: Counter, label: str):
+    """
+    装饰器：把被装饰方法（同步或异步）的耗时记入 histogram 的 label 子指标。
+    抛出异常、返回 None / False 或 {"success": False} 时同时计一次失败。
+    """
+    latency = histogram.labels(label)
+    failures = errors.labels(label)
+
+    def failed(result) -> bool:
+        return result is None or result is False or (isinstance(result, dict) and result.get("success") is False)
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = await func(*args, **kwargs)
+                except BaseException:
+                    failures.inc()
+                    raise
+                finally:
+                    latency.observe(time.perf_counter() - started)
+                if failed(result):
+                    failures.inc()
+                return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                failures.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+            if failed(result):
+                failures.inc()
+            return result
+        return wrapper
+
+    return decorator
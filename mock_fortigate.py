@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import collections
+import itertools
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class MockFortiOS:
+    """
+    模拟的 FortiOS REST API（仅用于压测和基准测试）
+
+    实现本程序用到的接口：/monitor/system/status、/cmdb/firewall/address、/cmdb/firewall/addrgrp
+    以及配置事务（/cmdb/?action=transaction-*），可配置响应延迟、抖动和随机错误率；
+    按 "方法 资源" 统计调用次数，便于比较不同实现发往防火墙的请求量。
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 transactions: bool = True, group_name: str = "Proxied Devices", seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.transactions_enabled = transactions
+        self.addresses: Dict[str, dict] = {}
+        self.groups: Dict[str, dict] = {group_name: {"name": group_name, "member": []}}
+        self.revision = 1  # 每次配置变更递增
+        self.calls: collections.Counter = collections.Counter()
+        self.injected_errors = 0
+        self._transactions: Dict[int, List[tuple]] = {}  # 事务ID -> 暂存的操作
+        self._transaction_ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self.app = self._build_app()
+
+    def reset_stats(self):
+        self.calls.clear()
+        self.injected_errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "injected_errors": self.injected_errors,
+            "addresses": len(self.addresses),
+            "groups": {name: len(group["member"]) for name, group in self.groups.items()},
+            "revision": self.revision
+        }
+
+    def _result(self, results=None, http_status: int = 200, **extra) -> JSONResponse:
+        body = {"http_status": http_status, "status": "success" if http_status == 200 else "error",
+                "vdom": "root", "revision": str(self.revision)}
+        if results is not None:
+            body["results"] = results
+        body.update(extra)
+        return JSONResponse(body, status_code=http_status)
+
+    def _changed(self):
+        self.revision += 1
+
+    def _delete_address(self, name: str) -> JSONResponse:
+        if name not in self.addresses:
+            return self._result(http_status=404)
+        if any(member["name"] == name for group in self.groups.values() for member in group["member"]):
+            return self._result(http_status=500, error=-23)  # 对象仍被地址组引用
+        del self.addresses[name]
+        self._changed()
+        return self._result()
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Mock FortiOS")
+
+        @app.middleware("http")
+        async def simulate(request: Request, call_next):
+            path = request.url.path
+            if not path.startswith("/api/v2/"):
+                return await call_next(request)
+            parts = path[len("/api/v2/"):].strip("/").split("/")
+            if parts[0] == "cmdb" and len(parts) >= 3:
+                resource = parts[2]
+            elif parts[0] == "cmdb":
+                resource = request.query_params.get("action", "cmdb")
+            else:
+                resource = "/".join(parts[1:])
+            self.calls[f"{request.method} {resource}"] += 1
+
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.injected_errors += 1
+                return self._result(http_status=500, error=-1)
+            return await call_next(request)
+
+        @app.get("/mock/stats")
+        async def mock_stats():
+            return self.stats()
+
+        @app.post("/mock/reset")
+        async def mock_reset():
+            self.reset_stats()
+            return self.stats()
+
+        @app.get("/api/v2/monitor/system/status")
+        async def system_status():
+            return self._result({"model_name": "FortiGate", "model_number": "VM64", "hostname": "mock-fgt"},
+                                version="v7.2.0")
+
+        @app.get("/api/v2/cmdb/firewall/address")
+        async def list_addresses(request: Request):
+            results = list(self.addresses.values())
+            name_filter = request.query_params.get("filter", "")
+            if name_filter.startswith("name=@"):
+                needle = name_filter[len("name=@"):]
+                results = [obj for obj in results if needle in obj["name"]]
+            fields = request.query_params.get("format")
+            if fields:
+                keep = fields.split("|")
+                results = [{key: obj[key] for key in keep if key in obj} for obj in results]
+            start = int(request.query_params.get("start", 0))
+            count = request.query_params.get("count")
+            if count is not None:
+                results = results[start:start + int(count)]
+            return self._result(results)
+
+        @app.post("/api/v2/cmdb/firewall/address")
+        async def create_address(request: Request):
+            data = await request.json()
+            name = data.get("name")
+            if not name or name in self.addresses:
+                return self._result(http_status=500, error=-5)  # 名称重复
+            self.addresses[name] = {
+                "name": name,
+                "type": data.get("type", "ipmask"),
+                "subnet": data.get("subnet", "0.0.0.0/32").replace("/32", " 255.255.255.255"),
+                "comment": data.get("comment", "")
+            }
+            if data.get("type") == "iprange":
+                self.addresses[name].update({"start-ip": data.get("start-ip"), "end-ip": data.get("end-ip")})
+            self._changed()
+            return self._result(mkey=name)
+
+        @app.put("/api/v2/cmdb/firewall/address/{name}")
+        async def update_address(name: str, request: Request):
+            if name not in self.addresses:
+                return self._result(http_status=404)
+            data = await request.json()
+            if "subnet" in data:
+                data["subnet"] = data["subnet"].replace("/32", " 255.255.255.255")
+            self.addresses[name].update({key: value for key, value in data.items() if key != "name"})
+            self._changed()
+            return self._result(mkey=name)
+
+        @app.delete("/api/v2/cmdb/firewall/address/{name}")
+        async def delete_address(name: str, request: Request):
+            transaction_id = request.headers.get("X-TRANSACTION-ID")
+            if transaction_id is not None:
+                staged = self._transactions.get(int(transaction_id))
+                if staged is None:
+                    return self._result(http_status=400, error=-651)  # 事务不存在
+                if name not in self.addresses:
+                    return self._result(http_status=404)
+                staged.append(("delete", name))
+                return self._result(mkey=name)
+            return self._delete_address(name)
+
+        @app.get("/api/v2/cmdb/firewall/addrgrp")
+        async def list_groups():
+            return self._result(list(self.groups.values()))
+
+        @app.get("/api/v2/cmdb/firewall/addrgrp/{name}")
+        async def get_group(name: str, request: Request):
+            if name not in self.groups:
+                return self._result(http_status=404)
+            group = self.groups[name]
+            fields = request.query_params.get("format")
+            if fields:
+                group = {key: group[key] for key in fields.split("|") if key in group}
+            return self._result([group])
+
+        @app.put("/api/v2/cmdb/firewall/addrgrp/{name}")
+        async def update_group(name: str, request: Request):
+            if name not in self.groups:
+                return self._result(http_status=404)
+            data = await request.json()
+            members = [{"name": member["name"]} for member in data.get("member", [])]
+            if any(member["name"] not in self.addresses for member in members):
+                return self._result(http_status=500, error=-3)  # 引用了不存在的对象
+            self.groups[name]["member"] = members
+            self._changed()
+            return self._result(mkey=name)
+
+        @app.post("/api/v2/cmdb/")
+        async def transaction(request: Request):
+            if not self.transactions_enabled:
+                return self._result(http_status=404)
+            action = request.query_params.get("action")
+            if action == "transaction-start":
+                transaction_id = next(self._transaction_ids)
+                self._transactions[transaction_id] = []
+                return self._result({"transaction-id": transaction_id})
+            transaction_id = int(request.headers.get("X-TRANSACTION-ID", 0))
+            staged = self._transactions.pop(transaction_id, None)
+            if staged is None:
+                return self._result(http_status=400, error=-651)
+            if action == "transaction-commit":
+                for op, name in staged:
+                    if op == "delete":
+                        self._delete_address(name)
+            return self._result()
+
+        return app
+
+
+def serve_in_thread(mock: MockFortiOS, host: str = "127.0.0.1", port: int = 9443,
+                    ssl_certfile: Optional[str] = None, ssl_keyfile: Optional[str] = None) -> uvicorn.Server:
+    """在后台线程中启动模拟服务器，返回 uvicorn.Server（设置 should_exit 即可停止）"""
+    server = uvicorn.Server(uvicorn.Config(
+        mock.app, host=host, port=port, log_level="warning",
+        ssl_certfile=ssl_certfile, ssl_keyfile=ssl_keyfile
+    ))
+    thread = threading.Thread(target=server.run, name="mock-fortigate", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"模拟服务器启动失败（端口 {port} 是否已被占用？）")
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟的 FortiOS REST API 服务器（压测用）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9443)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的随机抖动范围（±秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 500 的比例（0-1）")
+    parser.add_argument("--no-transactions", action="store_true", help="不支持配置事务")
+    parser.add_argument("--group", default="Proxied Devices", help="预先创建的地址组名称")
+    parser.add_argument("--ssl-certfile", help="证书文件（不指定时使用 HTTP）")
+    parser.add_argument("--ssl-keyfile", help="私钥文件")
+    args = parser.parse_args()
+
+    mock = MockFortiOS(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       transactions=not args.no_transactions, group_name=args.group)
+    uvicorn.run(mock.app, host=args.host, port=args.port, log_level="warning",
+                ssl_certfile=args.ssl_certfile, ssl_keyfile=args.ssl_keyfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+
+class Operation:
+    """一个在后台执行的操作及其结果"""
+
+    __slots__ = ("id", "kind", "key", "state", "created_at", "finished_at", "result", "error", "status_code", "task")
+
+    PENDING, SUCCEEDED, FAILED = "pending", "succeeded", "failed"
+
+    def __init__(self, kind: str, key: Hashable):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.state = self.PENDING
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.result = None
+        self.error: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.state != self.PENDING
+
+    def to_dict(self) -> dict:
+        return {
+            "operation_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "status_code": self.status_code
+        }
+
+
+class OperationTracker:
+    """
+    后台操作登记表
+
+    submit 立即返回操作记录，操作在独立的任务（不继承调用方的上下文）中执行；
+    同一 (类型, 键) 已有进行中的操作时直接返回它。进行中的操作超过 max_pending 时拒绝新操作，
+    已完成的操作保留 retention 秒（最多 max_finished 个）供查询。只能在事件循环线程中调用。
+    """
+
+    def __init__(self, max_pending: int = 1000, retention: float = 300.0, max_finished: int = 10000,
+                 on_finish: Optional[Callable[[Operation], None]] = None):
+        self.max_pending = max_pending
+        self.retention = retention
+        self.max_finished = max_finished
+        self.on_finish = on_finish
+        self._operations: Dict[str, Operation] = {}
+        self._pending: Dict[tuple, Operation] = {}  # (类型, 键) -> 进行中的操作
+        self._finished: "OrderedDict[str, Operation]" = OrderedDict()  # 按完成时间排列
+        self._latest: Dict[Hashable, str] = {}  # 键 -> 最近一次操作的ID
+        # 统计信息
+        self.submitted = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def get(self, operation_id: str) -> Optional[Operation]:
+        return self._operations.get(operation_id)
+
+    def latest(self, key: Hashable) -> Optional[Operation]:
+        """键上最近一次（仍在保留期内的）操作"""
+        operation_id = self._latest.get(key)
+        return self._operations.get(operation_id) if operation_id else None
+
+    def submit(self, kind: str, key: Hashable, fn: Callable[[], Awaitable]) -> Optional[Operation]:
+        """登记并开始执行操作；已有进行中的同类操作时返回它，进行中的操作过多时返回 None"""
+        self._prune()
+        operation = self._pending.get((kind, key))
+        if operation is not None:
+            return operation
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            return None
+        operation = Operation(kind, key)
+        self._operations[operation.id] = operation
+        self._pending[(kind, key)] = operation
+        self._latest[key] = operation.id
+        self.submitted += 1
+        operation.task = asyncio.get_running_loop().create_task(
+            self._run(operation, fn), context=contextvars.Context()
+        )
+        return operation
+
+    async def _run(self, operation: Operation, fn: Callable[[], Awaitable]):
+        try:
+            operation.result = await fn()
+            operation.state = Operation.SUCCEEDED
+        except asyncio.CancelledError:
+            operation.state, operation.error = Operation.FAILED, "操作已取消"
+            raise
+        except Exception as e:
+            operation.state = Operation.FAILED
+            operation.status_code = getattr(e, "status_code", None)
+            operation.error = str(getattr(e, "detail", None) or e)
+        finally:
+            operation.finished_at = time.time()
+            operation.task = None
+            self._pending.pop((operation.kind, operation.key), None)
+            self._finished[operation.id] = operation
+            if self.on_finish:
+                self.on_finish(operation)
+
+    def _prune(self):
+        """丢弃超过保留期或超出数量上限的已完成操作"""
+        expire_before = time.time() - self.retention
+        while self._finished:
+            operation_id, operation = next(iter(self._finished.items()))
+            if operation.finished_at >= expire_before and len(self._finished) <= self.max_finished:
+                break
+            del self._finished[operation_id]
+            del self._operations[operation_id]
+            if self._latest.get(operation.key) == operation_id:
+                del self._latest[operation.key]
+
+    def cancel_all(self):
+        for operation in list(self._pending.values()):
+            if operation.task is not None:
+                operation.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "retained": len(self._finished),
+            "submitted": self.submitted,
+            "rejected": self.rejected
+        }
@@ -0,0 +1,75 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class TokenBucketLimiter:
+    """
+    按客户端IP的令牌桶限流
+
+    每个IP的桶最多存放 burst 个令牌，以每秒 rate 个的速度补充，每个请求消耗一个；
+    桶空时拒绝请求并给出需要等待的秒数。桶在首次请求时创建，补满后即可丢弃，
+    IP 数超过 max_clients 时清理已补满的桶，因此内存只与最近活跃的IP数有关。
+    只能在事件循环线程中调用。
+    """
+
+    def __init__(self, rate: float, burst: int, max_clients: int = 100000):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._buckets: Dict[str, list] = {}  # IP -> [令牌数, 上次更新时间]
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def acquire(self, client_ip: str) -> Tuple[bool, float]:
+        """消耗一个令牌，返回 (是否放行, 被拒绝时建议的重试等待秒数)"""
+        now = time.monotonic()
+        bucket = self._buckets.get(client_ip)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self._buckets[client_ip] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True, 0.0
+        self.rejected += 1
+        return False, (1 - bucket[0]) / self.rate
+
+    def _prune(self, now: float):
+        """丢弃已经补满的桶（与新建的桶等价）"""
+        full_after = self.burst / self.rate
+        for client_ip in [ip for ip, (_, updated) in self._buckets.items() if now - updated >= full_after]:
+            del self._buckets[client_ip]
+
+
+class SingleFlight:
+    """
+    合并同一个键上并发的异步操作
+
+    同一键已有操作在进行时，后来的调用者直接等待它的结果（或异常），而不是再执行一次。
+    操作在独立的任务中运行，发起它的请求被取消时不影响其他等待者。
+    只能在事件循环线程中调用。
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """该键上是否有正在进行的操作"""
+        return key in self._calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _, key=key: self._calls.pop(key, None))
+        return await asyncio.shield(task)
@@ -0,0 +1,194 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmark import PhaseResult, print_report
+from mock_fortigate import MockFortiOS, serve_in_thread
+from traffic import ENDPOINTS, RENEW, TrafficRecord, load_traffic
+
+PHASES = {"c": "connect", "d": "disconnect", "s": "status", RENEW: "events_renew"}
+
+
+class Replay:
+    """
+    在进程内按记录的时间间隔（除以加速比例）重放请求，防火墙由后台线程中的 MockFortiOS 模拟。
+
+    每个请求到点即发出，不等待之前的请求完成（开环，与真实客户端一样），因此实例处理不过来时延迟会堆积；
+    超过 max_inflight 个未完成的请求时暂停发送，发送时间相对计划的滞后会在报告中给出。
+    租约时长、续期去重窗口和按IP限流按同样的比例缩放，到期清理与记录时的节奏一致。
+    """
+
+    def __init__(self, app_module, mock: MockFortiOS, records: List[TrafficRecord],
+                 speedup: float, max_inflight: int):
+        self.m = app_module
+        self.mock = mock
+        self.records = records
+        self.speedup = speedup
+        self.max_inflight = max_inflight
+        self.max_lag = 0.0  # 发送时间相对计划的最大滞后（秒）
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def client(self, ip: str) -> httpx.AsyncClient:
+        if ip not in self._clients:
+            transport = httpx.ASGITransport(app=self.m.app, client=(ip, 50000))
+            self._clients[ip] = httpx.AsyncClient(transport=transport, base_url="http://proxy-manager", timeout=60)
+        return self._clients[ip]
+
+    def scale(self, durations: Dict[str, float], timer_duration: Optional[float]):
+        """按加速比例缩短各目标的租约时长（记录中的时长优先，timer_duration 覆盖所有目标）"""
+        for target in self.m.targets.values():
+            duration = timer_duration or durations.get(target.name) or target.duration
+            target.duration = max(1.0, duration / self.speedup)
+        self.m.RENEW_DEDUPE_SLACK = self.m.RENEW_DEDUPE_SLACK / self.speedup
+        if self.m.connect_limiter is not None:
+            self.m.connect_limiter.rate *= self.speedup
+
+    async def run(self, drain_timeout: float) -> List[PhaseResult]:
+        phases = {op: PhaseResult(name) for op, name in PHASES.items()}
+        total = PhaseResult("replay")
+        semaphore = asyncio.Semaphore(self.max_inflight)
+
+        async def one(record: TrafficRecord):
+            started = time.perf_counter()
+            try:
+                code = await self.send(record)
+            except Exception:
+                code = 0
+            finally:
+                semaphore.release()
+            elapsed = time.perf_counter() - started
+            for result in (phases[record.op], total):
+                result.requests += 1
+                result.latencies.append(elapsed)
+                result.status_codes[code] = result.status_codes.get(code, 0) + 1
+                # 与记录时的状态码不同即视为错误（记录中本来就是 404 的断开不算）
+                if code != record.status:
+                    result.errors += 1
+
+        results = []
+        async with self.m.app.router.lifespan_context(self.m.app):
+            await self.m.wait_until_ready()
+            self.mock.reset_stats()
+            tasks = []
+            first = self.records[0].at
+            started = time.perf_counter()
+            for record in self.records:
+                due = started + (record.at - first) / self.speedup
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await semaphore.acquire()
+                self.max_lag = max(self.max_lag, time.perf_counter() - due)
+                tasks.append(asyncio.create_task(one(record)))
+            await asyncio.gather(*tasks)
+            total.duration = time.perf_counter() - started
+            total.firewall_calls = dict(self.mock.calls)
+            for result in phases.values():
+                result.duration = total.duration
+            results.extend(result for result in phases.values() if result.requests)
+            results.append(total)
+            if drain_timeout > 0:
+                results.append(await self.drain(drain_timeout))
+            for client in self._clients.values():
+                await client.aclose()
+        return results
+
+    async def send(self, record: TrafficRecord) -> int:
+        """重放一条记录，返回状态码；推送连接的服务端续期直接执行同样的续期（没有租约时视为 404）"""
+        if record.op == RENEW:
+            renewed = await self.m.run_shared(self.m.renew_streaming_lease, record.client_ip, force=True)
+            return 200 if renewed is not None else 404
+        method, path = ENDPOINTS[record.op]
+        response = await self.client(record.client_ip).request(method, path)
+        return response.status_code
+
+    async def drain(self, timeout: float) -> PhaseResult:
+        """等待重放结束时仍然有效的租约全部到期并清理完成"""
+        result = PhaseResult("drain")
+        self.mock.reset_stats()
+        started = time.perf_counter()
+        pending = set(self.m.address_objects)
+        result.requests = len(pending)
+        while pending and time.perf_counter() - started < timeout:
+            await asyncio.sleep(0.1)
+            for ip in [ip for ip in pending if ip not in self.m.address_objects]:
+                pending.discard(ip)
+                result.latencies.append(time.perf_counter() - started)
+        result.duration = time.perf_counter() - started
+        result.errors = len(pending)
+        result.firewall_calls = dict(self.mock.calls)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按比例加速重放记录的连接/断开/状态请求（TRAFFIC_RECORD_PATH）")
+    parser.add_argument("files", nargs="+", help="记录文件（多 worker 部署时可以同时给出各 worker 的文件）")
+    parser.add_argument("--speedup", type=float, default=60.0, help="加速比例，租约时长同样按该比例缩短")
+    parser.add_argument("--timer-duration", type=float, help="记录时的租约时长（秒），默认取记录文件中的值")
+    parser.add_argument("--max-inflight", type=int, default=1000, help="同时未完成的请求上限")
+    parser.add_argument("--limit", type=int, help="只重放前 N 个请求")
+    parser.add_argument("--drain", action="store_true", help="重放结束后等待剩余租约全部到期清理")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟防火墙的平均响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.01, help="延迟的随机抖动范围（±秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟防火墙随机返回 500 的比例")
+    parser.add_argument("--no-transactions", action="store_true", help="模拟防火墙不支持配置事务")
+    parser.add_argument("--port", type=int, default=18443, help="模拟防火墙监听端口")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--verbose", action="store_true", help="输出 app 的日志")
+    args = parser.parse_args()
+
+    headers, records = load_traffic(args.files)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error("记录文件中没有请求")
+    durations: Dict[str, float] = {}
+    for header in headers:
+        durations.update(header.get("durations", {}))
+
+    import app as app_module
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        logging.getLogger("urllib3").setLevel(logging.ERROR)
+
+    mock = MockFortiOS(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       transactions=not args.no_transactions, group_name=app_module.ADDRESS_GROUP_NAME)
+    server = serve_in_thread(mock, port=args.port)
+    for target in app_module.targets.values():
+        target.host = f"127.0.0.1:{args.port}"
+        mock.groups.setdefault(target.group_name, {"name": target.group_name, "member": []})
+    app_module.FORTIGATE_SCHEME = "http"
+    app_module.lease_journal = None  # 不写入真实的租约日志
+    if app_module.traffic_recorder:
+        app_module.traffic_recorder.enabled = False  # 重放的请求不再记录
+
+    replay = Replay(app_module, mock, records, args.speedup, args.max_inflight)
+    replay.scale(durations, args.timer_duration)
+    drain_timeout = (max(target.duration for target in app_module.targets.values()) + 30) if args.drain else 0
+    try:
+        results = asyncio.run(replay.run(drain_timeout))
+    finally:
+        server.should_exit = True
+
+    span = (records[-1].at - records[0].at) / args.speedup
+    if args.json:
+        print(json.dumps({
+            "requests": len(records),
+            "speedup": args.speedup,
+            "scheduled_duration_s": round(span, 3),
+            "max_lag_ms": round(replay.max_lag * 1000, 2),
+            "phases": [result.summary() for result in results]
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(f"{len(records)} 个请求，加速 {args.speedup:g} 倍，计划用时 {span:.1f} 秒，"
+              f"发送最大滞后 {replay.max_lag * 1000:.1f} ms")
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
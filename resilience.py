@@ -0,0 +1,170 @@
+import asyncio
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple, Type
+
+RETRY_STATUSES = (429, 502, 503, 504)  # 防火墙过载或网关错误；FortiOS 的 500 多为业务错误（名称重复等），不重试
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开期间拒绝的请求"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"防火墙暂时不可用（熔断中），{retry_after:.0f} 秒后重试")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败 failure_threshold 次后打开，打开期间直接拒绝请求，不再向过载的防火墙发送；
+    reset_timeout 秒后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开。
+    事件循环与清理工作线程共用，线程安全。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # 连续失败次数
+        self._opened_at = 0.0
+        self._probing = False  # 半开状态下是否已有探测请求在进行
+        self._lock = threading.Lock()
+        # 统计信息
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """是否放行一个请求；放行后调用方必须调用 record_success 或 record_failure"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def rejecting(self) -> bool:
+        """当前是否会拒绝请求（不占用半开状态的探测名额，供端点提前快速失败）"""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.reset_timeout
+            return self.state == self.HALF_OPEN and self._probing
+
+    def retry_after(self) -> float:
+        """距离下一次探测的秒数"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def abandon(self):
+        """放行的请求被取消、没有结果时调用，释放半开状态的探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.opens += 1
+
+    def stats(self) -> dict:
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opens": self.opens,
+                "rejected": self.rejected,
+                "retry_after": round(retry_after, 1)
+            }
+
+
+class RetryPolicy:
+    """
+    带熔断的重试：幂等请求在连接异常或 RETRY_STATUSES 时按指数退避（全抖动）重试，非幂等请求只发送一次。
+    每次尝试的结果都计入熔断器；熔断器打开时抛出 CircuitOpenError。
+    """
+
+    def __init__(self, retries: int = 2, base_delay: float = 0.2, max_delay: float = 2.0,
+                 retry_statuses: Tuple[int, ...] = RETRY_STATUSES, on_retry: Optional[Callable[[], None]] = None):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.on_retry = on_retry
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, breaker: CircuitBreaker, fn: Callable, idempotent: bool,
+             transient: Tuple[Type[BaseException], ...] = (Exception,)):
+        """同步版本，fn() 返回带 status_code 的响应"""
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(breaker.retry_after())
+            try:
+                response = fn()
+            except transient:
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            except BaseException:
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code not in self.retry_statuses:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    return response
+            if self.on_retry:
+                self.on_retry()
+            time.sleep(self.backoff(attempt))
+
+    async def acall(self, breaker: CircuitBreaker, fn: Callable, idempotent: bool,
+                    transient: Tuple[Type[BaseException], ...] = (Exception,)):
+        """异步版本，fn() 返回可等待的响应"""
+        attempts = self.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(breaker.retry_after())
+            try:
+                response = await fn()
+            except transient:
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            except BaseException:
+                breaker.abandon()
+                raise
+            else:
+                if response.status_code not in self.retry_statuses:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    return response
+            if self.on_retry:
+                self.on_retry()
+            await asyncio.sleep(self.backoff(attempt))
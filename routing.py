@@ -0,0 +1,57 @@
+import ipaddress
+from typing import Dict, Generic, List, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class RouteTable(Generic[T]):
+    """
+    客户端子网 -> 目标 的最长前缀匹配
+
+    路由按 (IP版本, 前缀长度) 分桶保存为 网络地址整数 -> 目标 的字典，
+    查找时从最长的前缀开始，每个前缀长度只做一次字典查找，与路由条数无关。
+    """
+
+    def __init__(self):
+        self._tables: Dict[Tuple[int, int], Dict[int, T]] = {}
+        self._order: List[Tuple[int, int]] = []  # 按前缀长度从长到短
+
+    def __len__(self) -> int:
+        return sum(len(table) for table in self._tables.values())
+
+    def add(self, network: str, target: T):
+        """添加一条路由；同一子网重复配置时抛出 ValueError"""
+        net = ipaddress.ip_network(network, strict=False)
+        table = self._tables.setdefault((net.version, net.prefixlen), {})
+        key = int(net.network_address)
+        if key in table:
+            raise ValueError(f"子网 {net} 重复配置")
+        table[key] = target
+        self._order = sorted(self._tables, key=lambda k: k[1], reverse=True)
+
+    def lookup(self, ip: str) -> Optional[T]:
+        """返回IP所属的最长前缀路由的目标，没有匹配或IP无效时返回 None"""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+        value, bits = int(addr), addr.max_prefixlen
+        for version, prefixlen in self._order:
+            if version != addr.version:
+                continue
+            shift = bits - prefixlen
+            target = self._tables[(version, prefixlen)].get(value >> shift << shift)
+            if target is not None:
+                return target
+        return None
+
+    def routes(self) -> List[Tuple[str, T]]:
+        """所有路由（子网字符串, 目标），按前缀长度从长到短"""
+        result = []
+        for version, prefixlen in self._order:
+            for key, target in self._tables[(version, prefixlen)].items():
+                net = (ipaddress.IPv4Network if version == 4 else ipaddress.IPv6Network)((key, prefixlen))
+                result.append((str(net), target))
+        return result
@@ -0,0 +1,317 @@
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+class Intent(NamedTuple):
+    """非主节点提交给主节点执行的操作"""
+    id: int
+    kind: str  # group_add / discard / release
+    client_ip: Optional[str]
+    name: Optional[str]
+
+
+class SharedStateBackend:
+    """
+    多 worker / 多节点共享状态的接口
+
+    包含三部分：租约表（IP -> 地址对象名称与到期时间，带递增的变更序号供主节点跟踪续期）、
+    带有效期的主节点租约（选主），以及非主节点提交给主节点执行的意图队列。
+    本机部署使用 SqliteStateBackend；跨主机部署可以用网络存储实现同样的接口。
+    """
+
+    # 租约表
+    def get_lease(self, client_ip: str) -> Optional[Tuple[str, Optional[float]]]:
+        raise NotImplementedError
+
+    def put_lease(self, client_ip: str, name: str):
+        raise NotImplementedError
+
+    def claim_lease(self, client_ip: str, name: str) -> str:
+        """
+        IP 还没有租约时记录为 name；已有租约（例如其他 worker 并发的首次连接先记录了）时不覆盖。
+        返回该IP最终记录的名称，与 name 不同说明本次创建的地址对象多余
+        """
+        raise NotImplementedError
+
+    def set_expiry(self, client_ip: str, expires_at: float) -> bool:
+        raise NotImplementedError
+
+    def remove_lease(self, client_ip: str) -> bool:
+        raise NotImplementedError
+
+    def leases(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        raise NotImplementedError
+
+    def lease_count(self) -> int:
+        raise NotImplementedError
+
+    def timed_lease_count(self) -> int:
+        """已设置到期时间（等待到期清理）的租约数量"""
+        raise NotImplementedError
+
+    def lease_ip(self, name: str) -> Optional[str]:
+        """地址对象名称对应的IP"""
+        raise NotImplementedError
+
+    def expiring_leases(self, limit: int, before: Optional[float] = None) -> List[Tuple[str, str, float]]:
+        """按到期时间从早到晚返回最多 limit 条 (IP, 名称, 到期时间)"""
+        raise NotImplementedError
+
+    def current_seq(self) -> int:
+        raise NotImplementedError
+
+    def changes_since(self, seq: int) -> Tuple[int, List[Tuple[str, float]]]:
+        """返回 (最新序号, 序号之后创建或续期的 [(IP, 到期时间)])"""
+        raise NotImplementedError
+
+    # 选主
+    def acquire_leadership(self, node_id: str, ttl: float) -> bool:
+        """竞选或续约主节点，返回本节点当前是否为主节点"""
+        raise NotImplementedError
+
+    def release_leadership(self, node_id: str):
+        raise NotImplementedError
+
+    def leader(self) -> Optional[str]:
+        raise NotImplementedError
+
+    # 意图队列
+    def submit_intent(self, kind: str, client_ip: Optional[str] = None, name: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def claim_intents(self, limit: int = 100, reclaim_after: float = 30.0) -> List[Intent]:
+        """主节点领取待处理的意图；领取后超过 reclaim_after 秒仍未完成的会被重新领取"""
+        raise NotImplementedError
+
+    def complete_intent(self, intent_id: int, ok: bool, result: dict):
+        raise NotImplementedError
+
+    def intent_result(self, intent_id: int) -> Optional[Tuple[bool, dict]]:
+        """意图完成后返回 (是否成功, 结果) 并删除记录，未完成时返回 None"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SqliteStateBackend(SharedStateBackend):
+    """
+    基于 SQLite（WAL 模式）的共享状态，适用于同一主机上的多个 worker 进程。
+    写操作使用 BEGIN IMMEDIATE 事务，由 SQLite 的文件锁保证跨进程的原子性。
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._write() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_leases ("
+                "ip TEXT PRIMARY KEY, name TEXT NOT NULL, expires_at REAL, seq INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS shared_leases_seq ON shared_leases (seq)")
+            conn.execute("CREATE INDEX IF NOT EXISTS shared_leases_name ON shared_leases (name)")
+            conn.execute("CREATE INDEX IF NOT EXISTS shared_leases_expiry ON shared_leases (expires_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS shared_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO shared_meta (key, value) VALUES ('seq', 0)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_leader ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), node TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_intents ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, ip TEXT, name TEXT, "
+                "state TEXT NOT NULL DEFAULT 'pending', "  # pending / claimed / done
+                "updated_at REAL NOT NULL, ok INTEGER, result TEXT)"
+            )
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _next_seq(conn: sqlite3.Connection) -> int:
+        conn.execute("UPDATE shared_meta SET value = value + 1 WHERE key = 'seq'")
+        return conn.execute("SELECT value FROM shared_meta WHERE key = 'seq'").fetchone()[0]
+
+    def get_lease(self, client_ip: str) -> Optional[Tuple[str, Optional[float]]]:
+        rows = self._read("SELECT name, expires_at FROM shared_leases WHERE ip = ?", (client_ip,))
+        return (rows[0][0], rows[0][1]) if rows else None
+
+    def put_lease(self, client_ip: str, name: str):
+        with self._write() as conn:
+            seq = self._next_seq(conn)
+            conn.execute(
+                "INSERT INTO shared_leases (ip, name, expires_at, seq) VALUES (?, ?, NULL, ?) "
+                "ON CONFLICT (ip) DO UPDATE SET name = excluded.name, seq = excluded.seq",
+                (client_ip, name, seq)
+            )
+
+    def claim_lease(self, client_ip: str, name: str) -> str:
+        with self._write() as conn:
+            seq = self._next_seq(conn)
+            conn.execute(
+                "INSERT INTO shared_leases (ip, name, expires_at, seq) VALUES (?, ?, NULL, ?) "
+                "ON CONFLICT (ip) DO NOTHING",
+                (client_ip, name, seq)
+            )
+            return conn.execute("SELECT name FROM shared_leases WHERE ip = ?", (client_ip,)).fetchone()[0]
+
+    def set_expiry(self, client_ip: str, expires_at: float) -> bool:
+        with self._write() as conn:
+            seq = self._next_seq(conn)
+            cursor = conn.execute(
+                "UPDATE shared_leases SET expires_at = ?, seq = ? WHERE ip = ?", (expires_at, seq, client_ip)
+            )
+            return cursor.rowcount > 0
+
+    def remove_lease(self, client_ip: str) -> bool:
+        with self._write() as conn:
+            return conn.execute("DELETE FROM shared_leases WHERE ip = ?", (client_ip,)).rowcount > 0
+
+    def leases(self) -> Dict[str, Tuple[str, Optional[float]]]:
+        return {ip: (name, expires_at)
+                for ip, name, expires_at in self._read("SELECT ip, name, expires_at FROM shared_leases")}
+
+    def lease_count(self) -> int:
+        return self._read("SELECT COUNT(*) FROM shared_leases")[0][0]
+
+    def timed_lease_count(self) -> int:
+        return self._read("SELECT COUNT(*) FROM shared_leases WHERE expires_at IS NOT NULL")[0][0]
+
+    def lease_ip(self, name: str) -> Optional[str]:
+        rows = self._read("SELECT ip FROM shared_leases WHERE name = ? LIMIT 1", (name,))
+        return rows[0][0] if rows else None
+
+    def expiring_leases(self, limit: int, before: Optional[float] = None) -> List[Tuple[str, str, float]]:
+        return [tuple(row) for row in self._read(
+            "SELECT ip, name, expires_at FROM shared_leases WHERE expires_at IS NOT NULL AND expires_at <= ? "
+            "ORDER BY expires_at LIMIT ?", (before if before is not None else float("inf"), limit)
+        )]
+
+    def current_seq(self) -> int:
+        return self._read("SELECT value FROM shared_meta WHERE key = 'seq'")[0][0]
+
+    def changes_since(self, seq: int) -> Tuple[int, List[Tuple[str, float]]]:
+        rows = self._read(
+            "SELECT ip, expires_at, seq FROM shared_leases WHERE seq > ? ORDER BY seq", (seq,)
+        )
+        if not rows:
+            return seq, []
+        return rows[-1][2], [(ip, expires_at) for ip, expires_at, _ in rows if expires_at is not None]
+
+    def acquire_leadership(self, node_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._write() as conn:
+            row = conn.execute("SELECT node, expires_at FROM shared_leader WHERE id = 1").fetchone()
+            if row is not None and row[0] != node_id and row[1] > now:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_leader (id, node, expires_at) VALUES (1, ?, ?)", (node_id, now + ttl)
+            )
+            return True
+
+    def release_leadership(self, node_id: str):
+        with self._write() as conn:
+            conn.execute("DELETE FROM shared_leader WHERE id = 1 AND node = ?", (node_id,))
+
+    def leader(self) -> Optional[str]:
+        rows = self._read("SELECT node FROM shared_leader WHERE id = 1 AND expires_at > ?", (time.time(),))
+        return rows[0][0] if rows else None
+
+    def submit_intent(self, kind: str, client_ip: Optional[str] = None, name: Optional[str] = None) -> int:
+        with self._write() as conn:
+            cursor = conn.execute(
+                "INSERT INTO shared_intents (kind, ip, name, updated_at) VALUES (?, ?, ?, ?)",
+                (kind, client_ip, name, time.time())
+            )
+            return cursor.lastrowid
+
+    def claim_intents(self, limit: int = 100, reclaim_after: float = 30.0) -> List[Intent]:
+        now = time.time()
+        with self._write() as conn:
+            rows = conn.execute(
+                "SELECT id, kind, ip, name FROM shared_intents "
+                "WHERE state = 'pending' OR (state = 'claimed' AND updated_at < ?) ORDER BY id LIMIT ?",
+                (now - reclaim_after, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE shared_intents SET state = 'claimed', updated_at = ? WHERE id = ?",
+                    [(now, row[0]) for row in rows]
+                )
+            # 提交方已经不再等待的结果（例如 worker 已退出）
+            conn.execute("DELETE FROM shared_intents WHERE state = 'done' AND updated_at < ?", (now - 3600,))
+        return [Intent(*row) for row in rows]
+
+    def complete_intent(self, intent_id: int, ok: bool, result: dict):
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE shared_intents SET state = 'done', ok = ?, result = ?, updated_at = ? WHERE id = ?",
+                (1 if ok else 0, json.dumps(result, ensure_ascii=False), time.time(), intent_id)
+            )
+
+    def intent_result(self, intent_id: int) -> Optional[Tuple[bool, dict]]:
+        rows = self._read("SELECT state, ok, result FROM shared_intents WHERE id = ?", (intent_id,))
+        if not rows or rows[0][0] != "done":
+            return None
+        with self._write() as conn:
+            conn.execute("DELETE FROM shared_intents WHERE id = ?", (intent_id,))
+        return bool(rows[0][1]), json.loads(rows[0][2] or "{}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedLeaseMap(MutableMapping):
+    """
+    把共享状态中的租约表包装成 IP -> 地址对象名称 的字典，多 worker 部署时代替进程内的 LeaseTable
+    （提供同样的 ip_for / expiring；到期时间由 SharedStateBackend.set_expiry 写入）
+    """
+
+    def __init__(self, backend: SharedStateBackend):
+        self.backend = backend
+
+    def __getitem__(self, client_ip: str) -> str:
+        lease = self.backend.get_lease(client_ip)
+        if lease is None:
+            raise KeyError(client_ip)
+        return lease[0]
+
+    def __setitem__(self, client_ip: str, name: str):
+        self.backend.put_lease(client_ip, name)
+
+    def __delitem__(self, client_ip: str):
+        if not self.backend.remove_lease(client_ip):
+            raise KeyError(client_ip)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.backend.leases()))
+
+    def __len__(self) -> int:
+        return self.backend.lease_count()
+
+    def ip_for(self, name: str) -> Optional[str]:
+        return self.backend.lease_ip(name)
+
+    def expiring(self, limit: int, before: Optional[float] = None) -> List[Tuple[str, str, float]]:
+        return self.backend.expiring_leases(limit, before)
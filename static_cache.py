@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    import brotli  # 可选依赖：支持时额外提供 br 编码
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class StaticAsset:
+    """
+    内存中的静态文件（首页）
+
+    启动时读入并预先压缩为 gzip（安装了 brotli 时还有 br），请求时按 Accept-Encoding 直接返回内存中的副本；
+    ETag 由内容哈希生成，If-None-Match 匹配时返回 304。
+    文件修改时间变化后自动重新加载，两次检查之间至少间隔 check_interval 秒。
+    """
+
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.bodies: Dict[str, bytes] = {}  # 编码 -> 内容（identity / gzip / br）
+        self.etags: Dict[str, str] = {}  # 编码 -> ETag
+        self._mtime_ns: Optional[int] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.bodies)
+
+    def load(self):
+        """读取文件并生成各编码的副本；文件不存在时抛出 FileNotFoundError"""
+        with self._lock:
+            stat = os.stat(self.path)
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha1(raw).hexdigest()[:16]
+            bodies = {"identity": raw, "gzip": gzip.compress(raw, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                bodies["br"] = brotli.compress(raw, quality=11)
+            elif not self.reloads:
+                logger.warning("未安装 brotli，前端页面只提供 gzip 压缩版本（pip install brotli）。")
+            # 不同编码的字节不同，强 ETag 也要区分
+            self.etags = {encoding: f'"{digest}-{encoding}"' for encoding in bodies}
+            self.bodies = bodies
+            self._mtime_ns = stat.st_mtime_ns
+            self._checked_at = time.monotonic()
+            self.reloads += 1
+
+    def stale(self) -> bool:
+        """文件是否需要（重新）加载；检查间隔内直接返回 False，不访问磁盘"""
+        now = time.monotonic()
+        if self.loaded and now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+        try:
+            return os.stat(self.path).st_mtime_ns != self._mtime_ns
+        except FileNotFoundError:
+            self.bodies = {}
+            self._mtime_ns = None
+            return False
+
+    def negotiate(self, accept_encoding: str) -> str:
+        """按 Accept-Encoding 选择编码，优先 br，其次 gzip"""
+        accepted = {}
+        for part in accept_encoding.split(","):
+            fields = part.strip().split(";")
+            coding = fields[0].strip().lower()
+            if not coding:
+                continue
+            quality = 1.0
+            for param in fields[1:]:
+                key, _, value = param.strip().partition("=")
+                if key == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            accepted[coding] = quality
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return "identity"
+
+    def not_modified(self, if_none_match: str) -> bool:
+        """If-None-Match 中是否有当前内容的 ETag（弱比较，任一编码的 ETag 都算）"""
+        if not if_none_match or not self.etags:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        current = set(self.etags.values())
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag in current:
+                return True
+        return False
@@ -0,0 +1,51 @@
+import os
+import socket
+import sys
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app 在导入时读取 config 模块：测试使用一份只对接模拟防火墙、不写入本地文件的配置
+_config = types.ModuleType("config")
+_config.FORTIGATE_IP = "127.0.0.1:1"
+_config.FORTIGATE_API_TOKEN = ""
+_config.FORTIGATE_SCHEME = "http"
+_config.ADDRESS_GROUP_NAME = "Proxied Devices"
+_config.TIMER_DURATION = 600
+_config.SERVER_HOST = "127.0.0.1"
+_config.SERVER_PORT = 8000
+_config.TIMEZONE = "UTC"
+_config.LEASE_DB_PATH = None
+_config.RECONCILE_INTERVAL = 0
+_config.CONNECT_RATE_LIMIT = 0
+sys.modules["config"] = _config
+
+from mock_fortigate import MockFortiOS, serve_in_thread  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mock_fortios():
+    """在后台线程中运行的模拟防火墙，返回 (MockFortiOS, host)"""
+    mock = MockFortiOS(group_name=_config.ADDRESS_GROUP_NAME, seed=1)
+    port = free_port()
+    server = serve_in_thread(mock, port=port)
+    yield mock, f"127.0.0.1:{port}"
+    server.should_exit = True
+
+
+@pytest.fixture
+def fortigate(mock_fortios):
+    """连接到模拟防火墙的同步客户端（完整模式）"""
+    import app
+    client = app.FortigateAPI(mock_fortios[1], "")
+    assert client.test_connection()["success"]
+    return client
@@ -0,0 +1,111 @@
+import asyncio
+from concurrent.futures import wait
+
+import pytest
+from fastapi import HTTPException
+
+from address_ranges import AddressRangeIndex, RangeCommitEngine, ip_to_int
+from group_commit import GroupCommitEngine
+
+GROUP = "Proxied Devices"
+
+
+@pytest.fixture
+def range_engine(fortigate):
+    names = (f"PROXY_range{i}" for i in range(1000))
+    group_commit = GroupCommitEngine(lambda: fortigate, GROUP, window=0.05)
+    engine = RangeCommitEngine(lambda: fortigate, group_commit, lambda: next(names), window=0.1)
+    group_commit.start()
+    engine.start()
+    yield engine
+    engine.stop()
+    group_commit.stop()
+
+
+def test_index_merges_and_splits_runs():
+    names = iter(["A", "B", "C"])
+    index = AddressRangeIndex(lambda: next(names))
+    for ip in ("10.0.0.1", "10.0.0.3", "10.0.0.2"):
+        index.add(ip_to_int(ip))
+    assert [(start, end) for start, end, _ in index.runs()] == [(ip_to_int("10.0.0.1"), ip_to_int("10.0.0.3"))]
+    index.remove(ip_to_int("10.0.0.2"))
+    assert len(index) == 2 and index.addresses == 2
+
+
+def test_adjacent_clients_share_one_range_object(mock_fortios, range_engine):
+    mock, _ = mock_fortios
+    futures = [range_engine.submit_add(f"10.0.0.{i}") for i in range(1, 6)]
+    wait(futures, timeout=10)
+    names = {future.result() for future in futures}
+    assert len(names) == 1 and None not in names
+    (name,) = names
+    assert mock.addresses[name]["start-ip"] == "10.0.0.1" and mock.addresses[name]["end-ip"] == "10.0.0.5"
+    assert [member["name"] for member in mock.groups[GROUP]["member"]] == [name]
+
+
+def test_ipv6_client_does_not_fail_the_batch(mock_fortios, range_engine):
+    mock, _ = mock_fortios
+    ipv6 = range_engine.submit_add("2001:db8::1")
+    futures = [range_engine.submit_add(f"10.0.0.{i}") for i in range(1, 4)]
+    wait(futures + [ipv6], timeout=10)
+    assert ipv6.result() is None
+    assert all(future.result() for future in futures)
+    assert len(mock.groups[GROUP]["member"]) == 1
+
+
+def test_failing_op_is_rolled_back_alone(mock_fortios, range_engine, monkeypatch):
+    index = range_engine.index
+    add = index.add
+    bad = ip_to_int("10.0.0.9")
+
+    def flaky_add(ip):
+        add(ip)
+        if ip == bad:
+            raise RuntimeError("boom")
+
+    monkeypatch.setattr(index, "add", flaky_add)
+    futures = [range_engine.submit_add(ip) for ip in ("10.0.0.8", "10.0.0.9", "10.0.0.10")]
+    wait(futures, timeout=10)
+    assert [future.result() is not None for future in futures] == [True, False, True]
+    assert bad not in index
+    assert len(index) == 2  # 10.0.0.8 与 10.0.0.10 不再被 .9 连成一段
+
+
+def test_aggregating_target_rejects_ipv6_client(fortigate):
+    import app
+    target = app.FirewallTarget("agg", fortigate.host, "", GROUP, 600, True)
+    target.fortigate = fortigate
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(app.establish_lease(target, "2001:db8::1"))
+    assert error.value.status_code == 400
+
+
+def test_sync_skips_oversized_and_ipv6_ranges(mock_fortios, fortigate, monkeypatch):
+    import app
+    mock, host = mock_fortios
+    objects = {
+        "PROXY_small": {"type": "iprange", "start-ip": "10.1.0.1", "end-ip": "10.1.0.3"},
+        "PROXY_huge": {"type": "iprange", "start-ip": "10.0.0.0", "end-ip": "10.255.255.255"},
+        "PROXY_v6": {"type": "iprange", "start-ip": "2001:db8::1", "end-ip": "2001:db8::ff"},
+    }
+    for name, fields in objects.items():
+        mock.addresses[name] = {"name": name, "subnet": "", **fields}
+    target = app.FirewallTarget("agg", host, "", GROUP, 600, True)
+    target.fortigate = fortigate
+
+    async def run():
+        target.afortigate = app.AsyncFortigateAPI(host, "")
+        try:
+            await app.sync_target_ranges(target, set(objects), {})
+        finally:
+            await target.afortigate.client.aclose()
+
+    monkeypatch.setattr(app, "target_for", lambda client_ip: target)
+    try:
+        asyncio.run(run())
+        assert [name for _, _, name in target.ranges.index.runs()] == ["PROXY_small"]
+        assert {ip for ip, name in app.address_objects.items() if name.startswith("PROXY_")} == \
+            {"10.1.0.1", "10.1.0.2", "10.1.0.3"}
+    finally:
+        for client_ip in ("10.1.0.1", "10.1.0.2", "10.1.0.3"):
+            app.drop_lease(client_ip)
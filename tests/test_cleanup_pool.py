@@ -0,0 +1,41 @@
+import asyncio
+from dataclasses import dataclass, field
+
+import pytest
+from fastapi import HTTPException
+
+from cleanup_pool import CleanupDispatcher
+
+
+@dataclass
+class Task:
+    client_ip: str
+    is_manual: bool = True
+    futures: list = field(default_factory=list)
+
+
+def test_stop_hands_pending_and_late_tasks_to_abandon():
+    abandoned = []
+    dispatcher = CleanupDispatcher(lambda tasks: None, workers=2, abandon=abandoned.extend)
+    dispatcher.submit(Task("10.0.0.1"))  # 尚未启动，留在队列中
+    dispatcher.stop()
+    assert [task.client_ip for task in abandoned] == ["10.0.0.1"]
+    assert dispatcher.qsize() == 0
+    dispatcher.submit(Task("10.0.0.2"))
+    assert [task.client_ip for task in abandoned] == ["10.0.0.1", "10.0.0.2"]
+
+
+def test_disconnect_waiting_on_a_stopped_pool_gets_503(monkeypatch):
+    import app
+    dispatcher = CleanupDispatcher(lambda tasks: None, abandon=app.abandon_cleanup_tasks)
+    monkeypatch.setattr(app, "cleanup_pool", dispatcher)
+
+    async def run():
+        release = asyncio.ensure_future(app.release_lease("10.0.0.1"))
+        await asyncio.sleep(0)
+        await asyncio.to_thread(dispatcher.stop)  # 例如失去主节点身份
+        return await asyncio.wait_for(release, timeout=5)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
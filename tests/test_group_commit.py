@@ -0,0 +1,151 @@
+from concurrent.futures import wait
+
+from address_cache import AddressGroupCache
+from group_commit import GroupCommitEngine
+
+GROUP = "Proxied Devices"
+
+
+def create_objects(mock, names):
+    """与真实设备一样，每创建一个地址对象配置版本号都会变化"""
+    for name in names:
+        mock.addresses[name] = {"name": name, "type": "ipmask", "subnet": "10.0.0.1 255.255.255.255"}
+        mock.revision += 1
+
+
+def external_add(mock, name):
+    """模拟管理员或其他实例直接修改地址组"""
+    create_objects(mock, [name])
+    mock.groups[GROUP]["member"].append({"name": name})
+    mock.revision += 1
+
+
+def member_names(mock):
+    return {member["name"] for member in mock.groups[GROUP]["member"]}
+
+
+def test_concurrent_adds_coalesce_into_one_put(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    names = [f"PROXY_{i}" for i in range(50)]
+    create_objects(mock, names)
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.2, cache=AddressGroupCache(ttl=30))
+    engine.start()
+    try:
+        mock.reset_stats()
+        futures = [engine.submit_add(name) for name in names]
+        wait(futures, timeout=10)
+        assert all(future.result() for future in futures)
+    finally:
+        engine.stop()
+    assert mock.calls["PUT addrgrp"] == 1
+    assert member_names(mock) == set(names)
+
+
+def test_opposite_ops_for_same_name_go_to_separate_flushes(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    create_objects(mock, ["PROXY_a"])
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.2)
+    engine.start()
+    try:
+        futures = [engine.submit_add("PROXY_a"), engine.submit_remove("PROXY_a")]
+        wait(futures, timeout=10)
+        assert all(future.result() for future in futures)
+    finally:
+        engine.stop()
+    assert engine.flush_count == 2
+    assert member_names(mock) == set()
+
+
+def test_flush_after_own_write_keeps_external_changes(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    create_objects(mock, ["PROXY_a", "PROXY_b"])
+    cache = AddressGroupCache(ttl=30)
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.05, cache=cache)
+    engine.start()
+    try:
+        assert engine.submit_add("PROXY_a").result(timeout=10)
+        external_add(mock, "ADMIN_host")  # 缓存仍在有效期内
+        assert engine.submit_add("PROXY_b").result(timeout=10)
+    finally:
+        engine.stop()
+    assert member_names(mock) == {"PROXY_a", "PROXY_b", "ADMIN_host"}
+
+
+def test_revision_conflict_refetches_before_put(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    create_objects(mock, ["PROXY_a"])
+    cache = AddressGroupCache(ttl=30)
+    group = fortigate.get_address_group(GROUP)
+    cache.store_members(group["member"], group["revision"])  # 例如启动同步时缓存的成员列表
+    external_add(mock, "ADMIN_host")
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.05, cache=cache)
+    engine.start()
+    try:
+        assert engine.submit_add("PROXY_a").result(timeout=10)
+    finally:
+        engine.stop()
+    assert member_names(mock) == {"PROXY_a", "ADMIN_host"}
+    assert cache.stats()["stale_writes_avoided"] == 1
+    assert cache.stats()["external_changes"] == 1
+    assert cache.stats()["hits"] == 0
+
+
+def test_unchanged_revision_uses_cached_members(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    create_objects(mock, ["PROXY_a"])
+    cache = AddressGroupCache(ttl=30)
+    group = fortigate.get_address_group(GROUP)
+    cache.store_members(group["member"], group["revision"])
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.05, cache=cache)
+    engine.start()
+    try:
+        mock.reset_stats()
+        assert engine.submit_add("PROXY_a").result(timeout=10)
+    finally:
+        engine.stop()
+    assert mock.calls["GET addrgrp"] == 1  # 只取版本号
+    assert cache.stats()["stale_writes_avoided"] == 0
+    assert member_names(mock) == {"PROXY_a"}
+    assert cache.stats()["hits"] == 1
+
+
+def test_flush_after_own_put_uses_revision_from_put(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    create_objects(mock, ["PROXY_a", "PROXY_b"])
+    cache = AddressGroupCache(ttl=30)
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.05, cache=cache)
+    engine.start()
+    try:
+        assert engine.submit_add("PROXY_a").result(timeout=10)
+        assert engine.submit_add("PROXY_b").result(timeout=10)
+        mock.reset_stats()
+        refetches = cache.stats()["revalidations"]
+        assert engine.submit_remove("PROXY_a").result(timeout=10)
+    finally:
+        engine.stop()
+    assert mock.calls["GET addrgrp"] == 1  # 只取版本号，沿用上次 PUT 返回的版本号
+    assert mock.calls["PUT addrgrp"] == 1
+    assert cache.stats()["revalidations"] == refetches
+    assert member_names(mock) == {"PROXY_b"}
+
+
+def test_probe_backoff_after_repeated_mismatches(mock_fortios, fortigate):
+    mock, _ = mock_fortios
+    names = [f"PROXY_{i}" for i in range(4)]
+    create_objects(mock, names)
+    cache = AddressGroupCache(ttl=30)
+    group = fortigate.get_address_group(GROUP)
+    cache.store_members(group["member"], group["revision"])
+    engine = GroupCommitEngine(lambda: fortigate, GROUP, window=0.05, cache=cache)
+    engine.start()
+    try:
+        for name in names:
+            create_objects(mock, [name])  # 例如每次连接前新建地址对象，版本号总会变化
+            assert engine.submit_add(name).result(timeout=10)
+    finally:
+        engine.stop()
+    stats = cache.stats()
+    assert stats["hits"] == 0
+    assert stats["probes_skipped"] > 0
+    assert stats["stale_writes_avoided"] + stats["probes_skipped"] == len(names)
+    assert member_names(mock) == set(names)
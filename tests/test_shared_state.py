@@ -0,0 +1,117 @@
+import asyncio
+import threading
+
+import pytest
+
+from shared_state import SqliteStateBackend
+
+GROUP = "Proxied Devices"
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "shared.db")
+
+
+def test_claim_lease_keeps_first_writer(db_path):
+    worker_a, worker_b = SqliteStateBackend(db_path), SqliteStateBackend(db_path)
+    try:
+        assert worker_a.claim_lease("10.0.0.1", "PROXY_a") == "PROXY_a"
+        assert worker_b.claim_lease("10.0.0.1", "PROXY_b") == "PROXY_a"
+        assert worker_b.get_lease("10.0.0.1") == ("PROXY_a", None)
+        assert worker_a.lease_ip("PROXY_b") is None
+    finally:
+        worker_a.close()
+        worker_b.close()
+
+
+def test_concurrent_claims_agree_on_one_name(db_path):
+    workers = [SqliteStateBackend(db_path) for _ in range(8)]
+    results = [None] * len(workers)
+    start = threading.Barrier(len(workers))
+
+    def claim(i):
+        start.wait()
+        results[i] = workers[i].claim_lease("10.0.0.1", f"PROXY_{i}")
+
+    threads = [threading.Thread(target=claim, args=(i,)) for i in range(len(workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert len(set(results)) == 1
+        assert workers[0].get_lease("10.0.0.1")[0] == results[0]
+    finally:
+        for worker in workers:
+            worker.close()
+
+
+def test_losing_worker_reuses_winner_and_discards_its_object(db_path, monkeypatch, mock_fortios, fortigate):
+    import app
+    mock, _ = mock_fortios
+    for name in ("PROXY_winner", "PROXY_loser"):
+        mock.addresses[name] = {"name": name, "type": "ipmask", "subnet": "10.0.0.1 255.255.255.255"}
+        mock.groups[GROUP]["member"].append({"name": name})
+    backend = SqliteStateBackend(db_path)
+    backend.claim_lease("10.0.0.1", "PROXY_winner")  # 另一个 worker 先完成了同一IP的首次连接
+    target = app.default_target
+    monkeypatch.setattr(app, "shared_state", backend)
+    monkeypatch.setattr(target, "fortigate", fortigate)
+    target.group_commit.start()
+    try:
+        name = asyncio.run(app.record_lease(target, "10.0.0.1", "PROXY_loser"))
+    finally:
+        target.group_commit.stop()
+        backend.close()
+    assert name == "PROXY_winner"
+    assert [member["name"] for member in mock.groups[GROUP]["member"]] == ["PROXY_winner"]
+    assert "PROXY_loser" not in mock.addresses
+
+
+def test_health_reports_leader_timers_on_any_worker(db_path, monkeypatch):
+    import app
+    backend = SqliteStateBackend(db_path)
+    backend.claim_lease("10.0.0.1", "PROXY_a")
+    backend.claim_lease("10.0.0.2", "PROXY_b")
+    backend.set_expiry("10.0.0.1", 4102444800.0)  # 主节点为其安排了到期清理
+    monkeypatch.setattr(app, "shared_state", backend)
+    try:
+        assert app.health_snapshot()["active_timers"] == 1
+    finally:
+        backend.close()
+
+
+def test_request_handlers_read_shared_state_off_the_event_loop(db_path, monkeypatch):
+    import app
+    import httpx
+    from shared_state import SharedLeaseMap
+
+    class RecordingBackend(SqliteStateBackend):
+        def _read(self, sql, params=()):
+            reads.append(threading.get_ident())
+            return super()._read(sql, params)
+
+    reads = []
+    backend = RecordingBackend(db_path)
+    backend.claim_lease("127.0.0.1", "PROXY_a")
+    ready = asyncio.Event()
+    ready.set()
+    monkeypatch.setattr(app, "shared_state", backend)
+    monkeypatch.setattr(app, "address_objects", SharedLeaseMap(backend))
+    monkeypatch.setattr(app, "ready_event", ready)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app.app, client=("127.0.0.1", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            status = (await client.get("/status")).json()
+            assert status["address_name"] == "PROXY_a"
+            assert (await client.get("/ready")).json()["address_objects"] == 1
+            await app.renew_streaming_leases()
+        return threading.get_ident()
+
+    try:
+        loop_thread = asyncio.run(run())
+    finally:
+        backend.close()
+    assert reads and loop_thread not in reads
@@ -0,0 +1,109 @@
+import glob
+import gzip
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from traffic import TrafficRecorder, load_traffic
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def session_files(tmp_path):
+    return sorted(glob.glob(str(tmp_path / "traffic.*.jsonl.gz")))
+
+
+def test_recorder_round_trip(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl.gz"), {"durations": {"default": 600}}, flush_interval=0.05)
+    recorder.start()
+    now = time.time()
+    for i in range(20):
+        recorder.record("c", f"10.0.0.{i}", 200, now + i, 0.01)
+    recorder.stop()
+    headers, records = load_traffic(session_files(tmp_path))
+    assert [header["durations"] for header in headers] == [{"default": 600}]
+    assert [record.client_ip for record in records] == [f"10.0.0.{i}" for i in range(20)]
+    assert recorder.recorded == 20
+
+
+def test_each_session_writes_its_own_file(tmp_path):
+    for _ in range(2):
+        recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl.gz"), flush_interval=0.05)
+        recorder.start()
+        recorder.record("s", "10.0.0.1", 200, time.time(), 0.001)
+        recorder.stop()
+        time.sleep(1.1)  # 文件名精确到秒
+    files = session_files(tmp_path)
+    assert len(files) == 2
+    assert len(load_traffic(files)[1]) == 2
+
+
+def test_truncated_member_is_skipped(tmp_path):
+    path = tmp_path / "traffic.20240101-080000.1.jsonl.gz"
+    header = json.dumps({"format": "proxy-traffic", "version": 1, "started_at": 1000.0})
+    with open(path, "wb") as stream:
+        stream.write(gzip.compress((header + "\n").encode()))
+        stream.write(gzip.compress(b'[0, "c", "10.0.0.1", 200, 1.0]\n'))
+        stream.write(gzip.compress(b'[5, "d", "10.0.0.1", 200, 1.0]\n')[:-6])  # 写入时被杀死
+    clean = tmp_path / "traffic.20240101-090000.2.jsonl.gz"
+    clean.write_bytes(gzip.compress((header.replace("1000.0", "2000.0") + "\n" +
+                                     '[0, "s", "10.0.0.2", 200, 1.0]\n').encode()))
+    headers, records = load_traffic([str(path), str(clean)])
+    assert len(headers) == 2
+    assert [(record.op, record.client_ip) for record in records] == [("c", "10.0.0.1"), ("s", "10.0.0.2")]
+
+
+def test_killed_recorder_leaves_a_readable_file(tmp_path):
+    script = (
+        "import sys, time\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "from traffic import TrafficRecorder\n"
+        f"recorder = TrafficRecorder({str(tmp_path / 'traffic.jsonl.gz')!r}, flush_interval=0.02)\n"
+        "recorder.start()\n"
+        "print('ready', flush=True)\n"
+        "while True:\n"
+        "    recorder.record('c', '10.0.0.1', 200, time.time(), 0.001)\n"
+        "    time.sleep(0.0005)\n"
+    )
+    process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE)
+    assert process.stdout.readline().strip() == b"ready"
+    time.sleep(0.5)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    headers, records = load_traffic(session_files(tmp_path))
+    assert len(headers) == 1
+    assert len(records) > 0
+
+
+def test_events_renewal_is_recorded_and_replayed(tmp_path, monkeypatch):
+    import asyncio
+
+    import app
+    from replay import Replay
+    from traffic import RENEW, TrafficRecord
+
+    recorder = TrafficRecorder(str(tmp_path / "traffic.jsonl.gz"), flush_interval=0.05)
+    monkeypatch.setattr(app, "traffic_recorder", recorder)
+    monkeypatch.setattr(app, "is_leader", True)
+    app.address_objects["10.0.0.1"] = "PROXY_a"
+    subscriber = app.event_hub.subscribe("10.0.0.1", renew=True)
+    try:
+        # 上次续期已超过 EVENTS_RENEW_INTERVAL
+        app.schedule_cleanup("10.0.0.1", time.time() + app.default_target.duration - app.EVENTS_RENEW_INTERVAL - 1)
+        recorder.start()
+        asyncio.run(app.renew_streaming_leases())
+        recorder.stop()
+        assert app.lease_remaining("10.0.0.1") > app.default_target.duration - 5
+
+        replay = Replay(app, None, [], speedup=1, max_inflight=1)
+        assert asyncio.run(replay.send(TrafficRecord(0, RENEW, "10.0.0.1", 200, 0))) == 200
+        assert asyncio.run(replay.send(TrafficRecord(0, RENEW, "10.0.0.2", 200, 0))) == 404
+    finally:
+        app.event_hub.unsubscribe(subscriber)
+        app.lease_timer.cancel("10.0.0.1")
+        app.address_objects.pop("10.0.0.1", None)
+    records = load_traffic(session_files(tmp_path))[1]
+    assert [(record.op, record.client_ip, record.status) for record in records] == [(RENEW, "10.0.0.1", 200)]
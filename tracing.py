@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 当前上下文正在记录的调用链（未采样时为 None），以及所在的外层阶段（用于区分嵌套阶段）
+_current: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_parent: contextvars.ContextVar = contextvars.ContextVar("trace_parent", default=None)
+
+
+class Trace:
+    """
+    一次请求或后台操作的调用链：各阶段的 (名称, 开始时间, 耗时, 是否嵌套)
+
+    阶段可以在多个线程中并发写入（列表追加是原子的），开始时间为 perf_counter 的绝对值，
+    因此其他线程记录的调用链（例如批量提交的一次刷新）可以直接并入。
+    """
+
+    __slots__ = ("name", "attrs", "started", "wall", "duration", "spans")
+
+    def __init__(self, name: str, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.wall = time.time()
+        self.duration: Optional[float] = None
+        self.spans: List[Tuple[str, float, float, bool]] = []
+
+    def add(self, name: str, started: float, duration: float, nested: bool = False):
+        self.spans.append((name, started, duration, nested))
+
+    def adopt(self, other: "Trace"):
+        """并入另一条调用链的阶段（作为嵌套阶段，不重复计入总耗时的分解）"""
+        self.spans.extend((name, started, duration, True) for name, started, duration, _ in other.spans)
+
+    def breakdown(self) -> Dict[str, float]:
+        """各阶段名称的累计耗时（秒），另加 app（不属于任何顶层阶段的时间：事件循环排队、路由、序列化等）"""
+        totals: Dict[str, float] = {}
+        covered = 0.0
+        for name, _, duration, nested in list(self.spans):
+            totals[name] = totals.get(name, 0.0) + duration
+            if not nested:
+                covered += duration
+        elapsed = self.duration if self.duration is not None else time.perf_counter() - self.started
+        totals["app"] = max(0.0, elapsed - covered)
+        return totals
+
+    def server_timing(self) -> str:
+        """Server-Timing 响应头的值"""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.breakdown().items()]
+        if self.duration is not None:
+            entries.append(f"total;dur={self.duration * 1000:.1f}")
+        return ", ".join(entries)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.wall).isoformat(),
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "attrs": self.attrs,
+            "breakdown_ms": {name: round(seconds * 1000, 2) for name, seconds in self.breakdown().items()},
+            "spans": [
+                {
+                    "name": name,
+                    "offset_ms": round((started - self.started) * 1000, 2),
+                    "duration_ms": round(duration * 1000, 2),
+                    "nested": nested
+                }
+                for name, started, duration, nested in sorted(self.spans, key=lambda span: span[1])
+            ]
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    """当前上下文的调用链，未采样时为 None"""
+    return _current.get()
+
+
+@contextmanager
+def activate(trace: Optional[Trace]):
+    """把 trace 设为当前上下文的调用链（trace 为 None 时不做任何事）"""
+    if trace is None:
+        yield None
+        return
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "started", "token")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.token = _parent.set(self.name)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.started
+        _parent.reset(self.token)
+        self.trace.add(self.name, self.started, duration, _parent.get() is not None)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """记录一个阶段：with span("create"): ...；当前请求未被采样时只有一次 ContextVar 读取的开销"""
+    trace = _current.get()
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+
+def traced(name: str):
+    """装饰器：把被装饰函数（同步或异步）的执行记为一个阶段"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+class Tracer:
+    """
+    按比例采样的调用链记录器
+
+    只有被采样的请求/操作才创建 Trace，其余的热路径开销只是一次随机数判断和 ContextVar 读取。
+    每种调用链（按名称）保留耗时最长的 keep 条，供调试端点查看。线程安全。
+    """
+
+    def __init__(self, sample_rate: float = 0.01, keep: int = 20):
+        self.sample_rate = sample_rate
+        self.keep = max(1, keep)
+        self._slowest: Dict[str, list] = {}  # 名称 -> 小顶堆 [(耗时, 序号, Trace)]
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # 统计信息
+        self.sampled = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def start(self, name: str, force: bool = False, **attrs) -> Optional[Trace]:
+        """按采样率开始一条调用链（force 为 True 时总是记录），未采样时返回 None"""
+        if not force and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        self.sampled += 1
+        return Trace(name, **attrs)
+
+    def finish(self, trace: Trace):
+        """结束调用链，并放入该名称的最慢记录中"""
+        trace.duration = time.perf_counter() - trace.started
+        entry = (trace.duration, next(self._seq), trace)
+        with self._lock:
+            heap = self._slowest.setdefault(trace.name, [])
+            if len(heap) < self.keep:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    @contextmanager
+    def trace(self, name: str, force: bool = False, **attrs):
+        """开始、激活并在结束时记录一条调用链，产出 Trace（未采样时为 None）"""
+        trace = self.start(name, force, **attrs)
+        if trace is None:
+            yield None
+            return
+        try:
+            with activate(trace):
+                yield trace
+        finally:
+            self.finish(trace)
+
+    def slowest(self, names: Optional[Iterable[str]] = None) -> Dict[str, List[dict]]:
+        """各名称耗时最长的调用链（从慢到快）"""
+        with self._lock:
+            heaps = {name: list(heap) for name, heap in self._slowest.items() if names is None or name in names}
+        return {
+            name: [trace.to_dict() for _, _, trace in sorted(heap, reverse=True)]
+            for name, heap in heaps.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self._slowest.clear()
+
+
+class TracingMiddleware:
+    """
+    ASGI 中间件：对 paths 中的请求按采样率记录调用链，并在响应中加入 Server-Timing 头。
+    未采样的请求直接交给应用处理，不包装 send。
+    """
+
+    def __init__(self, app, tracer: Tracer, paths: Sequence[str] = ()):
+        self.app = app
+        self.tracer = tracer
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        client = scope.get("client")
+        trace = self.tracer.start(f"{scope['method']} {scope['path']}", client_ip=client[0] if client else None)
+        if trace is None:
+            return await self.app(scope, receive, send)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                trace.attrs["status"] = message["status"]
+                trace.duration = time.perf_counter() - trace.started
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            with activate(trace):
+                await self.app(scope, receive, send_with_timing)
+        finally:
+            self.tracer.finish(trace)
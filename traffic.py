@@ -0,0 +1,197 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "proxy-traffic"
+VERSION = 1
+_STOP = object()  # 写线程队列中的停止标记
+_READ_CHUNK = 1 << 16
+
+# 端点 <-> 记录中的操作代码
+OPERATIONS = {("POST", "/connect"): "c", ("POST", "/disconnect"): "d", ("GET", "/status"): "s"}
+ENDPOINTS = {code: endpoint for endpoint, code in OPERATIONS.items()}
+# 打开了 /events?renew=true 推送连接的IP由服务端定时续期，没有对应的请求，由续期任务单独记录
+RENEW = "r"
+
+
+class TrafficRecord(NamedTuple):
+    """一次被记录的请求"""
+    at: float  # 请求开始的时间戳
+    op: str  # c / d / s / r
+    client_ip: str
+    status: int
+    duration: float  # 原始响应耗时（秒）
+
+
+class TrafficRecorder:
+    """
+    请求流量记录器
+
+    把 /connect、/disconnect、/status 请求以及推送连接的服务端续期（RENEW）的时间、客户端IP、状态码和耗时写入 gzip 压缩的 JSON 行文件：
+    每次启动（每个 worker）写入单独的会话文件（见 session_path），先写一行会话头（开始时间、各目标的租约时长等），
+    之后每个请求一行 [相对会话开始的毫秒数, 操作代码, IP, 状态码, 耗时毫秒]。
+    record 只把记录放入队列，由后台线程每隔 flush_interval 秒写入一个完整的 gzip 成员并落盘，不阻塞请求；
+    进程被杀死时最多丢失最后一个间隔的记录，之前写入的部分仍可读取。
+    """
+
+    def __init__(self, path: str, metadata: Optional[dict] = None, flush_interval: float = 1.0):
+        self.path = path  # 记录文件的基础路径，实际写入 session_path 返回的文件
+        self.enabled = True
+        self.session_file: Optional[str] = None
+        self.metadata = metadata or {}
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at = time.time()
+        # 统计信息
+        self.recorded = 0
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._started_at = time.time()
+        self.session_file = session_path(self.path, self._started_at)
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止写线程，队列中剩余的记录写入后返回"""
+        if self._thread:
+            self._queue.put(_STOP)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def record(self, op: str, client_ip: str, status: int, started_at: float, duration: float):
+        if self.enabled:
+            self._queue.put((op, client_ip, status, started_at, duration))
+
+    @staticmethod
+    def _write(stream, lines: List[str]):
+        """写入一个完整的 gzip 成员并落盘"""
+        stream.write(gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))
+        stream.flush()
+        os.fsync(stream.fileno())
+
+    def _run(self):
+        header = {"format": FORMAT, "version": VERSION, "started_at": self._started_at, **self.metadata}
+        try:
+            with open(self.session_file, "ab") as stream:
+                self._write(stream, [json.dumps(header, ensure_ascii=False)])
+                stopping = False
+                while not stopping:
+                    try:
+                        items = [self._queue.get(timeout=self.flush_interval)]
+                    except queue.Empty:
+                        continue
+                    while True:
+                        try:
+                            items.append(self._queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    lines = []
+                    for item in items:
+                        if item is _STOP:
+                            stopping = True
+                            continue
+                        op, client_ip, status, started_at, duration = item
+                        offset = round((started_at - self._started_at) * 1000, 1)
+                        lines.append(json.dumps([offset, op, client_ip, status, round(duration * 1000, 2)]))
+                    if lines:
+                        self._write(stream, lines)
+                        self.recorded += len(lines)
+        except Exception as e:
+            logger.error(f"流量记录写入失败: {str(e)}")
+
+
+def read_lines(path: str) -> Iterator[str]:
+    """
+    逐个解压记录文件中的 gzip 成员并产出其中的行。
+    最后一个成员不完整（写入时进程被杀死）或数据损坏时记录警告并停止，之前完整的成员照常产出
+    """
+    decompressor, parts, pending = zlib.decompressobj(wbits=31), [], False
+    with open(path, "rb") as stream:
+        data = stream.read(_READ_CHUNK)
+        while data:
+            pending = True
+            try:
+                parts.append(decompressor.decompress(data))
+            except zlib.error as e:
+                logger.warning(f"记录文件 {path} 已损坏，忽略其后的内容: {str(e)}")
+                return
+            if decompressor.eof:
+                yield from b"".join(parts).decode("utf-8").splitlines()
+                data = decompressor.unused_data
+                decompressor, parts, pending = zlib.decompressobj(wbits=31), [], False
+                if data:
+                    continue
+            data = stream.read(_READ_CHUNK)
+    if pending:
+        logger.warning(f"记录文件 {path} 的最后一段不完整（写入时进程退出），已忽略。")
+
+
+def load_traffic(paths: Iterable[str]) -> Tuple[List[dict], List[TrafficRecord]]:
+    """读取一个或多个记录文件（各次会话、各 worker 的文件），返回 (各次会话的会话头, 按请求时间排序的记录)"""
+    headers: List[dict] = []
+    records: List[TrafficRecord] = []
+    for path in paths:
+        started_at = None
+        for line in read_lines(path):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, dict):
+                headers.append(entry)
+                started_at = entry["started_at"]
+            elif started_at is not None:
+                offset, op, client_ip, code, duration = entry
+                records.append(TrafficRecord(started_at + offset / 1000, op, client_ip, code, duration / 1000))
+    records.sort(key=lambda record: record.at)
+    return headers, records
+
+
+def session_path(path: str, started_at: float) -> str:
+    """
+    一次会话（一次启动、一个 worker）的记录文件：文件名中加入开始时间和进程号，
+    例如 traffic.20240101-080000.1234.jsonl.gz；每次会话写入新文件，不会接在上次异常退出留下的不完整数据之后
+    """
+    directory, filename = os.path.split(path)
+    stem, dot, suffix = filename.partition(".")
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(started_at))
+    return os.path.join(directory, f"{stem}.{stamp}.{os.getpid()}{dot}{suffix}")
+
+
+class TrafficRecorderMiddleware:
+    """ASGI 中间件：记录 OPERATIONS 中端点的请求，响应开始时取状态码，响应结束时计算耗时"""
+
+    def __init__(self, app, recorder: TrafficRecorder, operations: Optional[Dict[tuple, str]] = None):
+        self.app = app
+        self.recorder = recorder
+        self.operations = operations or OPERATIONS
+
+    async def __call__(self, scope, receive, send):
+        op = self.operations.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if op is None:
+            return await self.app(scope, receive, send)
+        client = scope.get("client")
+        started_at, started = time.time(), time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.recorder.record(op, client[0] if client else "", status_code, started_at,
+                                 time.perf_counter() - started)